@@ -5,15 +5,36 @@ import zipfile
 import base64
 import shutil
 import datetime
-
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import JSONResponse
+import hashlib
+import asyncio
+import enum
+import functools
+import json
+from dataclasses import asdict
+from typing import Callable
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    status,
+    UploadFile,
+    File,
+    Form,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import docker
 import psutil
 
 from app.api.deps import get_server_key
 from app.core.config import settings
+from app.core import bundle_cache, build_cache, container_index, inventory, snapshots
+from app.core.gc_queue import gc_queue
+from app.core.metrics import FIELDS, metrics
+from app.core.scheduler import scheduler
 
 router = APIRouter(
     prefix="/agent",
@@ -21,13 +42,11 @@ router = APIRouter(
     dependencies=[Depends(get_server_key)],  # protect all agent routes
 )
 
-# Initialize Docker client
-client = docker.from_env()
-
-# Base dir for all compose projects
-WORK_DIR = "/opt/containers"
+WORK_DIR = inventory.WORK_DIR
 os.makedirs(WORK_DIR, exist_ok=True)
 
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
 
 # ─── Schemas ────────────────────────────────────────────────────────────
 
@@ -36,6 +55,8 @@ class ContainerInfo(BaseModel):
     name: str
     image: str
     status: str
+    project: str | None = None   # compose project, i.e. the environment name
+    service: str | None = None
 
 
 class StartContainerReq(BaseModel):
@@ -44,134 +65,485 @@ class StartContainerReq(BaseModel):
     vpn_conf_base64: str
 
 
+class StartFromBundleReq(BaseModel):
+    name: str
+    digest: str
+    vpn_conf_base64: str
+
+
 class ActionResponse(BaseModel):
     name: str
     status: str
+    cache_hit: bool | None = None
+    operation_id: str | None = None
+    services: list[str] | None = None   # reset: the services that were recreated
+
+
+class OperationInfo(BaseModel):
+    id: str
+    kind: str
+    name: str
+    priority: int
+    build: bool
+    state: str
+    error: str | None = None
+    created_at: datetime.datetime
+    started_at: datetime.datetime | None = None
+    finished_at: datetime.datetime | None = None
+    lines: int
+
+
+class RestartMode(str, enum.Enum):
+    fast = "fast"        # docker compose restart, no build
+    rebuild = "rebuild"  # rebuild images & recreate services
 
 
 # ─── Existing: list containers ──────────────────────────────────────────
 
+def _info(e: container_index.ContainerEntry) -> ContainerInfo:
+    return ContainerInfo(
+        id=e.id,
+        name=e.name,
+        image=e.image,
+        status=e.status,
+        project=e.project,
+        service=e.service,
+    )
+
+
 @router.get("/containers", response_model=list[ContainerInfo])
 def list_containers():
-    ctrs = client.containers.list()
-    return [
-        ContainerInfo(
-            id=c.id,
-            name=c.name,
-            image=c.image.tags[0] if c.image.tags else "",
-            status=c.status,
-        ) for c in ctrs
-    ]
+    # Served from the event-driven index, including stopped containers so
+    # the manager can tell "exited" from "gone"
+    return [_info(e) for e in container_index.container_index.entries()]
 
 
-# ─── New: start from Docker‐Compose + VPN conf ──────────────────────────
+@router.get("/containers/{name}", response_model=list[ContainerInfo])
+def get_container(name: str):
+    """The containers of environment (compose project) `name`."""
+    entries = container_index.container_index.project(name)
+    if not entries:
+        raise HTTPException(status_code=404, detail="Container not found")
+    return [_info(e) for e in entries]
 
-@router.post(
-    "/containers",
-    response_model=ActionResponse,
-    status_code=status.HTTP_201_CREATED,
-    summary="Unpack & docker compose up -d a new environment"
-)
-def start_container(req: StartContainerReq):
-    work_dir = os.path.join(WORK_DIR, req.name)
 
-    # 1) Remove old project folder if exists
+# ─── New: start from Docker‐Compose + VPN conf ──────────────────────────
+
+def _fresh_work_dir(name: str, stale: bool = False) -> str:
+    # A removal claimed from the GC queue is done here, before the new start
+    if stale:
+        remove_environment(name)
+    work_dir = os.path.join(WORK_DIR, name)
     if os.path.exists(work_dir):
         shutil.rmtree(work_dir)
     os.makedirs(work_dir)
+    return work_dir
 
-    # 2) Extract the Docker Compose ZIP
-    ctx_zip = os.path.join(work_dir, "context.zip")
-    with open(ctx_zip, "wb") as f:
-        f.write(base64.b64decode(req.docker_zip_base64))
-    with zipfile.ZipFile(ctx_zip, "r") as z:
-        z.extractall(work_dir)
-    os.remove(ctx_zip)
-
-    # 3) Write the VPN profile into the project
-    vpn_path = os.path.join(work_dir, "vpn.ovpn")
-    with open(vpn_path, "wb") as f:
-        f.write(base64.b64decode(req.vpn_conf_base64))
 
-    # 4) Launch with Docker Compose
+def _compose_up(work_dir: str) -> bool:
+    """Build what the cache lacks, then `up -d`. Returns the cache hit flag."""
     try:
-        subprocess.run(
-            ["docker", "compose", "up", "-d"],
-            cwd=work_dir,
-            check=True
-        )
+        return build_cache.up(work_dir)
+    except build_cache.ComposeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except subprocess.CalledProcessError as e:
         raise HTTPException(
             status_code=500,
             detail=f"'docker compose up' failed: {e}"
         )
 
-    return ActionResponse(name=req.name, status="started")
 
+def _snapshot_later(name: str):
+    """Queue a snapshot behind the operation that (re)created the environment."""
+    scheduler.submit("snapshot", name, functools.partial(snapshots.take, name))
+
+
+async def _start(name: str, fill: Callable[[str], None], priority: int):
+    """
+    Run a start operation: a fresh work dir, `fill` it, then compose up.
+    Call it only once the request is validated: it claims a removal of
+    `name` waiting in the GC queue, and if the operation ends without having
+    done that removal, the job goes back on the queue.
+    """
+    stale = await gc_queue.claim(name)
+    removed = False
+
+    def start() -> bool:
+        nonlocal removed
+        work_dir = _fresh_work_dir(name, stale)
+        removed = True
+        fill(work_dir)
+        return _compose_up(work_dir)
+
+    async def requeue():
+        # Whether or not anyone still waits on the request
+        try:
+            await op.wait()
+        except (Exception, asyncio.CancelledError):
+            pass
+        if not removed:
+            await gc_queue.enqueue(name)
+
+    op = scheduler.submit("start", name, start, build=True, priority=priority)
+    if stale:
+        asyncio.create_task(requeue())
+    return op, await op.wait()
+
+
+def _sha256_file(fileobj) -> str:
+    digest = hashlib.sha256()
+    while chunk := fileobj.read(CHUNK_SIZE):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
 
-# ─── New: rebuild & restart ────────────────────────────────────────────
 
 @router.post(
-    "/containers/{name}/restart",
+    "/containers",
     response_model=ActionResponse,
-    summary="Rebuild & restart an existing environment"
+    status_code=status.HTTP_201_CREATED,
+    summary="Unpack & docker compose up -d a new environment"
 )
-def restart_container(name: str):
-    work_dir = os.path.join(WORK_DIR, name)
-    if not os.path.isdir(work_dir):
-        raise HTTPException(status_code=404, detail="Environment not found")
+async def start_container(req: StartContainerReq, priority: int = 0):
+    def fill(work_dir: str):
+        # 1) Extract the Docker Compose ZIP
+        ctx_zip = os.path.join(work_dir, "context.zip")
+        with open(ctx_zip, "wb") as f:
+            f.write(base64.b64decode(req.docker_zip_base64))
+        with zipfile.ZipFile(ctx_zip, "r") as z:
+            z.extractall(work_dir)
+        os.remove(ctx_zip)
+
+        # 2) Write the VPN profile into the project
+        vpn_path = os.path.join(work_dir, "vpn.ovpn")
+        with open(vpn_path, "wb") as f:
+            f.write(base64.b64decode(req.vpn_conf_base64))
+
+    op, cache_hit = await _start(req.name, fill, priority)
+    _snapshot_later(req.name)
+    return ActionResponse(
+        name=req.name, status="started", cache_hit=cache_hit, operation_id=op.id
+    )
+
 
+@router.post(
+    "/containers/upload",
+    response_model=ActionResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Stream a bundle (multipart) & docker compose up -d a new environment"
+)
+async def start_container_upload(
+    name: str = Form(...),
+    bundle_sha256: str | None = Form(None),
+    bundle: UploadFile = File(...),
+    vpn_conf: UploadFile = File(...),
+    priority: int = 0,
+):
+    """
+    Multipart variant of `POST /containers`. The bundle part is spooled to
+    disk by the form parser and extracted member by member straight from
+    that file, so memory use does not grow with the bundle size.
+    """
+    # 1) Verify the bundle before queueing, let alone touching the work dir
+    if bundle_sha256:
+        digest = await asyncio.to_thread(_sha256_file, bundle.file)
+        if digest != bundle_sha256.lower():
+            raise HTTPException(status_code=400, detail="Bundle checksum mismatch")
+
+    def fill(work_dir: str):
+        # 2) Extract the Docker Compose ZIP
+        try:
+            with zipfile.ZipFile(bundle.file, "r") as z:
+                z.extractall(work_dir)
+        except zipfile.BadZipFile:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise HTTPException(status_code=400, detail="Bundle is not a valid ZIP")
+
+        # 3) Write the VPN profile into the project
+        vpn_path = os.path.join(work_dir, "vpn.ovpn")
+        with open(vpn_path, "wb") as f:
+            shutil.copyfileobj(vpn_conf.file, f)
+
+    op, cache_hit = await _start(name, fill, priority)
+    _snapshot_later(name)
+    return ActionResponse(name=name, status="started", cache_hit=cache_hit, operation_id=op.id)
+
+
+# ─── Digest-keyed bundle cache ─────────────────────────────────────────
+
+def _checked_digest(digest: str) -> str:
+    digest = digest.lower()
+    if not bundle_cache.valid_digest(digest):
+        raise HTTPException(status_code=400, detail="Digest must be a sha256 hex string")
+    return digest
+
+
+@router.head(
+    "/bundles/{digest}",
+    summary="Check whether a bundle is in the local cache"
+)
+def has_bundle(digest: str):
+    if not bundle_cache.lookup(_checked_digest(digest)):
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    return Response(status_code=status.HTTP_200_OK)
+
+
+@router.put(
+    "/bundles/{digest}",
+    status_code=status.HTTP_201_CREATED,
+    summary="Stream a bundle (raw body) into the local cache"
+)
+async def put_bundle(digest: str, request: Request):
+    digest = _checked_digest(digest)
+    if bundle_cache.lookup(digest):
+        return Response(status_code=status.HTTP_200_OK)
+
+    writer = await asyncio.to_thread(bundle_cache.BundleWriter, digest)
     try:
-        # Rebuild images
-        subprocess.run(
-            ["docker", "compose", "build"],
-            cwd=work_dir,
-            check=True
-        )
-        # Restart services
-        subprocess.run(
-            ["docker", "compose", "up", "-d"],
-            cwd=work_dir,
-            check=True
-        )
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Restart failed: {e}"
-        )
+        async for chunk in request.stream():
+            await asyncio.to_thread(writer.write, chunk)
+        await asyncio.to_thread(writer.commit)
+    except bundle_cache.DigestMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except bundle_cache.BundleTooLarge as e:
+        writer.abort()
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        writer.abort()
+        raise
+    return Response(status_code=status.HTTP_201_CREATED)
 
-    return ActionResponse(name=name, status="restarted")
 
+@router.post(
+    "/containers/from-bundle",
+    response_model=ActionResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Unpack a cached bundle & docker compose up -d a new environment"
+)
+async def start_container_from_bundle(req: StartFromBundleReq, priority: int = 0):
+    digest = _checked_digest(req.digest)
+    if not bundle_cache.lookup(digest):
+        raise HTTPException(status_code=404, detail="Bundle not cached")
+
+    def fill(work_dir: str):
+        # 1) Extract the cached ZIP into the fresh project folder; it may
+        # have been evicted while the operation was queued
+        path = bundle_cache.lookup(digest)
+        if not path:
+            raise HTTPException(status_code=404, detail="Bundle not cached")
+        with zipfile.ZipFile(path, "r") as z:
+            z.extractall(work_dir)
+
+        # 2) Write the VPN profile into the project
+        vpn_path = os.path.join(work_dir, "vpn.ovpn")
+        with open(vpn_path, "wb") as f:
+            f.write(base64.b64decode(req.vpn_conf_base64))
+
+    op, cache_hit = await _start(req.name, fill, priority)
+    _snapshot_later(req.name)
+    return ActionResponse(
+        name=req.name, status="started", cache_hit=cache_hit, operation_id=op.id
+    )
+
+
+# ─── New: restart / rebuild ────────────────────────────────────────────
+
+@router.post(
+    "/containers/{name}/restart",
+    response_model=ActionResponse,
+    summary="Restart (fast) or rebuild & recreate an existing environment"
+)
+async def restart_container(
+    name: str, mode: RestartMode = RestartMode.fast, priority: int = 0
+):
+    def restart() -> bool:
+        work_dir = os.path.join(WORK_DIR, name)
+        if not os.path.isdir(work_dir):
+            raise HTTPException(status_code=404, detail="Environment not found")
+
+        try:
+            if mode == RestartMode.fast:
+                # Restart services in place; images are untouched
+                build_cache.run_compose(work_dir, "restart")
+                return True
+            # Rebuild images and recreate services
+            return build_cache.up(work_dir, force=True, recreate=True)
+        except (subprocess.CalledProcessError, build_cache.ComposeError) as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Restart failed: {e}"
+            )
+
+    # Only a rebuild needs a build slot
+    rebuild = mode == RestartMode.rebuild
+    op, cache_hit = await scheduler.run(
+        "rebuild" if rebuild else "restart", name, restart, build=rebuild, priority=priority
+    )
+    if rebuild:
+        # New images: the old snapshot no longer describes the environment
+        _snapshot_later(name)
+    return ActionResponse(
+        name=name,
+        status="rebuilt" if rebuild else "restarted",
+        cache_hit=cache_hit,
+        operation_id=op.id,
+    )
+
+
+# ─── Reset to snapshot ─────────────────────────────────────────────────
+
+@router.post(
+    "/containers/{name}/reset",
+    response_model=ActionResponse,
+    summary="Put an environment back to the snapshot taken after it started"
+)
+async def reset_container(name: str, force: bool = False):
+    """
+    Recreates only the services whose filesystem or volumes drifted from
+    the snapshot, from their committed images; nothing is built. `force`
+    recreates every service.
+    """
+    def reset() -> list[str]:
+        work_dir = os.path.join(WORK_DIR, name)
+        if not os.path.isdir(work_dir):
+            raise HTTPException(status_code=404, detail="Environment not found")
+
+        try:
+            return snapshots.reset(name, work_dir, force=force)
+        except snapshots.SnapshotError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except (
+            subprocess.CalledProcessError,
+            build_cache.ComposeError,
+            docker.errors.DockerException,
+        ) as e:
+            raise HTTPException(status_code=500, detail=f"Reset failed: {e}")
+
+    op, services = await scheduler.run("reset", name, reset)
+    return ActionResponse(name=name, status="reset", services=services, operation_id=op.id)
+
+
+# ─── Down & remove (background) ────────────────────────────────────────
+
+def remove_environment(name: str):
+    """Blocking: down environment `name` and delete its work dir and snapshot."""
+    work_dir = os.path.join(WORK_DIR, name)
+    if os.path.isdir(work_dir):
+        try:
+            # Shut down and remove volumes but keep images for build cache
+            build_cache.run_compose(work_dir, "down", "--volumes")
+        except build_cache.ComposeError:
+            pass  # never got a compose file, so nothing of it is running
+
+        # Then delete the directory
+        shutil.rmtree(work_dir)
+    snapshots.drop(name)
 
-# ─── New: down & remove ─────────────────────────────────────────────────
 
 @router.delete(
     "/containers/{name}",
     response_model=ActionResponse,
-    summary="Down & remove the environment"
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Queue the environment for down & removal"
 )
-def remove_container(name: str):
-    work_dir = os.path.join(WORK_DIR, name)
-    if not os.path.isdir(work_dir):
+async def remove_container(name: str):
+    """
+    Records the removal in the durable GC queue and returns; the
+    environment is downed and deleted in the background.
+    """
+    if not os.path.isdir(os.path.join(WORK_DIR, name)) and not gc_queue.has(name):
         raise HTTPException(status_code=404, detail="Environment not found")
 
-    try:
-        # Shut down and remove volumes but keep images for build cache
-        subprocess.run(
-            ["docker", "compose", "down", "--volumes"],
-            cwd=work_dir,
-            check=True
-        )
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"'docker compose down' failed: {e}"
-        )
+    await gc_queue.enqueue(name)
+    return ActionResponse(name=name, status="queued")
 
-    # Finally, delete the directory
-    shutil.rmtree(work_dir)
 
-    return ActionResponse(name=name, status="removed")
+@router.get("/gc", summary="Removal queue state")
+async def gc_state():
+    return {
+        **gc_queue.stats(),
+        "jobs": [asdict(job) for job in gc_queue.jobs()],
+    }
+
+
+# ─── Operations ────────────────────────────────────────────────────────
+
+@router.get(
+    "/operations",
+    response_model=list[OperationInfo],
+    summary="Queued, running and recently finished operations"
+)
+async def list_operations(name: str | None = None):
+    return [op.info() for op in scheduler.operations(name)]
+
+
+@router.get(
+    "/operations/{op_id}",
+    response_model=OperationInfo,
+    summary="State of one operation"
+)
+async def get_operation(op_id: str):
+    op = scheduler.get(op_id)
+    if not op:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return op.info()
+
+
+@router.get(
+    "/operations/{op_id}/stream",
+    summary="Follow an operation's build and compose output (SSE)"
+)
+async def stream_operation(op_id: str, request: Request):
+    """
+    Replays the operation's log and then follows it live, one `log` event
+    per line (the event id is the line number), and ends with a `done`
+    event carrying the operation's final state. A client that reconnects
+    with `Last-Event-ID` picks up after that line.
+    """
+    op = scheduler.get(op_id)
+    if not op:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    last = request.headers.get("last-event-id", "")
+    start = int(last) + 1 if last.isdigit() else 0
+
+    async def events():
+        async for i, line in op.follow(start):
+            yield f"id: {i}\nevent: log\ndata: {line}\n\n"
+        info = OperationInfo(**op.info()).model_dump(mode="json")
+        yield f"event: done\ndata: {json.dumps(info)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ─── Inventory ─────────────────────────────────────────────────────────
+
+@router.get("/inventory", summary="Every environment on this host and its state")
+def get_inventory():
+    envs = inventory.environments()
+    return {"digest": inventory.digest(envs), "environments": envs}
+
+
+# ─── Metrics ───────────────────────────────────────────────────────────
+
+@router.get("/metrics", summary="Per-environment resource usage from cgroups")
+def get_metrics(name: str | None = None, since: float | None = None):
+    """
+    Latest sample of every environment (or just `name`); with `since` (a
+    unix timestamp), also every buffered sample taken after it. Samples are
+    rows in `fields` order.
+    """
+    body = {
+        "fields": ["t", *FIELDS],
+        "collector": metrics.stats(),
+        "latest": metrics.latest(name),
+    }
+    if since is not None:
+        body["samples"] = metrics.history(name, since)
+    return body
 
 
 # ─── Existing: health check ─────────────────────────────────────────────
@@ -179,12 +551,15 @@ def remove_container(name: str):
 @router.get("/health", status_code=status.HTTP_200_OK)
 def health():
     uptime = datetime.datetime.now() - datetime.datetime.fromtimestamp(psutil.boot_time())
-    running = len(client.containers.list())
+    running = container_index.container_index.running_count()
     mem = psutil.virtual_memory()
     cpu = psutil.cpu_percent(interval=0.5)
     return {
         "uptime_seconds": int(uptime.total_seconds()),
         "running_containers": running,
         "mem_percent": mem.percent,
-        "cpu_percent": cpu
+        "cpu_percent": cpu,
+        "operations": scheduler.stats(),
+        "gc": gc_queue.stats(),
+        "metrics": metrics.stats(),
     }
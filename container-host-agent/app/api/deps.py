@@ -1,6 +1,12 @@
-from fastapi import Header
+from fastapi import Header, HTTPException
+from app.core.prometheus import AUTH
 from app.core.security import validate_server_token
 
 def get_server_key(x_server_key: str = Header(..., alias="X-Server-Key")):
-    validate_server_token(x_server_key)
+    try:
+        validate_server_token(x_server_key)
+    except HTTPException:
+        AUTH.labels("rejected").inc()
+        raise
+    AUTH.labels("ok").inc()
     return x_server_key
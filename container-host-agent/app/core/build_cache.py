@@ -0,0 +1,336 @@
+# Build cache: images of `build:` services are tagged mlab-build:<fingerprint
+# of the build context> and pinned via an override compose file, so a context
+# that was built once on this host is never built again. vpn.ovpn is left out
+# of the fingerprint and bind-mounted over the path(s) the Dockerfile copies it
+# to; if that path can't be worked out, the profile is fingerprinted too.
+import hashlib
+import json
+import os
+import posixpath
+import shlex
+import socket
+import subprocess
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cache
+
+import docker
+import yaml
+
+from app.core import scheduler
+from app.core.config import settings
+from app.core.inventory import WORK_DIR
+from app.core.prometheus import timed_compose
+
+IMAGE_REPO = "mlab-build"
+OVERRIDE_FILE = ".mlab-compose.override.yml"
+VPN_FILE = "vpn.ovpn"
+VPN_PLACEHOLDER = b"# placeholder: the real profile is bind-mounted at runtime\n"
+COMPOSE_FILES = (
+    "compose.yaml",
+    "compose.yml",
+    "docker-compose.yaml",
+    "docker-compose.yml",
+)
+
+_docker = docker.DockerClient(base_url=settings.docker_socket)
+
+
+class ComposeError(Exception):
+    pass
+
+
+@dataclass
+class ServiceBuild:
+    service: str
+    context: str
+    image: str
+    vpn_targets: list[str] = field(default_factory=list)
+    cached: bool = False
+
+
+@dataclass
+class BuildPlan:
+    work_dir: str
+    services: list[ServiceBuild]
+
+    @property
+    def cache_hit(self) -> bool:
+        return all(s.cached for s in self.services)
+
+    @property
+    def missing(self) -> list[str]:
+        return [s.service for s in self.services if not s.cached]
+
+
+def compose_file(work_dir: str) -> str:
+    for name in COMPOSE_FILES:
+        if os.path.exists(os.path.join(work_dir, name)):
+            return name
+    raise ComposeError("No docker-compose file in environment")
+
+
+def compose_cmd(work_dir: str, *args: str, overrides: tuple[str, ...] = ()) -> list[str]:
+    """
+    `docker compose` with the project's file plus our override, if written,
+    and then any `overrides` files.
+    """
+    cmd = ["docker", "compose", "-f", compose_file(work_dir)]
+    if os.path.exists(os.path.join(work_dir, OVERRIDE_FILE)):
+        cmd += ["-f", OVERRIDE_FILE]
+    for path in overrides:
+        cmd += ["-f", path]
+    return cmd + list(args)
+
+
+def run_compose(work_dir: str, *args: str, overrides: tuple[str, ...] = ()):
+    """Run `docker compose`; inside an operation, its output goes to the operation's log."""
+    cmd = compose_cmd(work_dir, *args, overrides=overrides)
+    sink = scheduler.output.get()
+    with timed_compose(args[0]):
+        if sink is None:
+            subprocess.run(cmd, cwd=work_dir, check=True)
+            return
+        sink(f"$ {shlex.join(cmd)}")
+        with subprocess.Popen(
+            cmd,
+            cwd=work_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        ) as proc:
+            for line in proc.stdout:
+                sink(line.rstrip("\n"))
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+# ─── Fingerprinting ─────────────────────────────────────────────────────
+
+def _find_dockerfile(context: str, dockerfile: str | None) -> str | None:
+    candidates = [dockerfile] if dockerfile else ["Dockerfile", "dockerfile"]
+    for name in candidates:
+        path = os.path.join(context, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _instructions(dockerfile_path: str):
+    """Yield (INSTRUCTION, args) with line continuations joined."""
+    with open(dockerfile_path, encoding="utf-8", errors="replace") as f:
+        buf = ""
+        for raw in f:
+            line = raw.rstrip("\n")
+            if not buf and line.lstrip().startswith("#"):
+                continue
+            if line.endswith("\\"):
+                buf += line[:-1] + " "
+                continue
+            line = (buf + line).strip()
+            buf = ""
+            if line:
+                instr, _, rest = line.partition(" ")
+                yield instr.upper(), rest.strip()
+
+
+def _copy_args(rest: str) -> list[str] | None:
+    if rest.startswith("["):
+        try:
+            return json.loads(rest)
+        except ValueError:
+            return None
+    try:
+        return shlex.split(rest)
+    except ValueError:
+        return None
+
+
+def vpn_targets(dockerfile_path: str) -> list[str] | None:
+    """
+    Paths inside the image where the Dockerfile places vpn.ovpn.
+    Returns None if the file is used in a way we cannot bind-mount over.
+    """
+    workdir = "/"
+    targets = []
+    for instr, rest in _instructions(dockerfile_path):
+        if instr == "WORKDIR":
+            workdir = posixpath.join(workdir, rest.strip("\"'"))
+            continue
+        if instr in ("COPY", "ADD"):
+            args = _copy_args(rest)
+            if args is None:
+                return None
+            flags = [a for a in args if a.startswith("--")]
+            paths = [a for a in args if not a.startswith("--")]
+            if any(f.startswith("--from") for f in flags) or len(paths) < 2:
+                continue
+            srcs, dest = paths[:-1], paths[-1]
+            trailing = dest.endswith("/")
+            dest = posixpath.normpath(posixpath.join(workdir, dest)) + ("/" if trailing else "")
+            for src in srcs:
+                src = src.rstrip("/") or "."
+                if src in (VPN_FILE, f"./{VPN_FILE}"):
+                    if dest.endswith("/") or len(srcs) > 1:
+                        targets.append(posixpath.join(dest, VPN_FILE))
+                    else:
+                        targets.append(dest)
+                elif src == ".":
+                    targets.append(posixpath.join(dest, VPN_FILE))
+            continue
+        if VPN_FILE in rest:
+            return None
+    return targets
+
+
+def _hash_context(context: str, skip_vpn: bool) -> str:
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(context):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, context)
+            if rel == OVERRIDE_FILE or (skip_vpn and rel == VPN_FILE):
+                continue
+            digest.update(rel.encode() + b"\0")
+            with open(path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _build_spec(svc: dict) -> dict | None:
+    build = svc.get("build")
+    if build is None:
+        return None
+    if isinstance(build, str):
+        return {"context": build}
+    return dict(build)
+
+
+def _image_exists(tag: str) -> bool:
+    try:
+        _docker.images.get(tag)
+        return True
+    except docker.errors.ImageNotFound:
+        return False
+
+
+def plan(work_dir: str) -> BuildPlan:
+    """Fingerprint every built service and check which images already exist."""
+    with open(os.path.join(work_dir, compose_file(work_dir))) as f:
+        compose = yaml.safe_load(f) or {}
+
+    services = []
+    for name, svc in (compose.get("services") or {}).items():
+        spec = _build_spec(svc or {})
+        if spec is None:
+            continue
+        context = os.path.normpath(os.path.join(work_dir, spec.get("context", ".")))
+        dockerfile = _find_dockerfile(context, spec.get("dockerfile"))
+        targets = vpn_targets(dockerfile) if dockerfile else []
+        cacheable = targets is not None
+
+        digest = hashlib.sha256()
+        digest.update(_hash_context(context, skip_vpn=cacheable).encode())
+        digest.update((os.path.relpath(dockerfile, context) if dockerfile else "").encode())
+        digest.update(json.dumps(spec.get("args") or {}, sort_keys=True).encode())
+        digest.update(str(spec.get("target") or "").encode())
+        image = f"{IMAGE_REPO}:{digest.hexdigest()}"
+
+        services.append(ServiceBuild(
+            service=name,
+            context=context,
+            image=image,
+            vpn_targets=targets or [],
+            cached=_image_exists(image),
+        ))
+    return BuildPlan(work_dir=work_dir, services=services)
+
+
+@cache
+def _host_work_dir() -> str:
+    """
+    Where WORK_DIR is on the Docker host. Bind mount sources are resolved
+    by the daemon, so a path the agent sees inside its own container must
+    be translated: HOST_WORK_DIR if set, else the source of the agent
+    container's own WORK_DIR mount (the volume's directory for a named
+    volume), else WORK_DIR itself (agent running on the host).
+    """
+    if settings.host_work_dir:
+        return settings.host_work_dir
+    try:
+        me = _docker.containers.get(socket.gethostname())
+    except docker.errors.DockerException:
+        return WORK_DIR
+    for m in me.attrs.get("Mounts", []):
+        if m.get("Destination") == WORK_DIR and m.get("Source"):
+            return m["Source"]
+    return WORK_DIR
+
+
+def host_path(path: str) -> str:
+    rel = os.path.relpath(path, WORK_DIR)
+    if rel.startswith(os.pardir):
+        return path
+    return os.path.join(_host_work_dir(), rel)
+
+
+def write_override(p: BuildPlan):
+    """Pin built services to their fingerprint tag and mount the VPN profile."""
+    services = {}
+    for s in p.services:
+        entry = {"image": s.image}
+        vpn_src = os.path.join(s.context, VPN_FILE)
+        if s.vpn_targets and os.path.exists(vpn_src):
+            src = host_path(vpn_src)
+            entry["volumes"] = [f"{src}:{t}:ro" for t in s.vpn_targets]
+        services[s.service] = entry
+    with open(os.path.join(p.work_dir, OVERRIDE_FILE), "w") as f:
+        yaml.safe_dump({"services": services}, f, sort_keys=False)
+
+
+@contextmanager
+def _vpn_placeholders(p: BuildPlan, services: list[str]):
+    """Swap vpn.ovpn for a placeholder in mapped contexts while building."""
+    swapped = []
+    try:
+        for s in p.services:
+            path = os.path.join(s.context, VPN_FILE)
+            if s.service in services and s.vpn_targets and os.path.exists(path):
+                with open(path, "rb") as f:
+                    swapped.append((path, f.read()))
+                with open(path, "wb") as f:
+                    f.write(VPN_PLACEHOLDER)
+        yield
+    finally:
+        for path, content in swapped:
+            with open(path, "wb") as f:
+                f.write(content)
+
+
+def build(p: BuildPlan, force: bool = False):
+    """Build images that are missing (or all of them when `force`)."""
+    write_override(p)
+    targets = [s.service for s in p.services] if force else p.missing
+    if not targets:
+        return
+    with _vpn_placeholders(p, targets):
+        run_compose(p.work_dir, "build", *targets)
+
+
+def up(work_dir: str, force: bool = False, recreate: bool = False) -> bool:
+    """
+    Build (only what is missing) and `up -d --no-build`.
+    Returns True when every image came from the cache.
+    """
+    p = plan(work_dir)
+    hit = p.cache_hit and not force
+    build(p, force=force)
+    args = ["up", "-d", "--no-build"]
+    if recreate:
+        args.append("--force-recreate")
+    run_compose(work_dir, *args)
+    return hit
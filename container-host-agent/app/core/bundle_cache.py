@@ -0,0 +1,99 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from app.core.config import settings
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class DigestMismatch(Exception):
+    pass
+
+
+class BundleTooLarge(Exception):
+    pass
+
+
+def _limit() -> int:
+    return settings.bundle_cache_max_mb * 1024 * 1024
+
+
+def valid_digest(digest: str) -> bool:
+    return bool(DIGEST_RE.match(digest))
+
+
+def bundle_path(digest: str) -> str:
+    return os.path.join(settings.bundle_cache_dir, f"{digest}.zip")
+
+
+def lookup(digest: str) -> str | None:
+    """Return the cached bundle path (and mark it recently used), or None."""
+    path = bundle_path(digest)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+class BundleWriter:
+    """Write an incoming bundle to a temp file, hashing it as chunks arrive."""
+
+    def __init__(self, digest: str):
+        os.makedirs(settings.bundle_cache_dir, exist_ok=True)
+        self.digest = digest
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(
+            dir=settings.bundle_cache_dir, suffix=".part", delete=False
+        )
+
+    def write(self, chunk: bytes):
+        # A bundle over the whole budget would be evicted as soon as it landed
+        self.size += len(chunk)
+        if self.size > _limit():
+            raise BundleTooLarge(
+                f"Bundle exceeds the cache budget of {settings.bundle_cache_max_mb} MB"
+            )
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> str:
+        self._file.close()
+        if self._hash.hexdigest() != self.digest:
+            os.remove(self._file.name)
+            raise DigestMismatch("Bundle content does not match its digest")
+        path = bundle_path(self.digest)
+        os.replace(self._file.name, path)
+        evict(keep=path)
+        return path
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._file.name)
+        except FileNotFoundError:
+            pass
+
+
+def evict(keep: str | None = None):
+    """Drop least recently used bundles (never `keep`) until the cache fits its budget."""
+    limit = _limit()
+    entries = []
+    for entry in os.scandir(settings.bundle_cache_dir):
+        if entry.name.endswith(".zip") and entry.path != keep:
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None:
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
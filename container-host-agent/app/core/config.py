@@ -12,6 +12,38 @@ class Settings(BaseSettings):
     server_key: str   = Field(..., env="SERVER_KEY")
     heartbeat_interval: int = Field(10, env="HEARTBEAT_INTERVAL")
 
+    # digest-keyed bundle cache
+    bundle_cache_dir: str = Field("/opt/containers/.bundles", env="BUNDLE_CACHE_DIR")
+    bundle_cache_max_mb: int = Field(10240, env="BUNDLE_CACHE_MAX_MB")
+
+    # host-side path of /opt/containers (detected from the agent's own mount if empty)
+    host_work_dir: str = Field("", env="HOST_WORK_DIR")
+
+    # operation scheduler
+    build_slots: int = Field(2, env="BUILD_SLOTS")
+    operation_history: int = Field(200, env="OPERATION_HISTORY")
+    operation_log_lines: int = Field(5000, env="OPERATION_LOG_LINES")
+
+    # environment snapshots (reset)
+    snapshot_dir: str = Field("/opt/containers/.snapshots", env="SNAPSHOT_DIR")
+    snapshot_helper_image: str = Field("busybox:1.36", env="SNAPSHOT_HELPER_IMAGE")
+
+    # background removal (GC) queue
+    gc_dir: str = Field("/opt/containers/.gc", env="GC_DIR")
+    gc_workers: int = Field(4, env="GC_WORKERS")
+    gc_retry_base: int = Field(5, env="GC_RETRY_BASE")
+    gc_retry_max: int = Field(300, env="GC_RETRY_MAX")
+
+    # per-environment cgroup metrics
+    metrics_interval: int = Field(10, env="METRICS_INTERVAL")
+    metrics_samples: int = Field(360, env="METRICS_SAMPLES")
+    metrics_heartbeat_top: int = Field(5, env="METRICS_HEARTBEAT_TOP")
+    cgroup_root: str = Field("/sys/fs/cgroup", env="CGROUP_ROOT")
+    proc_root: str = Field("/proc", env="PROC_ROOT")
+
+    # prometheus: bearer token required at GET /metrics (unset: open)
+    metrics_token: str | None = Field(None, env="METRICS_TOKEN")
+
     class Config:
         case_sensitive = False
 
@@ -0,0 +1,151 @@
+# In-memory index of this host's containers, grouped by compose project.
+# Built with one full listing at startup and then kept current from the
+# Docker events stream, so endpoints and the heartbeat never list containers
+# through the Docker API. The stream is consumed on a daemon thread; if it
+# drops, the index is rebuilt and the stream resumed from before the rebuild,
+# so no event falls in between.
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+import docker
+
+from app.core.config import settings
+
+logger = logging.getLogger("container_index")
+
+PROJECT_LABEL = "com.docker.compose.project"
+SERVICE_LABEL = "com.docker.compose.service"
+
+# Event action -> container status as `docker ps` would report it
+STATUS_EVENTS = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+}
+
+
+@dataclass
+class ContainerEntry:
+    id: str
+    name: str
+    image: str
+    status: str
+    project: str | None = None
+    service: str | None = None
+
+
+class ContainerIndex:
+    def __init__(self):
+        self._docker = docker.DockerClient(base_url=settings.docker_socket)
+        self._lock = threading.Lock()
+        self._by_id: dict[str, ContainerEntry] = {}
+        self._projects: dict[str, set[str]] = {}
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._watch, name="container-index", daemon=True)
+        self._thread.start()
+
+    # ─── Reads ──────────────────────────────────────────────────────────
+
+    def entries(self) -> list[ContainerEntry]:
+        with self._lock:
+            return list(self._by_id.values())
+
+    def project(self, name: str) -> list[ContainerEntry]:
+        """Containers of compose project `name`, or the container called `name`."""
+        with self._lock:
+            ids = self._projects.get(name)
+            if ids:
+                return [self._by_id[i] for i in ids]
+            return [e for e in self._by_id.values() if e.name == name]
+
+    def running_count(self) -> int:
+        with self._lock:
+            return sum(1 for e in self._by_id.values() if e.status == "running")
+
+    # ─── Maintenance ────────────────────────────────────────────────────
+
+    def _watch(self):
+        while True:
+            since = int(time.time())
+            try:
+                self._rebuild()
+                for event in self._docker.events(
+                    since=since, decode=True, filters={"type": "container"}
+                ):
+                    self._apply(event)
+            except Exception as e:
+                logger.warning("Docker event stream lost (%s); rebuilding index", e)
+                time.sleep(1)
+
+    def _rebuild(self):
+        entries = {}
+        for c in self._docker.containers.list(all=True):
+            labels = c.labels or {}
+            entries[c.id] = ContainerEntry(
+                id=c.id,
+                name=c.name,
+                image=c.attrs.get("Config", {}).get("Image", ""),
+                status=c.status,
+                project=labels.get(PROJECT_LABEL),
+                service=labels.get(SERVICE_LABEL),
+            )
+        with self._lock:
+            self._by_id = entries
+            self._projects = {}
+            for e in entries.values():
+                if e.project:
+                    self._projects.setdefault(e.project, set()).add(e.id)
+
+    def _apply(self, event: dict):
+        action = (event.get("Action") or event.get("status") or "").split(":")[0]
+        cid = event.get("id") or event.get("Actor", {}).get("ID")
+        attrs = event.get("Actor", {}).get("Attributes", {})
+        if not cid:
+            return
+        with self._lock:
+            entry = self._by_id.get(cid)
+            if action == "destroy":
+                if entry:
+                    self._drop(entry)
+                return
+            if entry is None:
+                if action not in STATUS_EVENTS:
+                    return
+                # Event attributes carry the name, image and labels
+                entry = ContainerEntry(
+                    id=cid,
+                    name=attrs.get("name", cid[:12]),
+                    image=attrs.get("image", ""),
+                    status=STATUS_EVENTS[action],
+                    project=attrs.get(PROJECT_LABEL),
+                    service=attrs.get(SERVICE_LABEL),
+                )
+                self._by_id[cid] = entry
+                if entry.project:
+                    self._projects.setdefault(entry.project, set()).add(cid)
+            elif action in STATUS_EVENTS:
+                entry.status = STATUS_EVENTS[action]
+            elif action == "rename":
+                entry.name = attrs.get("name", entry.name)
+
+    def _drop(self, entry: ContainerEntry):
+        del self._by_id[entry.id]
+        if entry.project:
+            ids = self._projects.get(entry.project)
+            if ids:
+                ids.discard(entry.id)
+                if not ids:
+                    del self._projects[entry.project]
+
+
+container_index = ContainerIndex()
@@ -0,0 +1,196 @@
+# Garbage-collection queue. Removing an environment (`docker compose down
+# --volumes`, deleting its work_dir and snapshot) is slow, so DELETE only
+# records a job and returns. Up to GC_WORKERS removals then run in the
+# background, each as a scheduler operation, so a removal never overlaps
+# anything else on its environment. A failed removal is retried with
+# exponential backoff, capped at GC_RETRY_MAX seconds, until it succeeds.
+#
+# Each job is a file in GC_DIR, written before DELETE returns, so a restart
+# picks the queue up where it left off. Starting an environment again while
+# its removal is still waiting claims the job: the start does the removal
+# itself first, so the queue cannot remove the new environment later.
+import asyncio
+import functools
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable
+
+from app.core.config import settings
+from app.core.scheduler import Operation, scheduler
+
+logger = logging.getLogger("gc_queue")
+
+
+@dataclass
+class GcJob:
+    name: str
+    queued_at: float
+    attempts: int = 0
+    next_at: float = 0.0
+    error: str | None = None
+
+
+class GcQueue:
+    def __init__(self):
+        self._jobs: dict[str, GcJob] = {}
+        self._active: set[str] = set()
+        self._again: set[str] = set()   # queued again while being removed
+        self._wake = asyncio.Event()
+        self._remove: Callable[[str], None] | None = None
+        self.removed = 0
+        self.failures = 0
+
+    def start(self, remove: Callable[[str], None]):
+        """Load the persisted jobs and start working them off with `remove` (blocking)."""
+        self._remove = remove
+        os.makedirs(settings.gc_dir, exist_ok=True)
+        for entry in os.scandir(settings.gc_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path) as f:
+                    job = GcJob(**json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning("Dropping unreadable GC job %s: %s", entry.name, e)
+                os.remove(entry.path)
+                continue
+            job.next_at = 0.0
+            self._jobs[job.name] = job
+        if self._jobs:
+            logger.info("Resuming %d queued removals", len(self._jobs))
+        asyncio.create_task(self.run())
+
+    # ─── Queue ──────────────────────────────────────────────────────────
+
+    async def enqueue(self, name: str) -> GcJob:
+        """Durably queue environment `name` for removal."""
+        job = self._jobs.get(name)
+        if job is not None and name in self._active:
+            # The running removal may predate what is there now
+            self._again.add(name)
+        if job is None:
+            job = GcJob(name=name, queued_at=time.time())
+            await asyncio.to_thread(self._persist, job)
+            self._jobs[name] = job
+            self._wake.set()
+        return job
+
+    async def claim(self, name: str) -> bool:
+        """
+        Take over the pending removal of `name`, if one is waiting; the
+        caller must then remove the old environment itself. A removal that
+        is already under way is left alone: it holds the environment's
+        lock, so it finishes before anything queued after it.
+        """
+        if name not in self._jobs or name in self._active:
+            return False
+        del self._jobs[name]
+        await asyncio.to_thread(self._unlink, name)
+        return True
+
+    def has(self, name: str) -> bool:
+        return name in self._jobs
+
+    def names(self) -> list[str]:
+        return list(self._jobs)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "pending": len(self._jobs) - len(self._active),
+            "active": len(self._active),
+            "retrying": sum(1 for j in list(self._jobs.values()) if j.attempts and j.next_at > now),
+            "removed": self.removed,
+            "failures": self.failures,
+            "workers": settings.gc_workers,
+        }
+
+    def jobs(self) -> list[GcJob]:
+        return list(self._jobs.values())
+
+    # ─── Workers ────────────────────────────────────────────────────────
+
+    async def run(self):
+        while True:
+            now = time.time()
+            for job in sorted(self._jobs.values(), key=lambda j: (j.next_at, j.queued_at)):
+                if len(self._active) >= settings.gc_workers:
+                    break
+                if job.name not in self._active and job.next_at <= now:
+                    # Submitted before yielding: once a job is active, its
+                    # removal already holds its place in the environment's
+                    # lock queue, ahead of any start that `claim` turned away
+                    self._active.add(job.name)
+                    remove = functools.partial(self._remove, job.name)
+                    op = scheduler.submit("remove", job.name, remove)
+                    asyncio.create_task(self._collect(job, op))
+
+            # Sleep until a worker frees up, a job arrives or a retry is due
+            waiting = [
+                j.next_at for j in self._jobs.values()
+                if j.name not in self._active and j.next_at > now
+            ]
+            timeout = min(waiting) - now if waiting else None
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _collect(self, job: GcJob, op: Operation):
+        try:
+            await op.wait()
+        except Exception as e:
+            job.attempts += 1
+            delay = min(settings.gc_retry_max, settings.gc_retry_base * 2 ** (job.attempts - 1))
+            job.next_at = time.time() + delay
+            job.error = str(getattr(e, "detail", None) or e)
+            self.failures += 1
+            self._again.discard(job.name)   # the job stays queued anyway
+            logger.warning(
+                "Removal of %s failed (attempt %d), retrying in %ds: %s",
+                job.name, job.attempts, delay, job.error,
+            )
+            try:
+                await asyncio.to_thread(self._persist, job)
+            except OSError:
+                logger.exception("Could not persist GC job %s", job.name)
+        else:
+            self.removed += 1
+            if job.name in self._again:
+                self._again.discard(job.name)
+                job.attempts, job.next_at, job.error = 0, 0.0, None
+            else:
+                self._jobs.pop(job.name, None)
+                try:
+                    await asyncio.to_thread(self._unlink, job.name)
+                except OSError:
+                    logger.exception("Could not delete GC job %s", job.name)
+        finally:
+            self._active.discard(job.name)
+            self._wake.set()
+
+    # ─── Persistence ────────────────────────────────────────────────────
+
+    def _path(self, name: str) -> str:
+        return os.path.join(settings.gc_dir, f"{name}.json")
+
+    def _persist(self, job: GcJob):
+        path = self._path(job.name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(asdict(job), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _unlink(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+
+gc_queue = GcQueue()
@@ -4,12 +4,14 @@ import logging
 
 import httpx
 import psutil
-from docker import DockerClient
 
 from app.core.config import settings
+from app.core import inventory
+from app.core.container_index import container_index
+from app.core.metrics import metrics
+from app.core.scheduler import scheduler
 
 logger = logging.getLogger("heartbeat")
-docker = DockerClient(base_url=settings.docker_socket)
 
 
 async def heartbeat_loop():
@@ -22,18 +24,25 @@ async def heartbeat_loop():
             try:
                 cpu = psutil.cpu_percent(interval=None)
                 mem = psutil.virtual_memory().percent
-                containers = len(docker.containers.list())
+                containers = container_index.running_count()
+                inventory_digest = inventory.digest()
 
             except Exception as e:
                 logger.error("Failed to gather stats: %s", e)
                 cpu = 0
                 mem = 0
                 containers = 0
+                inventory_digest = None
 
+            ops = scheduler.stats()
             payload = {
                 "cpu": int(cpu),
                 "mem": int(mem),
                 "containers": containers,
+                "ops_queued": ops["queued"],
+                "ops_running": ops["running"],
+                "inventory": inventory_digest,
+                "environments": metrics.top(settings.metrics_heartbeat_top),
             }
 
             # send heartbeat
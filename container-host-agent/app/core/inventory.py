@@ -0,0 +1,50 @@
+# Environment inventory: every environment this host has a work dir for,
+# with the state of its compose services from the container index, and
+# whether it is queued for removal. Compose projects that were not started
+# through the agent have no work dir and are not listed. The manager's fleet
+# reconciler diffs this against its DB; the heartbeat carries only a digest,
+# so the full inventory is fetched only when something changed.
+import hashlib
+import json
+import os
+
+from app.core.container_index import container_index
+from app.core.gc_queue import gc_queue
+
+# Base dir for all compose projects
+WORK_DIR = "/opt/containers"
+
+
+def _state(entries) -> str:
+    if not entries:
+        return "missing"
+    running = sum(1 for e in entries if e.status == "running")
+    if running == len(entries):
+        return "running"
+    return "degraded" if running else "stopped"
+
+
+def environments() -> list[dict]:
+    names = set(gc_queue.names())
+    if os.path.isdir(WORK_DIR):
+        names.update(
+            e.name for e in os.scandir(WORK_DIR)
+            if e.is_dir() and not e.name.startswith(".")
+        )
+    envs = []
+    for name in sorted(names):
+        entries = container_index.project(name)
+        envs.append({
+            "name": name,
+            "state": _state(entries),
+            "services": len(entries),
+            "running": sum(1 for e in entries if e.status == "running"),
+            "removing": gc_queue.has(name),
+        })
+    return envs
+
+
+def digest(envs: list[dict] | None = None) -> str:
+    envs = environments() if envs is None else envs
+    key = [(e["name"], e["state"], e["removing"]) for e in envs]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:32]
@@ -0,0 +1,280 @@
+# Per-environment resource metrics, read straight from cgroup v2. Every
+# METRICS_INTERVAL seconds one pass reads, for each running container,
+# cpu.stat, memory.current, pids.current and io.stat from its cgroup
+# directory, plus /proc/<pid>/net/dev of one of its processes (once per
+# network namespace, so services sharing one are not counted twice). That
+# is a handful of small file reads per container, against the second or so
+# a `docker stats` call costs.
+#
+# Counters (CPU time, bytes read/written/received/sent) become rates over
+# the pass; samples are summed per compose project and appended to that
+# environment's ring: METRICS_SAMPLES rows of a timestamp and FIELDS, kept
+# in two flat arrays of doubles, so history costs a fixed
+# 8 * (1 + len(FIELDS)) bytes per sample and nothing is allocated per pass.
+#
+# CGROUP_ROOT and PROC_ROOT are the host's /sys/fs/cgroup and /proc as
+# seen from the agent (see docker-compose.yml). Both the systemd
+# (system.slice/docker-<id>.scope) and the cgroupfs (docker/<id>) layout
+# are recognised.
+import asyncio
+import logging
+import os
+import threading
+import time
+from array import array
+
+from app.core.config import settings
+from app.core.container_index import container_index
+
+logger = logging.getLogger("metrics")
+
+FIELDS = (
+    "cpu_percent",     # of one CPU; a busy 4-core environment reads 400
+    "mem_bytes",
+    "pids",
+    "io_read_bps",
+    "io_write_bps",
+    "net_rx_bps",
+    "net_tx_bps",
+)
+WIDTH = len(FIELDS)
+CPU, MEM, PIDS, IO_R, IO_W, NET_RX, NET_TX = range(WIDTH)
+
+
+class Ring:
+    """The last `capacity` samples of one environment, oldest overwritten first."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self._next = 0
+        self._t = array("d", bytes(8 * capacity))
+        self._v = array("d", bytes(8 * capacity * WIDTH))
+
+    def push(self, t: float, values: list[float]):
+        i = self._next
+        self._t[i] = t
+        self._v[i * WIDTH:(i + 1) * WIDTH] = array("d", values)
+        self._next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def latest(self) -> list[float] | None:
+        """[t, *FIELDS] of the newest sample."""
+        if not self.size:
+            return None
+        i = (self._next - 1) % self.capacity
+        return [self._t[i], *self._v[i * WIDTH:(i + 1) * WIDTH]]
+
+    def rows(self, since: float = 0.0) -> list[list[float]]:
+        """[t, *FIELDS] of every sample newer than `since`, oldest first."""
+        start = (self._next - self.size) % self.capacity
+        out = []
+        for k in range(self.size):
+            i = (start + k) % self.capacity
+            if self._t[i] > since:
+                out.append([self._t[i], *self._v[i * WIDTH:(i + 1) * WIDTH]])
+        return out
+
+
+# ─── cgroup / proc readers ──────────────────────────────────────────────
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:   # the container went away mid-pass
+        return None
+
+
+def _cpu_usec(cg: str) -> int | None:
+    text = _read(os.path.join(cg, "cpu.stat"))
+    if text is None:
+        return None
+    for line in text.splitlines():
+        key, _, value = line.partition(" ")
+        if key == "usage_usec":
+            return int(value)
+    return None
+
+
+def _int(cg: str, name: str) -> int:
+    text = _read(os.path.join(cg, name))
+    try:
+        return int(text) if text else 0
+    except ValueError:   # "max"
+        return 0
+
+
+def _io(cg: str) -> tuple[int, int]:
+    read = written = 0
+    for line in (_read(os.path.join(cg, "io.stat")) or "").splitlines():
+        for kv in line.split()[1:]:
+            key, _, value = kv.partition("=")
+            if key == "rbytes":
+                read += int(value)
+            elif key == "wbytes":
+                written += int(value)
+    return read, written
+
+
+def _net(cg: str) -> tuple[int, int, int] | None:
+    """(netns inode, rx bytes, tx bytes) of the cgroup's first process."""
+    procs = _read(os.path.join(cg, "cgroup.procs"))
+    if not procs:
+        return None
+    pid = procs.split("\n", 1)[0].strip()
+    try:
+        ns = os.stat(os.path.join(settings.proc_root, pid, "ns", "net")).st_ino
+    except OSError:
+        return None
+    text = _read(os.path.join(settings.proc_root, pid, "net", "dev"))
+    if text is None:
+        return None
+    rx = tx = 0
+    for line in text.splitlines()[2:]:
+        iface, _, counters = line.partition(":")
+        if iface.strip() == "lo":
+            continue
+        cols = counters.split()
+        rx += int(cols[0])
+        tx += int(cols[8])
+    return ns, rx, tx
+
+
+def _rate(cur: int, prev: int, dt: float) -> float:
+    # A counter that went backwards belongs to a new process or namespace
+    return max(0, cur - prev) / dt if dt > 0 else 0.0
+
+
+# ─── Collector ──────────────────────────────────────────────────────────
+
+class MetricsCollector:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rings: dict[str, Ring] = {}
+        self._paths: dict[str, str] = {}                          # container id -> cgroup dir
+        self._prev: dict[str, tuple[float, int, int, int]] = {}   # id -> (t, cpu, rd, wr)
+        self._prev_net: dict[int, tuple[float, int, int]] = {}    # netns -> (t, rx, tx)
+        self.passes = 0
+        self.last_pass_ms = 0.0
+        self.unresolved = 0
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.collect)
+            except Exception:
+                logger.exception("Metrics pass failed")
+            await asyncio.sleep(settings.metrics_interval)
+
+    def _cgroup(self, cid: str) -> str | None:
+        path = self._paths.get(cid)
+        if path:
+            return path
+        for candidate in (
+            os.path.join(settings.cgroup_root, "system.slice", f"docker-{cid}.scope"),
+            os.path.join(settings.cgroup_root, "docker", cid),
+        ):
+            if os.path.isdir(candidate):
+                self._paths[cid] = candidate
+                return candidate
+        return None
+
+    def collect(self):
+        """Blocking: one pass over every running container."""
+        started = time.perf_counter()
+        now = time.time()
+        entries = container_index.entries()
+        totals: dict[str, list[float]] = {}
+        seen, seen_ns, unresolved = set(), set(), 0
+
+        for e in entries:
+            if e.status != "running":
+                continue
+            cg = self._cgroup(e.id)
+            cpu = _cpu_usec(cg) if cg else None
+            if cpu is None:
+                self._paths.pop(e.id, None)
+                unresolved += 1
+                continue
+            seen.add(e.id)
+            row = totals.setdefault(e.project or e.name, [0.0] * WIDTH)
+            rd, wr = _io(cg)
+            prev = self._prev.get(e.id)
+            if prev:
+                dt = now - prev[0]
+                row[CPU] += _rate(cpu, prev[1], dt) / 1e4   # usec/s -> % of a CPU
+                row[IO_R] += _rate(rd, prev[2], dt)
+                row[IO_W] += _rate(wr, prev[3], dt)
+            self._prev[e.id] = (now, cpu, rd, wr)
+            row[MEM] += _int(cg, "memory.current")
+            row[PIDS] += _int(cg, "pids.current")
+
+            net = _net(cg)
+            if net and net[0] not in seen_ns:
+                ns, rx, tx = net
+                seen_ns.add(ns)
+                prev_net = self._prev_net.get(ns)
+                if prev_net:
+                    dt = now - prev_net[0]
+                    row[NET_RX] += _rate(rx, prev_net[1], dt)
+                    row[NET_TX] += _rate(tx, prev_net[2], dt)
+                self._prev_net[ns] = (now, rx, tx)
+
+        # Forget containers and namespaces that are gone
+        for cid in self._prev.keys() - seen:
+            del self._prev[cid]
+        for cid in self._paths.keys() - seen:
+            del self._paths[cid]
+        for ns in self._prev_net.keys() - seen_ns:
+            del self._prev_net[ns]
+
+        known = {e.project or e.name for e in entries}
+        with self._lock:
+            for name, row in totals.items():
+                ring = self._rings.get(name)
+                if ring is None:
+                    ring = self._rings[name] = Ring(settings.metrics_samples)
+                ring.push(now, row)
+            # An environment's history lasts as long as its containers
+            for name in self._rings.keys() - known:
+                del self._rings[name]
+        self.passes += 1
+        self.unresolved = unresolved
+        self.last_pass_ms = (time.perf_counter() - started) * 1000
+
+    # ─── Reads ──────────────────────────────────────────────────────────
+
+    def latest(self, name: str | None = None) -> dict[str, list[float]]:
+        with self._lock:
+            rings = self._rings if name is None else {name: self._rings.get(name)}
+            return {n: r.latest() for n, r in rings.items() if r and r.size}
+
+    def history(self, name: str | None = None, since: float = 0.0) -> dict[str, list[list[float]]]:
+        with self._lock:
+            rings = self._rings if name is None else {name: self._rings.get(name)}
+            return {n: r.rows(since) for n, r in rings.items() if r}
+
+    def top(self, n: int) -> list[dict]:
+        """The `n` environments using the most CPU right now, for the heartbeat."""
+        latest = sorted(self.latest().items(), key=lambda kv: kv[1][1 + CPU], reverse=True)
+        return [
+            {
+                "name": name,
+                "cpu_percent": round(row[1 + CPU], 1),
+                "mem_bytes": int(row[1 + MEM]),
+            }
+            for name, row in latest[:n]
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "environments": len(self._rings),
+            "passes": self.passes,
+            "last_pass_ms": round(self.last_pass_ms, 2),
+            "unresolved": self.unresolved,
+            "interval": settings.metrics_interval,
+        }
+
+
+metrics = MetricsCollector()
@@ -0,0 +1,112 @@
+# Prometheus metrics, served at GET /metrics. Operations and compose runs
+# observe a histogram when they finish; queue and capacity levels are read
+# from the scheduler, GC queue and container index at scrape time, so they
+# cost nothing between scrapes.
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Seconds; from a no-op restart to a cold image build
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+OPERATION_SECONDS = Histogram(
+    "agent_operation_seconds",
+    "Run time of scheduler operations (start, restart, rebuild, reset, snapshot, remove)",
+    ["kind", "result"],
+    buckets=BUCKETS,
+)
+OPERATION_WAIT = Histogram(
+    "agent_operation_wait_seconds",
+    "Time operations waited for their environment's lock and a build slot",
+    ["kind"],
+    buckets=BUCKETS,
+)
+COMPOSE_SECONDS = Histogram(
+    "agent_compose_seconds",
+    "Duration of `docker compose` commands",
+    ["command", "result"],
+    buckets=BUCKETS,
+)
+AUTH = Counter(
+    "agent_auth_total",
+    "Server key checks",
+    ["result"],
+)
+
+
+@contextmanager
+def timed_compose(command: str):
+    start = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        COMPOSE_SECONDS.labels(command, result).observe(time.perf_counter() - start)
+
+
+class StateCollector:
+    """Scheduler, removal queue and container levels, read when Prometheus scrapes."""
+
+    def describe(self):
+        # Without this, registering calls collect() at import time, which
+        # imports the singletons it reads before they are initialised
+        return []
+
+    def collect(self):
+        from app.core.container_index import container_index
+        from app.core.gc_queue import gc_queue
+        from app.core.metrics import metrics
+        from app.core.scheduler import scheduler
+
+        ops = scheduler.stats()
+        yield GaugeMetricFamily(
+            "agent_operations_queued", "Operations waiting to run", value=ops["queued"]
+        )
+        yield GaugeMetricFamily(
+            "agent_operations_running", "Operations running", value=ops["running"]
+        )
+        yield GaugeMetricFamily(
+            "agent_build_slots", "Concurrent image builds allowed", value=ops["build_slots"]
+        )
+        yield GaugeMetricFamily(
+            "agent_builds_running", "Build slots in use", value=ops["builds_running"]
+        )
+        yield GaugeMetricFamily(
+            "agent_builds_waiting", "Operations waiting for a build slot",
+            value=ops["builds_waiting"],
+        )
+
+        gc = gc_queue.stats()
+        queue = GaugeMetricFamily(
+            "agent_gc_jobs", "Queued environment removals", labels=["state"]
+        )
+        queue.add_metric(["pending"], gc["pending"])
+        queue.add_metric(["active"], gc["active"])
+        queue.add_metric(["retrying"], gc["retrying"])
+        yield queue
+        yield CounterMetricFamily(
+            "agent_gc_removed", "Environments removed by the queue", value=gc["removed"]
+        )
+        yield CounterMetricFamily(
+            "agent_gc_failures", "Removal attempts that failed", value=gc["failures"]
+        )
+
+        yield GaugeMetricFamily(
+            "agent_containers_running", "Running containers",
+            value=container_index.running_count(),
+        )
+        collector = metrics.stats()
+        yield GaugeMetricFamily(
+            "agent_environments_metered", "Environments with cgroup metrics",
+            value=collector["environments"],
+        )
+        yield GaugeMetricFamily(
+            "agent_metrics_pass_seconds", "Duration of the last cgroup metrics pass",
+            value=collector["last_pass_ms"] / 1000,
+        )
+
+
+REGISTRY.register(StateCollector())
@@ -0,0 +1,250 @@
+# Operation scheduler. Every lifecycle call on an environment (start,
+# restart, remove) runs as an operation on the event loop: it first takes the
+# environment's mutex, so two operations never touch one work_dir at the same
+# time, and an operation that builds images then waits for one of BUILD_SLOTS
+# build slots, handed out by priority and, within a priority, in arrival
+# order. The blocking work itself runs on a worker thread.
+#
+# `docker compose` output of an operation is captured line by line into its
+# log, which can be followed live over SSE. Finished operations are kept for
+# lookup until OPERATION_HISTORY newer ones have finished. Queue depth goes
+# out with every heartbeat.
+import asyncio
+import contextvars
+import datetime
+import heapq
+import itertools
+import logging
+import uuid
+from collections import deque
+from typing import Any, Callable
+
+from app.core.config import settings
+from app.core.prometheus import OPERATION_SECONDS, OPERATION_WAIT
+
+logger = logging.getLogger("scheduler")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+# Where the operation running in this context writes its output lines;
+# asyncio.to_thread carries it over to the worker thread
+output: contextvars.ContextVar[Callable[[str], None] | None] = contextvars.ContextVar(
+    "output", default=None
+)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class Operation:
+    def __init__(self, kind: str, name: str, priority: int, build: bool):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.name = name
+        self.priority = priority
+        self.build = build
+        self.state = QUEUED
+        self.error: str | None = None
+        self.created_at = _now()
+        self.started_at: datetime.datetime | None = None
+        self.finished_at: datetime.datetime | None = None
+        # Log lines; the oldest are dropped past OPERATION_LOG_LINES
+        self.lines: list[str] = []
+        self.dropped = 0
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._done = self._loop.create_future()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (SUCCEEDED, FAILED)
+
+    def write(self, line: str):
+        """Append a log line; safe to call from any thread."""
+        self._loop.call_soon_threadsafe(self._append, line)
+
+    async def wait(self) -> Any:
+        """The operation's result, or its exception; cancelling the waiter
+        does not cancel the operation."""
+        return await asyncio.shield(self._done)
+
+    async def follow(self, start: int = 0):
+        """Yield (index, line) from line `start` on, live, until the operation finishes."""
+        i = start
+        while True:
+            changed = self._changed
+            i = max(i, self.dropped)
+            while i < self.dropped + len(self.lines):
+                yield i, self.lines[i - self.dropped]
+                i += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "priority": self.priority,
+            "build": self.build,
+            "state": self.state,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "lines": self.dropped + len(self.lines),
+        }
+
+    def _append(self, line: str):
+        self.lines.append(line)
+        excess = len(self.lines) - settings.operation_log_lines
+        if excess > 0:
+            del self.lines[:excess]
+            self.dropped += excess
+        self._notify()
+
+    def _finish(self, result: Any = None, error: BaseException | None = None):
+        self.finished_at = _now()
+        if self.started_at:
+            OPERATION_SECONDS.labels(self.kind, "ok" if error is None else "error").observe(
+                (self.finished_at - self.started_at).total_seconds()
+            )
+        if error is None:
+            self.state = SUCCEEDED
+            self._done.set_result(result)
+        else:
+            self.state = FAILED
+            self.error = str(getattr(error, "detail", None) or error) or type(error).__name__
+            if isinstance(error, asyncio.CancelledError):
+                self._done.cancel()
+            else:
+                self._done.set_exception(error)
+                # Waiters re-raise it; don't warn when nobody was waiting
+                self._done.exception()
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class Scheduler:
+    def __init__(self):
+        self._ops: dict[str, Operation] = {}
+        self._history: deque[str] = deque()
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._holders: dict[str, int] = {}
+        self._waiting: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._slots_used = 0
+
+    # ─── Submission ─────────────────────────────────────────────────────
+
+    def submit(
+        self,
+        kind: str,
+        name: str,
+        fn: Callable[[], Any],
+        build: bool = False,
+        priority: int = 0,
+    ) -> Operation:
+        """Queue `fn` (blocking) as an operation on environment `name`."""
+        op = Operation(kind, name, priority, build)
+        self._ops[op.id] = op
+        self._holders[name] = self._holders.get(name, 0) + 1
+        asyncio.create_task(self._execute(op, fn))
+        return op
+
+    async def run(self, kind: str, name: str, fn: Callable[[], Any], **kw) -> tuple[Operation, Any]:
+        """Submit and wait for the result."""
+        op = self.submit(kind, name, fn, **kw)
+        return op, await op.wait()
+
+    async def _execute(self, op: Operation, fn: Callable[[], Any]):
+        try:
+            async with self._locks.setdefault(op.name, asyncio.Lock()):
+                if op.build:
+                    await self._acquire_slot(op.priority)
+                try:
+                    op.state = RUNNING
+                    op.started_at = _now()
+                    OPERATION_WAIT.labels(op.kind).observe(
+                        (op.started_at - op.created_at).total_seconds()
+                    )
+                    output.set(op.write)
+                    result = await asyncio.to_thread(fn)
+                finally:
+                    if op.build:
+                        self._release_slot()
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                op._finish(error=e)
+                raise
+            logger.warning("%s of %s failed: %s", op.kind, op.name, e)
+            op._append(f"error: {getattr(e, 'detail', None) or e}")
+            op._finish(error=e)
+        else:
+            op._finish(result)
+        finally:
+            self._holders[op.name] -= 1
+            if not self._holders[op.name]:
+                del self._holders[op.name]
+                self._locks.pop(op.name, None)
+            self._retire(op)
+
+    def _retire(self, op: Operation):
+        self._history.append(op.id)
+        while len(self._history) > settings.operation_history:
+            self._ops.pop(self._history.popleft(), None)
+
+    # ─── Build slots ────────────────────────────────────────────────────
+
+    async def _acquire_slot(self, priority: int):
+        # Waiters that were cancelled before getting a slot
+        while self._waiting and self._waiting[0][2].done():
+            heapq.heappop(self._waiting)
+        if self._slots_used < settings.build_slots and not self._waiting:
+            self._slots_used += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (-priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # Handed a slot just as we were cancelled: pass it on
+            if fut.done() and not fut.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        # The slot goes straight to the next waiter, if any
+        while self._waiting:
+            _, _, fut = heapq.heappop(self._waiting)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._slots_used -= 1
+
+    # ─── Reads ──────────────────────────────────────────────────────────
+
+    def get(self, op_id: str) -> Operation | None:
+        return self._ops.get(op_id)
+
+    def operations(self, name: str | None = None) -> list[Operation]:
+        return [op for op in self._ops.values() if name is None or op.name == name]
+
+    def stats(self) -> dict:
+        # Also read from the threadpool (health check): iterate over copies
+        states = [op.state for op in list(self._ops.values())]
+        return {
+            "queued": states.count(QUEUED),
+            "running": states.count(RUNNING),
+            "build_slots": settings.build_slots,
+            "builds_running": self._slots_used,
+            "builds_waiting": sum(1 for _, _, f in list(self._waiting) if not f.done()),
+        }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,257 @@
+# Environment snapshots. Right after an environment comes up, each service
+# container is committed to an image (mlab-snap:<env>-<service>) and each
+# volume it mounts is copied into a snapshot volume, with the project paused
+# so that the two agree. A reset then puts back only what drifted: changed
+# volumes are copied back from their snapshot, and the services that changed
+# (or mount a changed volume) get fresh containers from their committed
+# images. Nothing is built, and untouched services keep running.
+#
+# Drift is judged against fingerprints recorded with the snapshot (and again
+# after every reset): for a container, its filesystem diff and the size of
+# its writable layer; for a volume, the name, size, mtime and mode of every
+# file in it. A rewrite that keeps all of those is not noticed, so a forced
+# reset puts back every service.
+#
+# Snapshot metadata lives in SNAPSHOT_DIR, outside the environment's build
+# context, so it never changes the build cache fingerprints.
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+
+import docker
+import yaml
+
+from app.core import scheduler
+from app.core.build_cache import run_compose
+from app.core.config import settings
+from app.core.container_index import PROJECT_LABEL, SERVICE_LABEL
+
+logger = logging.getLogger("snapshots")
+
+SNAP_REPO = "mlab-snap"
+SNAP_LABEL = "mlab.snapshot.project"
+
+# Per-volume fingerprint, run in the helper container
+_VOLUME_SUM = (
+    "cd {0} && find . -exec stat -c '%n %s %Y %a' {{}} + | sort | sha256sum | cut -d' ' -f1"
+)
+
+_docker = docker.DockerClient(base_url=settings.docker_socket)
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _say(msg: str):
+    logger.info(msg)
+    sink = scheduler.output.get()
+    if sink:
+        sink(msg)
+
+
+def _slug(s: str) -> str:
+    return re.sub(r"[^a-z0-9_.-]+", "-", s.lower()).strip("-.") or "x"
+
+
+def _manifest_path(name: str) -> str:
+    return os.path.join(settings.snapshot_dir, f"{name}.json")
+
+
+def _override_path(name: str) -> str:
+    return os.path.join(settings.snapshot_dir, f"{name}.override.yml")
+
+
+# ─── Docker helpers ─────────────────────────────────────────────────────
+
+def _containers(name: str) -> dict[str, dict]:
+    """Service -> container summary (with its writable layer size)."""
+    found = _docker.api.containers(
+        all=True, size=True, filters={"label": f"{PROJECT_LABEL}={name}"}
+    )
+    return {
+        c["Labels"][SERVICE_LABEL]: c
+        for c in found
+        if SERVICE_LABEL in (c.get("Labels") or {})
+    }
+
+
+def _volumes_of(c: dict) -> list[str]:
+    return sorted(m["Name"] for m in c.get("Mounts") or [] if m.get("Type") == "volume")
+
+
+def _fingerprint(c: dict) -> str:
+    diff = sorted((d["Path"], d["Kind"]) for d in _docker.api.diff(c["Id"]) or [])
+    return hashlib.sha256(json.dumps([diff, c.get("SizeRw") or 0]).encode()).hexdigest()
+
+
+def _helper(mounts: dict[str, tuple[str, str]], script: str) -> str:
+    """Run `script` in a throwaway container with volume -> (path, mode) mounted."""
+    out = _docker.containers.run(
+        settings.snapshot_helper_image,
+        ["sh", "-c", script],
+        volumes={vol: {"bind": path, "mode": mode} for vol, (path, mode) in mounts.items()},
+        network_disabled=True,
+        remove=True,
+    )
+    return out.decode()
+
+
+def _volume_sums(volumes: list[str]) -> dict[str, str]:
+    if not volumes:
+        return {}
+    script = "; ".join(
+        f"echo {i} $({_VOLUME_SUM.format(f'/v/{i}')})" for i in range(len(volumes))
+    )
+    out = _helper({v: (f"/v/{i}", "ro") for i, v in enumerate(volumes)}, script)
+    sums = dict(line.split() for line in out.splitlines() if line.strip())
+    return {v: sums[str(i)] for i, v in enumerate(volumes)}
+
+
+def _copy_volumes(pairs: list[tuple[str, str]]):
+    """Make each destination volume an exact copy of its source."""
+    if not pairs:
+        return
+    mounts, steps = {}, []
+    for i, (src, dst) in enumerate(pairs):
+        mounts[src] = (f"/from/{i}", "ro")
+        mounts[dst] = (f"/to/{i}", "rw")
+        steps.append(f"find /to/{i} -mindepth 1 -delete && cp -a /from/{i}/. /to/{i}/")
+    _helper(mounts, " && ".join(steps))
+
+
+# ─── Snapshot / reset ───────────────────────────────────────────────────
+
+def take(name: str) -> dict:
+    """Blocking: snapshot environment `name` as it is now."""
+    containers = _containers(name)
+    if not containers:
+        raise SnapshotError(f"Environment {name} has no containers")
+    volumes = sorted({v for c in containers.values() for v in _volumes_of(c)})
+    os.makedirs(settings.snapshot_dir, exist_ok=True)
+
+    running = [c["Id"] for c in containers.values() if c["State"] == "running"]
+    for cid in running:
+        _docker.api.pause(cid)
+    try:
+        # 1) Commit each container's filesystem
+        services = {}
+        for svc, c in containers.items():
+            tag = f"{_slug(name)}-{_slug(svc)}"[:128]
+            _docker.api.commit(
+                c["Id"], repository=SNAP_REPO, tag=tag,
+                changes=[f"LABEL {SNAP_LABEL}={name}"], pause=False,
+            )
+            services[svc] = {
+                "image": f"{SNAP_REPO}:{tag}",
+                "fingerprint": _fingerprint(c),
+                "volumes": _volumes_of(c),
+            }
+
+        # 2) Copy each volume
+        snaps = {}
+        for vol in volumes:
+            snaps[vol] = f"{SNAP_REPO}-{vol}"
+            _docker.volumes.create(name=snaps[vol], labels={SNAP_LABEL: name})
+        _copy_volumes([(vol, snaps[vol]) for vol in volumes])
+        sums = _volume_sums(volumes)
+    finally:
+        for cid in running:
+            _docker.api.unpause(cid)
+
+    manifest = {
+        "taken_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "services": services,
+        "volumes": {v: {"snapshot": snaps[v], "sum": sums[v]} for v in volumes},
+    }
+    _save(name, manifest)
+    with open(_override_path(name), "w") as f:
+        yaml.safe_dump(
+            {"services": {svc: {"image": s["image"]} for svc, s in services.items()}},
+            f, sort_keys=False,
+        )
+    _say(f"Snapshot of {name}: {len(services)} services, {len(volumes)} volumes")
+    return manifest
+
+
+def reset(name: str, work_dir: str, force: bool = False) -> list[str]:
+    """
+    Blocking: put environment `name` back to its snapshot. Returns the
+    services that were recreated (none if nothing drifted).
+    """
+    manifest = _load(name)
+    containers = _containers(name)
+
+    # 1) Volumes whose contents drifted
+    volumes = manifest["volumes"]
+    sums = {} if force else _volume_sums(list(volumes))
+    changed_volumes = {v for v, snap in volumes.items() if sums.get(v) != snap["sum"]}
+
+    # 2) Services that drifted, stopped, or mount a drifted volume
+    changed = []
+    for svc, snap in manifest["services"].items():
+        c = containers.get(svc)
+        if (
+            force
+            or c is None
+            or c["State"] != "running"
+            or changed_volumes & set(snap["volumes"])
+            or _fingerprint(c) != snap["fingerprint"]
+        ):
+            changed.append(svc)
+    if not changed:
+        _say(f"{name} matches its snapshot; nothing to reset")
+        return []
+    _say(f"Resetting {', '.join(changed)} of {name}")
+
+    # 3) Stop them and put their volumes back
+    run_compose(work_dir, "stop", *changed)
+    _copy_volumes([(volumes[v]["snapshot"], v) for v in sorted(changed_volumes)])
+
+    # 4) Fresh containers from the committed images; anonymous volumes
+    #    carry over to the new containers
+    run_compose(
+        work_dir, "up", "-d", "--no-build", "--no-deps", "--force-recreate", *changed,
+        overrides=(_override_path(name),),
+    )
+
+    # 5) New containers, new baseline
+    containers = _containers(name)
+    for svc in changed:
+        if svc in containers:
+            manifest["services"][svc]["fingerprint"] = _fingerprint(containers[svc])
+    _save(name, manifest)
+    return changed
+
+
+def drop(name: str):
+    """Blocking: delete the snapshot of environment `name`, if any."""
+    label = {"label": f"{SNAP_LABEL}={name}"}
+    try:
+        for image in _docker.images.list(filters=label):
+            _docker.images.remove(image.id, force=True)
+        for volume in _docker.volumes.list(filters=label):
+            volume.remove(force=True)
+    except docker.errors.DockerException as e:
+        logger.warning("Could not remove snapshot of %s: %s", name, e)
+    for path in (_manifest_path(name), _override_path(name)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _load(name: str) -> dict:
+    try:
+        with open(_manifest_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise SnapshotError(f"No snapshot of environment {name}")
+
+
+def _save(name: str, manifest: dict):
+    path = _manifest_path(name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
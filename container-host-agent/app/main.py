@@ -1,5 +1,7 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response
 from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 load_dotenv()
 
@@ -8,10 +10,25 @@ app = FastAPI(title="Container Host Agent")
 from app.api.agent import router as agent_router
 app.include_router(agent_router)
 
-# — heartbeat on startup —
+from app.core.config import settings
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(authorization: str | None = Header(None)):
+    # Outside /agent: scraped with METRICS_TOKEN, not the server key
+    if settings.metrics_token and authorization != f"Bearer {settings.metrics_token}":
+        raise HTTPException(status_code=401, detail="Bad metrics token")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# — container index + heartbeat on startup —
+from app.core.container_index import container_index
 from app.core.heartbeat import heartbeat_loop
+from app.core.gc_queue import gc_queue
+from app.core.metrics import metrics
+from app.api.agent import remove_environment
 @app.on_event("startup")
 async def kick_off_heartbeat():
+    container_index.start()
+    gc_queue.start(remove_environment)
     # run in background
     import asyncio
-    asyncio.create_task(heartbeat_loop())
\ No newline at end of file
+    asyncio.create_task(heartbeat_loop())
+    asyncio.create_task(metrics.run())
\ No newline at end of file
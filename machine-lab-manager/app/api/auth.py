@@ -13,6 +13,8 @@ from app.core.security import (
     hash_password,
 )
 from app.api.deps import get_db, get_current_admin
+from app.internal.credentials import credentials
+from app.internal.prometheus import AUTH
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -48,7 +50,9 @@ async def login(req: LoginRequest, db: AsyncSession = Depends(get_db)):
     user: User | None = res.scalar_one_or_none()
 
     if not user or not verify_password(req.password, user.password_hash):
+        AUTH.labels("login", "rejected").inc()
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    AUTH.labels("login", "verified").inc()
 
     token = create_admin_token(str(user.id), exp_minutes=None)  # no expiry
     api_key = APIKey(
@@ -92,11 +96,14 @@ async def change_password(
     
     Requires the current password for verification.
     """
-    if not verify_password(body.current_password, admin.password_hash):
+    # The dependency may hand back a cached snapshot; edit this session's row
+    user = await db.get(User, admin.id)
+    if not verify_password(body.current_password, user.password_hash):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong current password")
 
-    admin.password_hash = hash_password(body.new_password)
+    user.password_hash = hash_password(body.new_password)
     await db.commit()
+    credentials.invalidate(admin.id)
     return MessageResponse(message="Password changed successfully")
 
 
@@ -146,8 +153,33 @@ async def rotate_key(
     )
     db.add(new_key)
     await db.commit()
+    credentials.invalidate(admin.id)
 
     return RotateKeyResponse(
         message="Admin key rotated successfully",
         admin_key=token
     )
+
+
+# --------------------
+# CREDENTIAL CACHE
+# --------------------
+class CredentialCacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    hit_rate: float | None
+    evictions: int
+    invalidations: int
+
+
+@router.get(
+    "/credential-cache",
+    response_model=CredentialCacheStats,
+    dependencies=[Depends(get_current_admin)],
+    summary="Credential cache statistics",
+    description="Hit rate and eviction counters of the verified-key cache.",
+)
+async def credential_cache_stats():
+    return CredentialCacheStats(**credentials.stats())
@@ -1,5 +1,6 @@
 # app/api/containers.py
 import uuid
+import enum
 import base64
 import datetime
 from pydantic import BaseModel,IPvAnyAddress
@@ -9,30 +10,41 @@ from fastapi import (
     Depends,
     UploadFile,
     File,
+    Form,
     HTTPException,
+    Query,
+    Response,
     status,
 )
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import tuple_
 from sqlalchemy.future import select
-import httpx
 
 from app.api.deps import get_db, get_current_admin
 from app.models import (
     ContainerHost,
-    HostStatus,
     Container,
     ContainerStatus,
     VPNProfile,
+    ChallengeTemplate,
 )
 
 from app.api.hosts import Healthiness, compute_healthiness
 
-from app.internal.vpn import (
-    create_or_get_profile,
-    apply_vpn_rule,
-    remove_vpn_rule,
-    remove_vpn_profile,
-)
+from app.core.config import get_settings
+from app.internal.agent_client import AgentUnavailable, agents
+from app.internal.cohort import CohortLaunch
+from app.internal.live_state import live_state, summarize
+from app.internal.placement import adjust_container_count, placement
+from app.internal.prometheus import LAUNCH_PHASE, STOP_PHASE, timed
+from app.internal.teardown import teardown_container
+from app.internal.warm_pool import warm_pool
+from app.internal.jobs import LaunchJob, QueueFull, launch_jobs
+from app.internal.launcher import run_launch
+from app.internal.bundles import BundleTooLarge, SpooledBundle, spool_upload
+
+settings = get_settings()
 
 router = APIRouter(
     prefix="/containers",
@@ -44,153 +56,345 @@ router = APIRouter(
 class ContainerLaunchResponse(BaseModel):
     id: str
     host_id: uuid.UUID
+    job_id: str | None = None   # None when a warm environment was claimed
+    status: ContainerStatus
+    warm: bool = False
+
+class JobPhaseInfo(BaseModel):
+    name: str
+    started_at: datetime.datetime
+    finished_at: datetime.datetime | None = None
+    error: str | None = None
+
+class LaunchJobResponse(BaseModel):
+    id: str
+    container_id: str
+    host_id: uuid.UUID
+    user_id: uuid.UUID | None
+    status: ContainerStatus
+    phase: str
+    phases: list[JobPhaseInfo]
+    error: str | None = None
+    cache_hit: bool | None = None
+    created_at: datetime.datetime
+    finished_at: datetime.datetime | None = None
+
+class RestartMode(str, enum.Enum):
+    fast = "fast"
+    rebuild = "rebuild"
+
+class RestartResponse(BaseModel):
+    detail: str
+    mode: RestartMode
+    cache_hit: bool | None = None
+
+class ResetResponse(BaseModel):
+    detail: str
+    services: list[str]   # the services that were recreated
+
+class ServiceState(BaseModel):
+    service: str | None
+    name: str
+    image: str
+    status: str
 
 class ContainerInfoResponse(BaseModel):
     id: str
     host_id: str
-    user_id: str
+    user_id: str | None
     created_at: datetime.datetime
     name: str
     image: str
     status: str
     ip_address: IPvAnyAddress   # ← new field
+    services: list[ServiceState] = []
+
+class LiveState(BaseModel):
+    state: str                  # running / degraded / stopped / missing
+    services: list[ServiceState]
+
+class ContainerListItem(BaseModel):
+    id: str
+    name: str
+    host_id: uuid.UUID
+    user_id: uuid.UUID | None
+    template_digest: str | None
+    status: ContainerStatus
+    created_at: datetime.datetime
+    live: LiveState | None = None
+    live_error: str | None = None
+
+class ContainerPage(BaseModel):
+    items: list[ContainerListItem]
+    next_cursor: str | None = None
+
+
+def _service_states(services: list[dict]) -> list[ServiceState]:
+    return [
+        ServiceState(
+            service=s.get("service"),
+            name=s["name"],
+            image=s.get("image", ""),
+            status=s.get("status", ""),
+        ) for s in services
+    ]
+
+
+def _encode_cursor(cont: Container) -> str:
+    raw = f"{cont.created_at.isoformat()}|{cont.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime.datetime, uuid.UUID]:
+    try:
+        created, cid = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(created), uuid.UUID(cid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @router.post(
     "/launch",
     response_model=ContainerLaunchResponse,
     status_code=status.HTTP_202_ACCEPTED,
     summary="Launch containerized environment",
-    description="Upload and launch a Docker Compose environment for a user with automatic VPN integration."
+    description="Upload a Docker Compose environment for a user and queue it for launch with automatic VPN integration."
 )
 async def launch_container(
+    response: Response,
     user_id: uuid.UUID,
-    file: UploadFile = File(...),
+    template_digest: str | None = None,
+    file: UploadFile | None = File(None),
     db: AsyncSession = Depends(get_db),
 ):
     """
-    Launch a containerized environment for a user.
+    Queue a containerized environment launch for a user.
     
     This endpoint:
-    1. Accepts a ZIP file containing Docker Compose configuration
-    2. Selects an available container host with sufficient resources
-    3. Creates or retrieves a VPN profile for the user
-    4. Deploys the environment on the selected host
-    5. Sets up VPN routing for secure access
+    1. Takes a `template_digest` from `/templates`, or an ad-hoc ZIP file
+       containing Docker Compose configuration
+    2. Reserves a slot on the least-loaded healthy host
+    3. Records a `pending` container and returns its launch job id
+    
+    If the template has a warm pool with a ready environment, that one is
+    assigned to the user instead and the call returns `201` right away.
+    
+    The rest of the pipeline (VPN profiles, deployment on the host and
+    VPN routing) runs on a background worker; poll
+    `GET /containers/jobs/{job_id}` for progress.
     
     The ZIP file should contain:
     - docker-compose.yml or docker-compose.yaml
     - Any additional files referenced in the compose file
     - Optional Dockerfile(s) for custom images
     """
-    # 1) Read & base64-encode the ZIP
-    data = await file.read()
-    encoded_zip = base64.b64encode(data).decode()
-
-    # 2) Pick a healthy host with capacity
-    stmt = select(ContainerHost).where(
-        ContainerHost.status != HostStatus.offline,
-        ContainerHost.cpu_percent < 90,
-        ContainerHost.mem_percent < 90,
-        ContainerHost.current_containers < ContainerHost.max_containers
-    ).order_by(ContainerHost.current_containers)
-    host = (await db.execute(stmt)).scalar_one_or_none()
-    if not host:
-        raise HTTPException(status_code=503, detail="No available host")
-
-    # 3) Create or fetch the user's VPN profile, catching any errors
     try:
-        user_ovpn_path = await create_or_get_profile(db, str(user_id))
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to create VPN profile for user {user_id}: {e}"
-        )
-
-    # 4) Load the VPNProfile record so we know the assigned IP
-    stmt = select(VPNProfile).where(
-        VPNProfile.client_name == str(user_id),
-        VPNProfile.revoked == False
-    )
-    user_prof = (await db.execute(stmt)).scalar_one_or_none()
-    if not user_prof:
-        raise HTTPException(status_code=500, detail="User VPN profile missing")
+        launch_jobs.ensure_capacity()
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-    # 5) Pre-generate a container ID & create its VPN profile, again catching errors
-    container_id = str(uuid.uuid4())
-    try:
-        cont_ovpn_path = await create_or_get_profile(db, container_id)
-    except Exception as e:
+    if (template_digest is None) == (file is None):
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to create VPN profile for container {container_id}: {e}"
+            status_code=400,
+            detail="Provide exactly one of template_digest or file",
         )
 
-    stmt = select(VPNProfile).where(
-        VPNProfile.client_name == container_id,
-        VPNProfile.revoked == False
-    )
-    cont_prof = (await db.execute(stmt)).scalar_one_or_none()
-    if not cont_prof:
-        raise HTTPException(status_code=500, detail="Container VPN profile missing")
-
-    with open(cont_ovpn_path, "rb") as f:
-        encoded_vpn_container = base64.b64encode(f.read()).decode()
-
-    # 6) Tell the host agent to start the container
-    agent_url = f"http://{host.ip}:{host.api_port}/agent/containers"
-    payload = {
-        "name": container_id,
-        "docker_zip_base64": encoded_zip,
-        "vpn_conf_base64": encoded_vpn_container,
-    }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            agent_url,
-            json=payload,
-            headers={"X-Server-Key": host.cred_ref},
-            timeout=600.0,  # 10 minutes for container building
-        )
-
-    if resp.status_code != status.HTTP_201_CREATED:
-        text = resp.text
-        raise HTTPException(
-            status_code=resp.status_code,
-            detail=f"Agent failed to launch container: {text}"
-        )
+    # 1) Resolve the template, or spool the ad-hoc ZIP to disk (hashing as we go)
+    if template_digest:
+        tmpl = await db.get(ChallengeTemplate, template_digest)
+        if not tmpl:
+            raise HTTPException(status_code=404, detail="Template not found")
+
+        # Fast path: claim a pre-launched environment from the warm pool
+        try:
+            with timed(LAUNCH_PHASE, "warm_claim"):
+                warm = await warm_pool.claim(db, template_digest, user_id)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to assign warm environment: {e}"
+            )
+        if warm:
+            response.status_code = status.HTTP_201_CREATED
+            return ContainerLaunchResponse(
+                id=str(warm.id),
+                host_id=warm.host_id,
+                status=warm.status,
+                warm=True,
+            )
+        bundle = SpooledBundle(path=tmpl.storage_path, sha256=tmpl.digest, size=tmpl.size)
+    else:
+        try:
+            with timed(LAUNCH_PHASE, "upload"):
+                bundle = await spool_upload(file)
+        except BundleTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    discard = template_digest is None
+
+    # 2) Reserve a slot on the least-loaded healthy host
+    with timed(LAUNCH_PHASE, "host_selection"):
+        res = placement.reserve()
+    if not res:
+        if discard:
+            bundle.discard()
+        raise HTTPException(status_code=503, detail="No available host")
 
-    # 7) Persist in our DB
+    # 3) Persist a pending record, then turn the reservation into a used slot
+    container_id = str(uuid.uuid4())
     container = Container(
         id=container_id,
         user_id=user_id,
-        host_id=host.id,
+        host_id=res.host_id,
         name=container_id,
-        status=ContainerStatus.running,
+        template_digest=template_digest,
+        status=ContainerStatus.pending,
         created_at=datetime.datetime.utcnow(),
     )
-    db.add(container)
-    host.current_containers += 1
-    await db.commit()
+    try:
+        with timed(LAUNCH_PHASE, "db_commit"):
+            db.add(container)
+            await adjust_container_count(db, res.host_id, +1)
+            await db.commit()
+    except Exception:
+        placement.release(res)
+        if discard:
+            bundle.discard()
+        raise
+    placement.confirm(res)
+
+    # 4) Hand the rest of the pipeline to the worker pool
+    job = LaunchJob(container_id=container_id, host_id=res.host_id, user_id=user_id)
+    try:
+        launch_jobs.submit(job, lambda j: run_launch(j, bundle, discard=discard))
+    except QueueFull as e:
+        if discard:
+            bundle.discard()
+        # Never reached an agent: drop the row rather than leave an error behind
+        await db.delete(container)
+        await adjust_container_count(db, res.host_id, -1)
+        await db.commit()
+        placement.freed(res.host_id)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return ContainerLaunchResponse(
+        id=container_id,
+        host_id=res.host_id,
+        job_id=job.id,
+        status=container.status,
+    )
 
-    # 8) Allow only user↔container over tun0
-    apply_vpn_rule(user_prof.ip_address, cont_prof.ip_address)
 
-    return ContainerLaunchResponse(id=container_id, host_id=host.id)
+@router.post(
+    "/launch/bulk",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    summary="Launch environments for a cohort",
+    description="Launch one environment per user from a template or an uploaded ZIP. Per-user results are streamed back as NDJSON as they finish."
+)
+async def launch_cohort(
+    user_ids: list[uuid.UUID] = Form(...),
+    template_digest: str | None = Form(None),
+    file: UploadFile | None = File(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Bulk form of `/containers/launch` for classes and CTF events.
+
+    Warm environments are claimed and host slots reserved for the whole
+    cohort before anything starts, VPN profiles are issued in one batch and
+    agents are called concurrently (bounded per host). Each line of the
+    response is one user's result:
+    `{"user_id", "container_id", "host_id", "status", "warm", "cache_hit", "error"}`.
+    """
+    if (template_digest is None) == (file is None):
+        raise HTTPException(
+            status_code=400,
+            detail="Provide exactly one of template_digest or file",
+        )
+    if len(set(user_ids)) > settings.bulk_launch_max_users:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.bulk_launch_max_users} users per cohort",
+        )
+
+    # 1) Resolve the bundle once for the whole cohort
+    if template_digest:
+        tmpl = await db.get(ChallengeTemplate, template_digest)
+        if not tmpl:
+            raise HTTPException(status_code=404, detail="Template not found")
+        bundle = SpooledBundle(path=tmpl.storage_path, sha256=tmpl.digest, size=tmpl.size)
+    else:
+        try:
+            bundle = await spool_upload(file)
+        except BundleTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    discard = template_digest is None
+
+    # 2) Claim warm environments, reserve slots and record pending rows
+    cohort = CohortLaunch(user_ids, bundle, template_digest, discard)
+    try:
+        await cohort.plan(db)
+    except Exception:
+        if discard:
+            bundle.discard()
+        raise
+
+    # 3) Launch in the background; stream results as they land
+    cohort.start()
+    return StreamingResponse(cohort.stream(), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=LaunchJobResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Launch job progress",
+    description="Report the per-phase progress and final state of a launch job."
+)
+async def get_launch_job(job_id: str):
+    job = launch_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return LaunchJobResponse(
+        id=job.id,
+        container_id=job.container_id,
+        host_id=job.host_id,
+        user_id=job.user_id,
+        status=job.status,
+        phase=job.phase,
+        phases=[
+            JobPhaseInfo(
+                name=p.name,
+                started_at=p.started_at,
+                finished_at=p.finished_at,
+                error=p.error,
+            ) for p in job.phases
+        ],
+        error=job.error,
+        cache_hit=job.cache_hit,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    )
 
 @router.post(
     "/{container_id}/restart",
+    response_model=RestartResponse,
     status_code=status.HTTP_200_OK,
     summary="Restart container",
-    description="Restart an existing container environment."
+    description="Restart an existing container environment, or rebuild its images and recreate it."
 )
 async def restart_container(
     container_id: str,
+    mode: RestartMode = RestartMode.fast,
     db: AsyncSession = Depends(get_db),
 ):
     """
     Restart a container environment.
     
     This sends a restart command to the container host where the
-    container is running. The container will be stopped and started again.
+    container is running:
+    - `fast` (default) restarts the services in place without building
+    - `rebuild` rebuilds the images and recreates the services
     """
     # 1) Lookup the container record
     stmt = select(Container).where(Container.id == container_id)
@@ -204,14 +408,14 @@ async def restart_container(
         raise HTTPException(status_code=500, detail="Host missing")
 
     # 3) Forward to the host agent
-    agent_url = (f"http://{host.ip}:{host.api_port}"
-                 f"/agent/containers/{cont.name}/restart")
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            agent_url,
-            headers={"X-Server-Key": host.cred_ref},
-            timeout=30.0,
+    try:
+        resp = await agents.request(
+            host, "POST", f"/containers/{cont.name}/restart",
+            params={"mode": mode.value},
+            timeout=30.0 if mode == RestartMode.fast else 600.0,
         )
+    except AgentUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     if resp.status_code != 200:
         raise HTTPException(
             status_code=resp.status_code,
@@ -219,30 +423,35 @@ async def restart_container(
         )
 
     # 4) Update status
+    live_state.invalidate(host.id)
     cont.status = ContainerStatus.running
     await db.commit()
-    return {"detail": "Container restarted successfully"}
+    return RestartResponse(
+        detail="Container restarted successfully",
+        mode=mode,
+        cache_hit=resp.json().get("cache_hit"),
+    )
 
 
-@router.delete(
-    "/{container_id}",
+@router.post(
+    "/{container_id}/reset",
+    response_model=ResetResponse,
     status_code=status.HTTP_200_OK,
-    summary="Stop and remove container",
-    description="Stop, remove, and clean up a container environment along with its VPN access."
+    summary="Reset container",
+    description="Put a container environment back to the snapshot its host took right after it first started."
 )
-async def stop_container(
+async def reset_container(
     container_id: str,
+    force: bool = False,
     db: AsyncSession = Depends(get_db),
 ):
     """
-    Stop and completely remove a container environment.
-    
-    This operation:
-    1. Stops and removes the container from the host
-    2. Removes VPN routing rules
-    3. Revokes the container's VPN profile
-    4. Updates host capacity counters
-    5. Removes the container record from the database
+    Undo every change made inside a container environment.
+
+    The host recreates only the services whose filesystem or volumes
+    differ from the snapshot, from committed images, so nothing is
+    rebuilt and untouched services keep running. `force` recreates every
+    service.
     """
     # 1) Lookup the container record
     stmt = select(Container).where(Container.id == container_id)
@@ -255,28 +464,69 @@ async def stop_container(
     if not host:
         raise HTTPException(status_code=500, detail="Host missing")
 
-    # 3) Tell the host agent to remove it
-    agent_url = f"http://{host.ip}:{host.api_port}/agent/containers/{cont.name}"
-    async with httpx.AsyncClient() as client:
-        resp = await client.delete(
-            agent_url,
-            headers={"X-Server-Key": host.cred_ref},
-            timeout=30.0,
+    # 3) Forward to the host agent
+    try:
+        resp = await agents.request(
+            host, "POST", f"/containers/{cont.name}/reset",
+            params={"force": str(force).lower()},
+            timeout=120.0,
         )
-    if resp.status_code not in (200, 202, 204, 404):
+    except AgentUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if resp.status_code != 200:
         raise HTTPException(
             status_code=resp.status_code,
-            detail=f"Agent delete failed: {resp.json()}"
+            detail=f"Agent reset failed: {resp.json()}"
         )
 
-    # 4) Tear down VPN routing and profile
-    await remove_vpn_profile(db, cont.id)
-
-    # 5) Update DB
-    await db.delete(cont)
-    host.current_containers = max(0, host.current_containers - 1)
+    # 4) Update status
+    services = resp.json().get("services") or []
+    if services:
+        live_state.invalidate(host.id)
+    cont.status = ContainerStatus.running
     await db.commit()
-    return {"detail": "Container stopped and removed successfully"}
+    return ResetResponse(
+        detail="Container reset successfully" if services else "Container already matches its snapshot",
+        services=services,
+    )
+
+
+@router.delete(
+    "/{container_id}",
+    status_code=status.HTTP_200_OK,
+    summary="Stop and remove container",
+    description="Stop, remove, and clean up a container environment along with its VPN access."
+)
+async def stop_container(
+    container_id: str,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Stop and completely remove a container environment.
+    
+    This operation:
+    1. Marks the container stopped and frees its host capacity
+    2. Removes VPN routing rules
+    3. Revokes the container's VPN profile
+    4. Queues the removal from the host, which happens in the background;
+       the record is deleted once the host has accepted it
+    """
+    # 1) Lookup the container record
+    with timed(STOP_PHASE, "lookup"):
+        stmt = select(Container).where(Container.id == container_id)
+        cont = (await db.execute(stmt)).scalar_one_or_none()
+        if not cont:
+            raise HTTPException(status_code=404, detail="Container not found")
+
+        # 2) Find its host
+        host = await db.get(ContainerHost, cont.host_id)
+        if not host:
+            raise HTTPException(status_code=500, detail="Host missing")
+
+    # 3) Free its slot and VPN access; removal from the host is queued
+    if cont.status != ContainerStatus.stopped:
+        await teardown_container(db, cont, host)
+    return {"detail": "Container stopped; removal from its host is queued"}
 
 
 @router.get(
@@ -298,18 +548,17 @@ async def inspect_container(
     if not host:
         raise HTTPException(status_code=500, detail="Host missing")
 
-    agent_url = f"http://{host.ip}:{host.api_port}/agent/containers"
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            agent_url,
-            headers={"X-Server-Key": host.cred_ref},
-            timeout=10.0,
-        )
-    live = resp.json()
-    
-    info = next((c for c in live if cont.name in c["name"] ), None)
-    if not info:
+    # The agent indexes containers by compose project: a single cheap lookup
+    try:
+        resp = await agents.request(host, "GET", f"/containers/{cont.name}", timeout=10.0)
+    except AgentUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if resp.status_code == 404:
         raise HTTPException(status_code=404, detail="Container not running")
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"Agent lookup failed: {resp.text}")
+    services = resp.json()
+    info = services[0]
 
     vpn_stmt = select(VPNProfile).where(
         VPNProfile.client_name == container_id,
@@ -322,38 +571,85 @@ async def inspect_container(
     return ContainerInfoResponse(
         id=container_id,
         host_id=str(cont.host_id),
-        user_id=str(cont.user_id),
+        user_id=str(cont.user_id) if cont.user_id else None,
         created_at=cont.created_at,
         name=info["name"],
         image=info.get("image", ""),
-        status=info.get("status", ""),
-        ip_address=vpn_prof.ip_address
+        status=info.get("status", "") if len(services) == 1 else summarize(services),
+        ip_address=vpn_prof.ip_address,
+        services=_service_states(services),
     )
 
 
 @router.get(
     "/",
-    # response_model=list[ContainerInfoResponse],
+    response_model=ContainerPage,
     status_code=status.HTTP_200_OK,
-    summary="List all containers",
-    description="Retrieve a list of all containers managed by the platform."
+    summary="List containers",
+    description="Page through containers (newest first) with optional host, user and status filters; with live=true, joined with live state from the hosts."
 )
 async def list_all_containers(
+    host_id: uuid.UUID | None = None,
+    user_id: uuid.UUID | None = None,
+    status_filter: ContainerStatus | None = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None,
+    live: bool = False,
     db: AsyncSession = Depends(get_db),
 ):
     """
-    Get a list of all containers in the system.
-    
-    Returns basic information about each container including:
-    - Container ID and name
-    - Associated user ID
-    - Host assignment
-    - Creation timestamp
-    - Current status
+    Keyset-paginated container listing.
+
+    Pass the returned `next_cursor` back as `cursor` for the following
+    page. With `live=true` every host on the page is asked for
+    its running containers once, concurrently, through a short-TTL cache;
+    hosts that cannot be reached are reported per row in `live_error`.
     """
-    # 1) Fetch all Container records
+    # 1) One page of rows, newest first, resuming after the cursor
     stmt = select(Container)
-    result = await db.execute(stmt)
-    containers = result.scalars().all()
-    
-    return containers
+    if host_id:
+        stmt = stmt.where(Container.host_id == host_id)
+    if user_id:
+        stmt = stmt.where(Container.user_id == user_id)
+    if status_filter:
+        stmt = stmt.where(Container.status == status_filter)
+    if cursor:
+        created_at, cid = _decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Container.created_at, Container.id) < (created_at, cid))
+    stmt = stmt.order_by(Container.created_at.desc(), Container.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).scalars().all()
+    page, more = rows[:limit], len(rows) > limit
+
+    # 2) Live state: one snapshot per involved host, fetched concurrently
+    snaps = {}
+    if live and page:
+        host_ids = {c.host_id for c in page}
+        hosts = (await db.execute(
+            select(ContainerHost).where(ContainerHost.id.in_(host_ids))
+        )).scalars().all()
+        snaps = await live_state.gather(hosts)
+
+    # 3) Join in memory
+    items = []
+    for c in page:
+        item = ContainerListItem(
+            id=str(c.id),
+            name=c.name,
+            host_id=c.host_id,
+            user_id=c.user_id,
+            template_digest=c.template_digest,
+            status=c.status,
+            created_at=c.created_at,
+        )
+        snap = snaps.get(c.host_id)
+        if snap and snap.error:
+            item.live_error = snap.error
+        elif snap:
+            services = snap.services(c)
+            item.live = LiveState(state=summarize(services), services=_service_states(services))
+        items.append(item)
+
+    return ContainerPage(
+        items=items,
+        next_cursor=_encode_cursor(page[-1]) if more else None,
+    )
@@ -1,4 +1,8 @@
+import datetime
+import uuid
+
 from fastapi import Header, HTTPException, status, Depends
+from sqlalchemy import or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 import jwt
@@ -6,11 +10,33 @@ import jwt
 from app.core.config import get_settings
 from app.core.security import hash_token
 from app.core.database import SessionLocal
-from app.models import User, UserRole, APIKey
+from app.models import User, UserRole, APIKey, APIKeyOwner
+from app.internal.credentials import credentials
+from app.internal.prometheus import AUTH
 
 settings = get_settings()
 
 
+def _active_key(token_hash: str):
+    now = datetime.datetime.utcnow()
+    return select(APIKey).where(
+        APIKey.key_hash == token_hash,
+        or_(APIKey.expires_at.is_(None), APIKey.expires_at > now),
+    )
+
+
+def _subject(payload: dict) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _rejected(kind: str, detail: str) -> HTTPException:
+    AUTH.labels(kind, "rejected").inc()
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+
 async def get_db():
     async with SessionLocal() as sess:
         yield sess
@@ -20,6 +46,12 @@ async def get_current_admin(
     x_admin_key: str = Header(..., alias="X-Admin-Key"),
     db: AsyncSession = Depends(get_db),
 ) -> User:
+    token_hash = hash_token(x_admin_key)
+    cached = credentials.get(token_hash, APIKeyOwner.admin)
+    if cached:
+        AUTH.labels("admin_key", "cached").inc()
+        return cached.user
+
     try:
         payload = jwt.decode(
             x_admin_key,
@@ -27,29 +59,42 @@ async def get_current_admin(
             algorithms=["HS256"],
             options={"verify_exp": False},  # we allow timeless tokens
         )
-        user_id = payload.get("sub")
+        user_id = _subject(payload)
     except jwt.PyJWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Bad token")
+        raise _rejected("admin_key", "Bad token")
+    if not user_id:
+        raise _rejected("admin_key", "Bad token")
+    generation = credentials.generation(user_id)
 
     # Is token hash present & not revoked/expired?
-    stmt = select(APIKey).where(APIKey.key_hash == hash_token(x_admin_key))
-    res = await db.execute(stmt)
-    if not res.scalar_one_or_none():
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Key revoked")
+    res = await db.execute(_active_key(token_hash))
+    key = res.scalar_one_or_none()
+    if not key:
+        raise _rejected("admin_key", "Key revoked")
 
     # Load user
     stmt = select(User).where(User.id == user_id, User.role == UserRole.admin)
     res = await db.execute(stmt)
     user = res.scalar_one_or_none()
     if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No such admin")
+        raise _rejected("admin_key", "No such admin")
 
+    credentials.put(
+        token_hash, APIKeyOwner.admin, user.id, generation, key.expires_at, user=user
+    )
+    AUTH.labels("admin_key", "verified").inc()
     return user
 
 async def get_server_key(
     x_server_key: str = Header(..., alias="X-Server-Key"),
     db: AsyncSession = Depends(get_db),
 ) -> str:
+    token_hash = hash_token(x_server_key)
+    cached = credentials.get(token_hash, APIKeyOwner.server)
+    if cached:
+        AUTH.labels("server_key", "cached").inc()
+        return str(cached.owner_id)
+
     # Decode & verify JWT
     try:
         payload = jwt.decode(
@@ -58,18 +103,22 @@ async def get_server_key(
             algorithms=["HS256"],
             options={"verify_exp": False},
         )
-        host_id = payload.get("sub")
+        host_id = _subject(payload)
     except jwt.PyJWTError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Bad server token")
+        raise _rejected("server_key", "Bad server token")
+    if not host_id:
+        raise _rejected("server_key", "Bad server token")
+    generation = credentials.generation(host_id)
 
     # Ensure we have an active server APIKey
-    stmt = select(APIKey).where(
-        APIKey.key_hash == hash_token(x_server_key),
-        APIKey.owner_id == host_id
-    )
+    stmt = _active_key(token_hash).where(APIKey.owner_id == host_id)
     res = await db.execute(stmt)
-    if not res.scalar_one_or_none():
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Server key revoked or invalid")
+    key = res.scalar_one_or_none()
+    if not key:
+        raise _rejected("server_key", "Server key revoked or invalid")
+
+    credentials.put(token_hash, APIKeyOwner.server, host_id, generation, key.expires_at)
+    AUTH.labels("server_key", "verified").inc()
 
     # Optionally: return host_id so handlers can verify path matches token
-    return host_id
\ No newline at end of file
+    return str(host_id)
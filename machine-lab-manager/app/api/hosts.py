@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel, conint
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -7,9 +7,19 @@ import uuid
 
 from app.models import ContainerHost, HostStatus, APIKey, APIKeyOwner
 from app.api.deps import get_db, get_current_admin, get_server_key
+from app.core.config import get_settings
 from app.core.security import hash_token, create_admin_token
+from app.internal.agent_client import agents
+from app.internal.credentials import credentials
+from app.internal.failure_detector import failure_detector
+from app.internal.fleet import fleet
+from app.internal.host_metrics import host_metrics
+from app.internal.host_state import HostState, host_state
+from app.internal.placement import placement
 import enum
 
+settings = get_settings()
+
 router = APIRouter(
     prefix="/hosts",
     tags=["hosts"],
@@ -43,10 +53,20 @@ class HostBase(BaseModel):
     max_containers: conint(gt=0)
 
 
+class EnvironmentUsage(BaseModel):
+    name: str
+    cpu_percent: float   # of one CPU
+    mem_bytes: int
+
+
 class HeartbeatRequest(BaseModel):
     cpu: int
     mem: int
     containers: int
+    ops_queued: int = 0     # agent operations waiting for their environment or a build slot
+    ops_running: int = 0
+    inventory: str | None = None   # digest of the agent's environment inventory
+    environments: list[EnvironmentUsage] = []   # heaviest environments by CPU
 
 
 class HostCreate(HostBase):
@@ -69,11 +89,34 @@ class HostInfo(HostBase):
     cpu_percent: int
     mem_percent: int
     healthiness: Healthiness
+    phi: float | None = None    # heartbeat suspicion level (None when offline)
+    ops_queued: int = 0
+    ops_running: int = 0
 
     class Config:
         orm_mode = True
 
 
+def _to_info(h: HostState) -> HostInfo:
+    return HostInfo(
+        id=h.id,
+        hostname=h.hostname,
+        ip=h.ip,
+        ssh_port=h.ssh_port,
+        api_port=h.api_port,
+        max_containers=h.max_containers,
+        current_containers=h.current_containers,
+        cpu_percent=h.cpu_percent,
+        mem_percent=h.mem_percent,
+        status=h.status,
+        last_seen=h.last_seen,
+        healthiness=compute_healthiness(h.status, h.cpu_percent, h.mem_percent),
+        phi=failure_detector.phi(h.id),
+        ops_queued=h.ops_queued,
+        ops_running=h.ops_running,
+    )
+
+
 class HostRegisterResponse(BaseModel):
     host_id: uuid.UUID
     server_key: str
@@ -87,6 +130,26 @@ class HostStatusResponse(BaseModel):
     mem_percent: int
     healthiness: Healthiness
     current_containers: int
+    phi: float | None = None
+    ops_queued: int = 0
+    ops_running: int = 0
+    top_environments: list[EnvironmentUsage] = []
+
+
+class MetricPoint(BaseModel):
+    t: datetime.datetime          # start of the bin
+    samples: int                  # heartbeats in the bin
+    cpu_avg: float
+    cpu_max: int
+    mem_avg: float
+    mem_max: int
+
+
+class HostMetricsResponse(BaseModel):
+    host_id: uuid.UUID
+    resolution: str               # raw | 1m | 1h
+    step: int                     # seconds per point, rounded up to the resolution
+    points: list[MetricPoint]
 
 
 # ─── Endpoints ─────────────────────────────────────────────────────────
@@ -99,7 +162,7 @@ class HostStatusResponse(BaseModel):
     summary="List all container hosts",
     description="Retrieve a list of all registered container hosts with their current status and health metrics."
 )
-async def list_hosts(db: AsyncSession = Depends(get_db)):
+async def list_hosts():
     """
     Get a list of all registered container hosts.
     
@@ -108,31 +171,11 @@ async def list_hosts(db: AsyncSession = Depends(get_db)):
     - Resource usage (CPU and memory percentages)
     - Container count and capacity
     - Last seen timestamp
+    
+    Served from the live host state table, so the latest heartbeat is
+    visible before it is written back to the database.
     """
-    stmt = select(ContainerHost)
-    res = await db.execute(stmt)
-    hosts = res.scalars().all()
-
-    out: list[HostInfo] = []
-    for h in hosts:
-        health = compute_healthiness(h.status, h.cpu_percent, h.mem_percent)
-        out.append(
-            HostInfo(
-                id=h.id,
-                hostname=h.hostname,
-                ip=h.ip,
-                ssh_port=h.ssh_port,
-                api_port=h.api_port,
-                max_containers=h.max_containers,
-                current_containers=h.current_containers,
-                cpu_percent=h.cpu_percent,
-                mem_percent=h.mem_percent,
-                status=h.status,
-                last_seen=h.last_seen,
-                healthiness=health,
-            )
-        )
-    return out
+    return [_to_info(h) for h in host_state.all()]
 
 
 @router.get(
@@ -142,13 +185,8 @@ async def list_hosts(db: AsyncSession = Depends(get_db)):
     summary="Fetch status, last_seen & container count for a host",
     dependencies=[Depends(get_current_admin)],
 )
-async def get_host_status(
-    host_id: uuid.UUID,
-    db: AsyncSession = Depends(get_db),
-):
-    stmt = select(ContainerHost).where(ContainerHost.id == host_id)
-    res = await db.execute(stmt)
-    h = res.scalar_one_or_none()
+async def get_host_status(host_id: uuid.UUID):
+    h = host_state.get(host_id)
     if not h:
         raise HTTPException(status_code=404, detail="Host not found")
 
@@ -161,9 +199,77 @@ async def get_host_status(
         cpu_percent=h.cpu_percent,
         mem_percent=h.mem_percent,
         healthiness=health,
+        phi=failure_detector.phi(h.id),
+        ops_queued=h.ops_queued,
+        ops_running=h.ops_running,
+        top_environments=h.top_environments,
     )
 
 
+def _epoch(t: datetime.datetime) -> float:
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.timestamp()
+
+
+@router.get(
+    "/{host_id}/metrics",
+    response_model=HostMetricsResponse,
+    dependencies=[Depends(get_current_admin)],
+    summary="CPU/mem history of a host",
+)
+async def get_host_metrics(
+    host_id: uuid.UUID,
+    start: datetime.datetime | None = Query(None, alias="from"),
+    end: datetime.datetime | None = Query(None, alias="to"),
+    step: int = Query(60, ge=1),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Heartbeat CPU/mem of a host over [from, to) (default: the last hour),
+    in bins of `step` seconds. Steps under a minute are served from the
+    in-memory heartbeat ring while it reaches back to `from`; longer steps
+    from the 1-minute rollups, and steps of an hour or more, or ranges past
+    the minute retention, from the 1-hour rollups.
+    """
+    if not host_state.get(host_id):
+        raise HTTPException(status_code=404, detail="Host not found")
+    t_end = _epoch(end) if end else datetime.datetime.now(datetime.timezone.utc).timestamp()
+    t_start = _epoch(start) if start else t_end - 3600
+    if t_end <= t_start:
+        raise HTTPException(status_code=422, detail="'to' must be after 'from'")
+    if (t_end - t_start) / step > settings.host_metrics_max_points:
+        raise HTTPException(
+            status_code=422,
+            detail=f"More than {settings.host_metrics_max_points} points; use a larger step",
+        )
+    resolution, step, points = await host_metrics.series(db, host_id, t_start, t_end, step)
+    return HostMetricsResponse(host_id=host_id, resolution=resolution, step=step, points=points)
+
+
+@router.get(
+    "/reconciler",
+    dependencies=[Depends(get_current_admin)],
+    summary="Fleet reconciler counters",
+)
+async def reconciler_stats():
+    """Repairs made so far by the fleet reconciler, and its last pass."""
+    return fleet.stats()
+
+
+@router.post(
+    "/reconcile",
+    dependencies=[Depends(get_current_admin)],
+    summary="Reconcile the fleet now",
+)
+async def reconcile_fleet():
+    """
+    Run a reconciler pass right away: diff every online host's environments
+    against the database and repair the drift. Returns what was repaired.
+    """
+    return await fleet.reconcile()
+
+
 @router.post(
     "/",
     response_model=HostRegisterResponse,
@@ -215,6 +321,8 @@ async def register_host(
     new_host.cred_ref = token
 
     await db.commit()
+    host_state.upsert(new_host)
+    placement.upsert(new_host)
 
     return HostRegisterResponse(host_id=new_host.id, server_key=token)
 
@@ -239,22 +347,10 @@ async def update_host(
         setattr(h, field, value)
     await db.commit()
     await db.refresh(h)
+    host_state.upsert(h)
+    placement.upsert(h)
 
-    health = compute_healthiness(h.status, h.cpu_percent, h.mem_percent)
-    return HostInfo(
-        id=h.id,
-        hostname=h.hostname,
-        ip=h.ip,
-        ssh_port=h.ssh_port,
-        api_port=h.api_port,
-        max_containers=h.max_containers,
-        current_containers=h.current_containers,
-        cpu_percent=h.cpu_percent,
-        mem_percent=h.mem_percent,
-        status=h.status,
-        last_seen=h.last_seen,
-        healthiness=health,
-    )
+    return _to_info(host_state.get(h.id))
 
 
 @router.delete(
@@ -283,6 +379,12 @@ async def delete_host(
 
     await db.delete(host)
     await db.commit()
+    host_state.remove(host_id)
+    placement.remove(host_id)
+    failure_detector.forget(host_id)
+    agents.forget(host_id)
+    credentials.invalidate(host_id)
+    fleet.forget(host_id)
     return {"detail": "Host deleted successfully"}
 
 
@@ -296,7 +398,6 @@ async def delete_host(
 async def host_heartbeat(
     host_id: uuid.UUID,
     payload: HeartbeatRequest,
-    db: AsyncSession = Depends(get_db),
 ):
     """
     Receive heartbeat from a container host.
@@ -305,21 +406,20 @@ async def host_heartbeat(
     - Current CPU usage percentage
     - Current memory usage percentage  
     - Number of running containers
+    - Depth of the agent's operation queue
+    - The environments using the most CPU, from the agent's cgroup metrics
     
-    This updates the host's status to healthy and records the metrics.
+    This updates the host's status to healthy and records the metrics
+    in memory; they reach the database within HOST_FLUSH_INTERVAL seconds.
+    The container count is informational: `current_containers` is owned
+    by the manager, which reserves slots before the agent ever sees them.
     """
-    stmt = select(ContainerHost).where(ContainerHost.id == host_id)
-    res = await db.execute(stmt)
-    host = res.scalar_one_or_none()
-    if not host:
+    # Memory only; the host state table writes changes back in batches
+    if not host_state.heartbeat(
+        host_id, payload.cpu, payload.mem, payload.ops_queued, payload.ops_running,
+        payload.inventory, [e.model_dump() for e in payload.environments],
+    ):
         raise HTTPException(status_code=404, detail="Host not found")
-
-    # Update host status
-    host.current_containers = payload.containers
-    host.cpu_percent = payload.cpu
-    host.mem_percent = payload.mem
-    host.last_seen = datetime.datetime.utcnow()
-    host.status = HostStatus.healthy
-    await db.commit()
+    failure_detector.heartbeat(host_id)
 
     return {"ack": True}
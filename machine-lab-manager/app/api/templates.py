@@ -0,0 +1,210 @@
+# app/api/templates.py
+import asyncio
+import datetime
+import os
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    UploadFile,
+    File,
+    HTTPException,
+    Response,
+    status,
+)
+from pydantic import BaseModel, conint
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.api.deps import get_db, get_current_admin
+from app.models import ChallengeTemplate, Container, ContainerStatus
+from app.internal.bundles import BundleTooLarge, spool_upload
+from app.internal.templates import (
+    InvalidBundle,
+    parse_bundle_metadata,
+    store_bundle,
+)
+from app.internal.warm_pool import warm_pool
+
+router = APIRouter(
+    prefix="/templates",
+    tags=["templates"],
+    dependencies=[Depends(get_current_admin)],  # admin-only
+)
+
+
+# ─── Schemas ────────────────────────────────────────────────────────────
+
+class TemplateInfo(BaseModel):
+    digest: str
+    name: str
+    size: int
+    meta: dict
+    warm_pool_size: int
+    created_at: datetime.datetime
+
+
+class WarmPoolConfig(BaseModel):
+    size: conint(ge=0)
+
+
+class WarmPoolInfo(BaseModel):
+    size: int           # configured pool size
+    target: int         # 0 while the template is idle
+    ready: int          # running, unassigned environments
+    launching: int      # unassigned environments still launching
+    idle: bool
+
+
+def _to_info(t: ChallengeTemplate) -> TemplateInfo:
+    return TemplateInfo(
+        digest=t.digest,
+        name=t.name,
+        size=t.size,
+        meta=t.meta,
+        warm_pool_size=t.warm_pool_size or 0,
+        created_at=t.created_at,
+    )
+
+
+# ─── Endpoints ─────────────────────────────────────────────────────────
+
+@router.post(
+    "/",
+    response_model=TemplateInfo,
+    status_code=status.HTTP_201_CREATED,
+    summary="Upload a challenge template",
+    description="Store a challenge bundle by its sha256 digest. Uploading the same bundle twice returns the existing template."
+)
+async def upload_template(
+    response: Response,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Upload a challenge ZIP once and launch it by digest afterwards.
+
+    The bundle must have a docker-compose file at its root; a
+    `challenge.yml` next to it is parsed into the template metadata.
+    """
+    try:
+        bundle = await spool_upload(file)
+    except BundleTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    existing = await db.get(ChallengeTemplate, bundle.sha256)
+    if existing:
+        bundle.discard()
+        response.status_code = status.HTTP_200_OK
+        return _to_info(existing)
+
+    try:
+        meta = await asyncio.to_thread(parse_bundle_metadata, bundle.path)
+    except InvalidBundle as e:
+        bundle.discard()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    path = await asyncio.to_thread(store_bundle, bundle)
+    tmpl = ChallengeTemplate(
+        digest=bundle.sha256,
+        name=meta["challenge"].get("name") or file.filename or bundle.sha256[:12],
+        size=bundle.size,
+        storage_path=path,
+        meta=meta,
+        warm_pool_size=0,
+        created_at=datetime.datetime.utcnow(),
+    )
+    db.add(tmpl)
+    await db.commit()
+    return _to_info(tmpl)
+
+
+@router.get(
+    "/",
+    response_model=list[TemplateInfo],
+    summary="List challenge templates",
+)
+async def list_templates(db: AsyncSession = Depends(get_db)):
+    res = await db.execute(
+        select(ChallengeTemplate).order_by(ChallengeTemplate.created_at)
+    )
+    return [_to_info(t) for t in res.scalars().all()]
+
+
+@router.get(
+    "/{digest}",
+    response_model=TemplateInfo,
+    summary="Get a challenge template",
+)
+async def get_template(digest: str, db: AsyncSession = Depends(get_db)):
+    tmpl = await db.get(ChallengeTemplate, digest)
+    if not tmpl:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return _to_info(tmpl)
+
+
+@router.delete(
+    "/{digest}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Delete a challenge template",
+    description="Remove a template that no active environment is using."
+)
+async def delete_template(digest: str, db: AsyncSession = Depends(get_db)):
+    tmpl = await db.get(ChallengeTemplate, digest)
+    if not tmpl:
+        raise HTTPException(status_code=404, detail="Template not found")
+
+    in_use = (await db.execute(
+        select(func.count()).select_from(Container).where(
+            Container.template_digest == digest,
+            Container.status.in_([ContainerStatus.pending, ContainerStatus.running]),
+        )
+    )).scalar_one()
+    if in_use:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Template is used by {in_use} active environment(s)"
+        )
+
+    await db.delete(tmpl)
+    await db.commit()
+    try:
+        await asyncio.to_thread(os.remove, tmpl.storage_path)
+    except FileNotFoundError:
+        pass
+
+
+@router.get(
+    "/{digest}/pool",
+    response_model=WarmPoolInfo,
+    summary="Get warm pool state",
+)
+async def get_warm_pool(digest: str, db: AsyncSession = Depends(get_db)):
+    tmpl = await db.get(ChallengeTemplate, digest)
+    if not tmpl:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return WarmPoolInfo(**await warm_pool.stats(db, tmpl))
+
+
+@router.put(
+    "/{digest}/pool",
+    response_model=WarmPoolInfo,
+    summary="Resize warm pool",
+    description="Keep `size` pre-launched environments of this template ready to be claimed. `0` drains the pool."
+)
+async def set_warm_pool(
+    digest: str,
+    body: WarmPoolConfig,
+    db: AsyncSession = Depends(get_db),
+):
+    tmpl = await db.get(ChallengeTemplate, digest)
+    if not tmpl:
+        raise HTTPException(status_code=404, detail="Template not found")
+    tmpl.warm_pool_size = body.size
+    await db.commit()
+    if body.size:
+        # An explicit resize counts as demand, so the pool fills right away
+        warm_pool.note_demand(digest)
+    warm_pool.wake()
+    return WarmPoolInfo(**await warm_pool.stats(db, tmpl))
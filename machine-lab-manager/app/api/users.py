@@ -1,16 +1,20 @@
 # app/api/users.py
 import datetime
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.api.deps import get_db, get_current_admin
 from app.models import VPNProfile
+from app.internal.cert_pool import cert_pool
+from app.internal.firewall import firewall
 from app.internal.vpn import (
     create_or_get_profile,
+    profile_config,
     remove_vpn_profile,
+    vpn_addresses,
 )
 
 router = APIRouter(
@@ -25,6 +29,36 @@ class CreateVPNReq(BaseModel):
     client_name: str
 
 
+class PoolUtilization(BaseModel):
+    pool: str
+    subnet: str
+    capacity: int
+    allocated: int
+    free: int
+    utilization: float
+
+
+class ReconcileResult(BaseModel):
+    pairs: int
+    added: int
+    removed: int
+
+
+class CertPoolStats(BaseModel):
+    ready: int
+    target: int
+    issued: int
+    on_demand: int
+
+
+def _ovpn_response(config: bytes, client_name: str) -> Response:
+    return Response(
+        content=config,
+        media_type="application/x-openvpn-profile",
+        headers={"Content-Disposition": f'attachment; filename="{client_name}.ovpn"'},
+    )
+
+
 # ─── Endpoints ─────────────────────────────────────────────────────────
 
 @router.post(
@@ -47,12 +81,8 @@ async def create_vpn_profile(
     into OpenVPN clients for secure access to containerized environments.
     """
     print(f"Creating VPN profile for {req.client_name}")
-    path = await create_or_get_profile(db, req.client_name)
-    return FileResponse(
-        path,
-        media_type="application/x-openvpn-profile",
-        filename=f"{req.client_name}.ovpn",
-    )
+    prof = await create_or_get_profile(db, req.client_name)
+    return _ovpn_response(await profile_config(prof), req.client_name)
 
 
 @router.post(
@@ -93,9 +123,35 @@ async def rotate_vpn_profile(
     await remove_vpn_profile(db, client_name)
 
     # Create fresh profile
-    path = await create_or_get_profile(db, client_name)
-    return FileResponse(
-        path,
-        media_type="application/x-openvpn-profile",
-        filename=f"{client_name}.ovpn",
-    )
+    prof = await create_or_get_profile(db, client_name)
+    return _ovpn_response(await profile_config(prof), client_name)
+
+
+@router.get(
+    "/vpn/pools",
+    response_model=list[PoolUtilization],
+    summary="VPN address pool utilization",
+    description="Capacity and allocated addresses of the user and container VPN pools.",
+)
+async def vpn_pool_utilization():
+    return [PoolUtilization(**p) for p in vpn_addresses.stats()]
+
+
+@router.get(
+    "/vpn/cert-pool",
+    response_model=CertPoolStats,
+    summary="VPN certificate pool",
+    description="Pre-issued client certificates ready, and how many profiles had to wait for one.",
+)
+async def vpn_cert_pool():
+    return CertPoolStats(**cert_pool.stats())
+
+
+@router.post(
+    "/vpn/firewall/reconcile",
+    response_model=ReconcileResult,
+    summary="Reconcile VPN firewall",
+    description="Recompute user↔container access pairs from the database and apply the difference in one transaction.",
+)
+async def reconcile_vpn_firewall():
+    return ReconcileResult(**await firewall.reconcile())
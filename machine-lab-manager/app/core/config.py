@@ -16,6 +16,90 @@ class Settings(BaseSettings):
     jwt_secret: str = Field(..., env="JWT_SECRET")
     admin_default_email: str = Field(..., env="ADMIN_DEFAULT_EMAIL")
     admin_default_password: str = Field(..., env="ADMIN_DEFAULT_PASSWORD")
+    credential_cache_size: int = Field(default=1024, env="CREDENTIAL_CACHE_SIZE")
+    credential_cache_ttl: int = Field(default=300, env="CREDENTIAL_CACHE_TTL")
+
+    # Launch jobs
+    launch_workers: int = Field(default=4, env="LAUNCH_WORKERS")
+    launch_queue_size: int = Field(default=256, env="LAUNCH_QUEUE_SIZE")
+    launch_job_ttl: int = Field(default=3600, env="LAUNCH_JOB_TTL")
+
+    # Challenge bundles
+    bundle_spool_dir: str = Field(default="/var/tmp/mlab-bundles", env="BUNDLE_SPOOL_DIR")
+    bundle_max_mb: int = Field(default=1024, env="BUNDLE_MAX_MB")
+    template_dir: str = Field(default="/var/lib/mlab/templates", env="TEMPLATE_DIR")
+
+    # Warm pools
+    warm_pool_interval: int = Field(default=10, env="WARM_POOL_INTERVAL")
+    warm_pool_idle_seconds: int = Field(default=1800, env="WARM_POOL_IDLE_SECONDS")
+
+    # Teardown: hand-off of stopped environments to their agents
+    teardown_retry_interval: int = Field(default=30, env="TEARDOWN_RETRY_INTERVAL")
+    teardown_concurrency: int = Field(default=16, env="TEARDOWN_CONCURRENCY")
+
+    # Host state
+    host_flush_interval: int = Field(default=5, env="HOST_FLUSH_INTERVAL")
+    heartbeat_interval: int = Field(default=10, env="HEARTBEAT_INTERVAL")
+    failure_detector_window: int = Field(default=20, env="FAILURE_DETECTOR_WINDOW")
+
+    # Prometheus: bearer token required at GET /metrics (unset: open)
+    metrics_token: str | None = Field(default=None, env="METRICS_TOKEN")
+
+    # Host metrics history
+    host_metrics_raw_samples: int = Field(default=360, env="HOST_METRICS_RAW_SAMPLES")
+    host_metrics_flush_interval: int = Field(default=60, env="HOST_METRICS_FLUSH_INTERVAL")
+    host_metrics_minute_retention: int = Field(default=7, env="HOST_METRICS_MINUTE_RETENTION")  # days
+    host_metrics_hour_retention: int = Field(default=365, env="HOST_METRICS_HOUR_RETENTION")  # days
+    host_metrics_max_points: int = Field(default=1440, env="HOST_METRICS_MAX_POINTS")
+
+    # Placement
+    placement_reservation_ttl: int = Field(default=60, env="PLACEMENT_RESERVATION_TTL")
+    placement_sync_interval: int = Field(default=60, env="PLACEMENT_SYNC_INTERVAL")
+
+    # Fleet reconciler: DB vs. agent inventories
+    fleet_reconcile_interval: int = Field(default=60, env="FLEET_RECONCILE_INTERVAL")
+    fleet_inventory_max_age: int = Field(default=600, env="FLEET_INVENTORY_MAX_AGE")
+    fleet_profile_grace: int = Field(default=120, env="FLEET_PROFILE_GRACE")
+
+    # Agent client
+    agent_http2: bool = Field(default=False, env="AGENT_HTTP2")
+    agent_max_connections: int = Field(default=20, env="AGENT_MAX_CONNECTIONS")
+    agent_retries: int = Field(default=2, env="AGENT_RETRIES")
+    agent_retry_backoff: float = Field(default=0.5, env="AGENT_RETRY_BACKOFF")
+    agent_breaker_threshold: int = Field(default=5, env="AGENT_BREAKER_THRESHOLD")
+    agent_breaker_cooldown: int = Field(default=30, env="AGENT_BREAKER_COOLDOWN")
+
+    # Live container state
+    live_state_ttl: float = Field(default=5.0, env="LIVE_STATE_TTL")
+
+    # VPN address pools (CIDRs inside VPN_INTERNAL_SUBNET; default to its halves)
+    vpn_user_pool: str | None = Field(default=None, env="VPN_USER_POOL")
+    vpn_container_pool: str | None = Field(default=None, env="VPN_CONTAINER_POOL")
+
+    # VPN access control
+    vpn_acl_backend: str = Field(default="ipset", env="VPN_ACL_BACKEND")  # ipset | fake
+    vpn_acl_set: str = Field(default="mlab-vpn-pairs", env="VPN_ACL_SET")
+    vpn_acl_maxelem: int = Field(default=262144, env="VPN_ACL_MAXELEM")
+    firewall_batch_window: float = Field(default=0.05, env="FIREWALL_BATCH_WINDOW")
+    firewall_reconcile_interval: int = Field(default=300, env="FIREWALL_RECONCILE_INTERVAL")
+    firewall_reconcile_debounce: float = Field(default=2.0, env="FIREWALL_RECONCILE_DEBOUNCE")
+
+    # VPN PKI
+    pki_key_type: str = Field(default="rsa", env="PKI_KEY_TYPE")  # rsa | ec
+    pki_rsa_bits: int = Field(default=2048, env="PKI_RSA_BITS")
+    pki_cert_days: int = Field(default=825, env="PKI_CERT_DAYS")
+    pki_ca_key_passphrase: str | None = Field(default=None, env="PKI_CA_KEY_PASSPHRASE")
+    vpn_profile_store_db: bool = Field(default=True, env="VPN_PROFILE_STORE_DB")
+    vpn_profile_cache_size: int = Field(default=2048, env="VPN_PROFILE_CACHE_SIZE")
+
+    # VPN certificate pool
+    cert_pool_size: int = Field(default=32, env="CERT_POOL_SIZE")
+    cert_pool_workers: int = Field(default=0, env="CERT_POOL_WORKERS")  # 0: CPU count
+    cert_pool_interval: int = Field(default=30, env="CERT_POOL_INTERVAL")
+
+    # Bulk launches
+    bulk_launch_max_users: int = Field(default=500, env="BULK_LAUNCH_MAX_USERS")
+    bulk_host_concurrency: int = Field(default=4, env="BULK_HOST_CONCURRENCY")
 
     @property
     def database_uri(self) -> str:
@@ -3,6 +3,7 @@ import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.core.database import engine, Base, SessionLocal
+from app.core.schema import upgrade
 from app.models import User, UserRole
 from app.core.security import hash_password
 from app.core.config import get_settings
@@ -13,6 +14,8 @@ async def init_models():
     async with engine.begin() as conn:
         # create tables
         await conn.run_sync(Base.metadata.create_all)
+        # bring tables from earlier releases up to date
+        await upgrade(conn)
 
 async def create_default_admin():
     settings = get_settings()
@@ -31,29 +34,49 @@ async def create_default_admin():
         session.add(new_admin)
         await session.commit()
 
-async def monitor_offline_hosts():
-    """
-    Periodically scan all hosts: if last_seen > 30s ago, mark offline.
-    """
-    from sqlalchemy.future import select
-    from app.core.database import SessionLocal
-    from app.models import ContainerHost, HostStatus
-
-    THRESHOLD = 30  # seconds
-    while True:
-        async with SessionLocal() as session:
-            stmt = select(ContainerHost)
-            res = await session.execute(stmt)
-            hosts = res.scalars().all()
-            now = datetime.datetime.now(timezone.utc)
-            for host in hosts:
-                if not host.last_seen or (now - host.last_seen).total_seconds() > THRESHOLD:
-                    if host.status != HostStatus.offline:
-                        host.status = HostStatus.offline
-            await session.commit()
-        await asyncio.sleep(THRESHOLD)
-
 async def startup():
+    from app.internal.cert_pool import cert_pool
+    from app.internal.jobs import launch_jobs
+    from app.internal.failure_detector import failure_detector
+    from app.internal.firewall import firewall
+    from app.internal.fleet import fleet
+    from app.internal.host_metrics import host_metrics
+    from app.internal.host_state import host_state
+    from app.internal.placement import placement
+    from app.internal.teardown import reaper
+    from app.internal.vpn import vpn_addresses
+    from app.internal.warm_pool import warm_pool
+
+    settings = get_settings()
     await init_models()
     await create_default_admin()
-    asyncio.create_task(monitor_offline_hosts())
+    async with SessionLocal() as session:
+        await host_state.load(session)
+        await placement.sync(session)
+        await vpn_addresses.load(session)
+    failure_detector.seed()
+    launch_jobs.start(
+        workers=settings.launch_workers,
+        maxsize=settings.launch_queue_size,
+        ttl=settings.launch_job_ttl,
+    )
+    asyncio.create_task(failure_detector.run())
+    asyncio.create_task(host_state.run())
+    asyncio.create_task(host_metrics.run())
+    asyncio.create_task(placement.run())
+    asyncio.create_task(warm_pool.run())
+    asyncio.create_task(cert_pool.run())
+    asyncio.create_task(firewall.run())
+    asyncio.create_task(reaper.run())
+    asyncio.create_task(fleet.run())
+
+async def shutdown():
+    from app.internal.agent_client import agents
+    from app.internal.cert_pool import cert_pool
+    from app.internal.host_metrics import host_metrics
+    from app.internal.host_state import host_state
+
+    await host_state.flush()
+    await host_metrics.flush(final=True)
+    await agents.aclose()
+    cert_pool.close()
@@ -0,0 +1,51 @@
+import logging
+
+from sqlalchemy import text
+
+logger = logging.getLogger("schema")
+
+# `Base.metadata.create_all` creates missing tables but never alters ones
+# that already exist, so every column, index or constraint added to an
+# existing table is also listed here. Each statement is idempotent; they
+# run at startup right after create_all, in order, and are no-ops on a
+# database create_all has just built.
+UPGRADES: list[str] = [
+    # Challenge template registry
+    "ALTER TABLE containers ADD COLUMN IF NOT EXISTS template_digest VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS ix_containers_template_digest ON containers (template_digest)",
+    # Warm pools: unassigned environments have no owner yet
+    "ALTER TABLE containers ALTER COLUMN user_id DROP NOT NULL",
+    "ALTER TABLE challenge_templates ADD COLUMN IF NOT EXISTS warm_pool_size INTEGER NOT NULL DEFAULT 0",
+    # Keyset pagination of GET /containers/
+    "CREATE INDEX IF NOT EXISTS ix_containers_created_at_id ON containers (created_at, id)",
+    # Credential cache misses look keys up by hash
+    "CREATE INDEX IF NOT EXISTS ix_api_keys_key_hash ON api_keys (key_hash)",
+    # An address belongs to at most one active profile. The allocator before
+    # it could hand one address out twice: keep the newest such profile
+    """
+    UPDATE vpn_profiles SET revoked = true
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY ip_address ORDER BY created_at DESC, id DESC
+            ) AS n
+            FROM vpn_profiles WHERE NOT revoked
+        ) ranked
+        WHERE n > 1
+    )
+    RETURNING client_name, ip_address
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_vpn_profiles_active_ip ON vpn_profiles (ip_address) WHERE NOT revoked",
+    # Pooled client certificates
+    "ALTER TABLE vpn_profiles ADD COLUMN IF NOT EXISTS cert_name VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_vpn_profiles_cert_name ON vpn_profiles (cert_name)",
+    # Rendered profiles kept in the database
+    "ALTER TABLE vpn_profiles ADD COLUMN IF NOT EXISTS config BYTEA",
+]
+
+async def upgrade(conn):
+    for statement in UPGRADES:
+        result = await conn.execute(text(statement))
+        if result.returns_rows:
+            for row in result.all():
+                logger.warning("Schema upgrade changed %s", dict(row._mapping))
@@ -0,0 +1,168 @@
+# app/internal/agent_client.py
+#
+# One long-lived httpx client per host agent (keep-alive pool, optional
+# HTTP/2), shared by every route and background task that talks to agents.
+# Idempotent calls are retried with exponential backoff on transport errors
+# and 502/503/504. Repeated failures open a per-host circuit breaker: calls
+# fail fast with AgentUnavailable and the host is suspended in the placement
+# index until a probe after the cooldown succeeds.
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+
+import httpx
+
+from app.core.config import get_settings
+from app.models import ContainerHost
+from app.internal.placement import placement
+
+logger = logging.getLogger("agent_client")
+settings = get_settings()
+
+IDEMPOTENT = {"GET", "HEAD", "PUT", "DELETE"}
+RETRY_STATUS = {502, 503, 504}
+
+
+class AgentUnavailable(Exception):
+    """The agent could not be reached, or its circuit breaker is open."""
+
+
+@dataclass
+class Breaker:
+    failures: int = 0
+    opened_at: float | None = None
+    probing: bool = False
+
+    @property
+    def open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        # Half-open: let a single probe through once the cooldown is over
+        if not self.probing and time.monotonic() - self.opened_at >= settings.agent_breaker_cooldown:
+            self.probing = True
+            return True
+        return False
+
+
+class AgentClient:
+    def __init__(self):
+        self._clients: dict[uuid.UUID, tuple[str, httpx.AsyncClient]] = {}
+        self._breakers: dict[uuid.UUID, Breaker] = {}
+
+    def _client(self, host: ContainerHost) -> httpx.AsyncClient:
+        base = f"http://{host.ip}:{host.api_port}/agent"
+        cached = self._clients.get(host.id)
+        if cached and cached[0] == base:
+            return cached[1]
+        if cached:
+            # Host was re-addressed; let the old pool drain in the background
+            asyncio.create_task(cached[1].aclose())
+        client = httpx.AsyncClient(
+            base_url=base,
+            http2=settings.agent_http2,
+            limits=httpx.Limits(
+                max_connections=settings.agent_max_connections,
+                max_keepalive_connections=settings.agent_max_connections,
+                keepalive_expiry=30.0,
+            ),
+            timeout=10.0,
+        )
+        self._clients[host.id] = (base, client)
+        return client
+
+    def breaker(self, host_id: uuid.UUID) -> Breaker:
+        return self._breakers.setdefault(host_id, Breaker())
+
+    async def request(
+        self,
+        host: ContainerHost,
+        method: str,
+        path: str,
+        *,
+        retry: bool | None = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send `method path` to the host's agent. `retry` defaults to whether
+        the method is idempotent; pass False for streamed request bodies.
+        """
+        method = method.upper()
+        if retry is None:
+            retry = method in IDEMPOTENT
+        breaker = self.breaker(host.id)
+        if not breaker.allow():
+            raise AgentUnavailable(f"Agent on {host.hostname} is unavailable (circuit open)")
+
+        # An open breaker that let us through made this call its probe
+        probe = breaker.open
+        try:
+            return await self._send(host, breaker, method, path, retry, **kwargs)
+        except asyncio.CancelledError:
+            if probe and breaker.probing:
+                # Cancelled before the agent answered: let the next call probe
+                breaker.probing = False
+            raise
+        except BaseException:
+            if probe and breaker.probing:
+                # Failed in a way `_send` doesn't account for (streamed body,
+                # decoding, ...): count it, so the breaker can't stay half-open
+                self._failure(host, breaker)
+            raise
+
+    async def _send(self, host, breaker, method, path, retry, **kwargs) -> httpx.Response:
+        headers = {"X-Server-Key": host.cred_ref, **kwargs.pop("headers", {})}
+        attempts = 1 + settings.agent_retries if retry else 1
+        client = self._client(host)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                resp = await client.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                if last:
+                    self._failure(host, breaker)
+                    raise AgentUnavailable(f"Agent on {host.hostname} unreachable: {e!r}")
+            else:
+                if resp.status_code not in RETRY_STATUS:
+                    self._success(host, breaker)
+                    return resp
+                if last:
+                    self._failure(host, breaker)
+                    return resp
+            await asyncio.sleep(settings.agent_retry_backoff * 2 ** attempt)
+
+    def forget(self, host_id: uuid.UUID):
+        """Drop the pool and breaker of a deleted host."""
+        self._breakers.pop(host_id, None)
+        cached = self._clients.pop(host_id, None)
+        if cached:
+            asyncio.create_task(cached[1].aclose())
+
+    async def aclose(self):
+        clients = [c for _, c in self._clients.values()]
+        self._clients.clear()
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+    def _success(self, host: ContainerHost, breaker: Breaker):
+        if breaker.open:
+            logger.info("Agent on %s recovered; closing circuit", host.hostname)
+            placement.resume(host.id)
+        breaker.failures, breaker.opened_at, breaker.probing = 0, None, False
+
+    def _failure(self, host: ContainerHost, breaker: Breaker):
+        breaker.failures += 1
+        if breaker.open:
+            # Failed probe: stay open for another cooldown
+            breaker.opened_at, breaker.probing = time.monotonic(), False
+        elif breaker.failures >= settings.agent_breaker_threshold:
+            logger.warning("Agent on %s failing; opening circuit", host.hostname)
+            breaker.opened_at = time.monotonic()
+            placement.suspend(host.id)
+
+
+agents = AgentClient()
@@ -0,0 +1,66 @@
+# app/internal/bundles.py
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+class BundleTooLarge(Exception):
+    """The uploaded bundle exceeds BUNDLE_MAX_MB."""
+
+
+@dataclass
+class SpooledBundle:
+    """A challenge ZIP written to local disk, with its sha256 and size."""
+    path: str
+    sha256: str
+    size: int
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _open_spool_file():
+    os.makedirs(settings.bundle_spool_dir, exist_ok=True)
+    return tempfile.NamedTemporaryFile(
+        dir=settings.bundle_spool_dir, suffix=".zip", delete=False
+    )
+
+
+async def spool_upload(file: UploadFile) -> SpooledBundle:
+    """
+    Copy an upload to the spool dir chunk by chunk while hashing it, so
+    memory stays at one chunk regardless of the bundle size.
+    """
+    limit = settings.bundle_max_mb * 1024 * 1024
+    digest = hashlib.sha256()
+    size = 0
+    out = await asyncio.to_thread(_open_spool_file)
+    try:
+        while chunk := await file.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                raise BundleTooLarge(
+                    f"Bundle exceeds {settings.bundle_max_mb} MB limit"
+                )
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        out.close()
+        os.remove(out.name)
+        raise
+    await asyncio.to_thread(out.close)
+    return SpooledBundle(path=out.name, sha256=digest.hexdigest(), size=size)
@@ -0,0 +1,118 @@
+# app/internal/cert_pool.py
+#
+# Pre-issued VPN client certificates. Key generation is what makes a
+# profile slow, so a background task keeps up to CERT_POOL_SIZE signed
+# certificates (common names `pool-<hex>`) ready in memory, and profile
+# creation binds one of them to its client instead of generating a key on
+# the request path. Keys are generated in a pool of CERT_POOL_WORKERS
+# processes and signed by the in-process PKI.
+#
+# Certificates that were never bound are simply dropped on restart.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.core.config import get_settings
+from app.internal.pki import IssuedCert, generate_key_pem, pki
+
+logger = logging.getLogger("cert_pool")
+settings = get_settings()
+
+POOL_PREFIX = "pool-"
+
+
+def _workers() -> int:
+    return settings.cert_pool_workers or os.cpu_count() or 1
+
+
+class CertPool:
+    def __init__(self):
+        self._ready: deque[IssuedCert] = deque()
+        self._wake = asyncio.Event()
+        self._executor: ProcessPoolExecutor | None = None
+        self.issued = 0
+        self.on_demand = 0
+
+    def wake(self):
+        self._wake.set()
+
+    async def acquire(self, count: int) -> list[IssuedCert]:
+        """`count` unbound certificates; issued on the spot if the pool runs dry."""
+        taken = [self._ready.popleft() for _ in range(min(count, len(self._ready)))]
+        self.wake()
+        missing = count - len(taken)
+        if missing:
+            self.on_demand += missing
+            try:
+                taken += await self._issue(missing)
+            except Exception:
+                self.give_back(taken)
+                raise
+        return taken
+
+    def give_back(self, certs: list[IssuedCert]):
+        """Certificates whose profile never got persisted."""
+        self._ready.extendleft(certs)
+
+    def stats(self) -> dict:
+        return {
+            "ready": len(self._ready),
+            "target": settings.cert_pool_size,
+            "issued": self.issued,
+            "on_demand": self.on_demand,
+        }
+
+    async def run(self):
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Certificate pool refill failed")
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), timeout=settings.cert_pool_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def refill(self):
+        while len(self._ready) < settings.cert_pool_size:
+            batch = min(settings.cert_pool_size - len(self._ready), _workers())
+            self._ready.extend(await self._issue(batch))
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _issue(self, count: int) -> list[IssuedCert]:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                _workers(), mp_context=multiprocessing.get_context("spawn")
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            keys = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self._executor, generate_key_pem, settings.pki_key_type, settings.pki_rsa_bits
+                )
+                for _ in range(count)
+            ))
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time
+            self._executor = None
+            raise
+        certs = await asyncio.to_thread(
+            lambda: [pki.sign(f"{POOL_PREFIX}{secrets.token_hex(8)}", k) for k in keys]
+        )
+        self.issued += len(certs)
+        return certs
+
+
+cert_pool = CertPool()
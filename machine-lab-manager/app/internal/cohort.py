@@ -0,0 +1,347 @@
+# app/internal/cohort.py
+
+import asyncio
+import datetime
+import json
+import logging
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import Container, ContainerHost, ContainerStatus, VPNProfile
+from app.internal.bundles import SpooledBundle
+from app.internal.firewall import firewall
+from app.internal.launcher import ensure_bundle_on_host, start_on_host
+from app.internal.placement import adjust_container_count, placement
+from app.internal.teardown import request_removal
+from app.internal.vpn import (
+    apply_vpn_rules,
+    create_profiles,
+    profile_config,
+    remove_vpn_profile,
+)
+from app.internal.warm_pool import warm_pool
+
+logger = logging.getLogger("cohort")
+settings = get_settings()
+
+# Running cohorts, so their tasks are not garbage-collected mid-launch
+_running: set[asyncio.Task] = set()
+
+
+@dataclass
+class CohortMember:
+    user_id: uuid.UUID
+    container_id: str | None = None
+    host_id: uuid.UUID | None = None
+    status: ContainerStatus = ContainerStatus.pending
+    warm: bool = False
+    started: bool = False   # the agent was asked to start it
+    cache_hit: bool | None = None
+    error: str | None = None
+
+    def result(self) -> dict:
+        return {
+            "user_id": str(self.user_id),
+            "container_id": self.container_id,
+            "host_id": str(self.host_id) if self.host_id else None,
+            "status": self.status.value,
+            "warm": self.warm,
+            "cache_hit": self.cache_hit,
+            "error": self.error,
+        }
+
+
+class CohortLaunch:
+    """
+    One environment per user from the same bundle, launched as a unit:
+    warm environments are claimed and host slots reserved for the whole
+    cohort up front, VPN profiles are issued in one batch, agents are called
+    concurrently (at most BULK_HOST_CONCURRENCY at a time per host), and
+    finished environments are persisted and firewalled in batches.
+
+    Launches continue in the background if the client stops reading.
+    """
+
+    def __init__(
+        self,
+        user_ids: list[uuid.UUID],
+        bundle: SpooledBundle,
+        template_digest: str | None,
+        discard: bool,
+    ):
+        self.members = [CohortMember(user_id=u) for u in dict.fromkeys(user_ids)]
+        self.bundle = bundle
+        self.template_digest = template_digest
+        self.discard = discard
+        self._results: asyncio.Queue = asyncio.Queue()
+        self._open = len(self.members)
+        self._hosts: dict[uuid.UUID, ContainerHost] = {}
+
+    # ─── Planning (request scope) ───────────────────────────────────────
+
+    async def plan(self, db: AsyncSession):
+        """Claim warm environments, reserve host slots and record pending rows."""
+        # 1) Warm environments first
+        if self.template_digest:
+            warm_pool.note_demand(self.template_digest)
+            stmt = (
+                select(Container)
+                .where(
+                    Container.template_digest == self.template_digest,
+                    Container.user_id.is_(None),
+                    Container.status == ContainerStatus.running,
+                )
+                .order_by(Container.created_at)
+                .limit(len(self.members))
+                .with_for_update(skip_locked=True)
+            )
+            warm = (await db.execute(stmt)).scalars().all()
+            for m, cont in zip(self.members, warm):
+                cont.user_id = m.user_id
+                m.container_id, m.host_id, m.warm = str(cont.id), cont.host_id, True
+            # Claims are committed with the pending rows below, so a failed
+            # plan leaves the warm environments in their pool
+
+        # 2) Reserve a slot for everyone else
+        reservations = []
+        for m in self.members:
+            if m.warm:
+                continue
+            res = placement.reserve()
+            if not res:
+                self._emit(m, ContainerStatus.error, "No available host")
+                continue
+            reservations.append(res)
+            m.container_id, m.host_id = str(uuid.uuid4()), res.host_id
+
+        # 3) One commit for every warm claim, pending row and host counter
+        try:
+            now = datetime.datetime.utcnow()
+            for m in self._cold():
+                db.add(Container(
+                    id=m.container_id,
+                    user_id=m.user_id,
+                    host_id=m.host_id,
+                    name=m.container_id,
+                    template_digest=self.template_digest,
+                    status=ContainerStatus.pending,
+                    created_at=now,
+                ))
+            for host_id, n in Counter(r.host_id for r in reservations).items():
+                await adjust_container_count(db, host_id, n)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            for res in reservations:
+                placement.release(res)
+            raise
+        for res in reservations:
+            placement.confirm(res)
+        if any(m.warm for m in self.members):
+            warm_pool.wake()
+
+    def start(self):
+        task = asyncio.create_task(self.run())
+        _running.add(task)
+        task.add_done_callback(_running.discard)
+
+    async def stream(self):
+        """NDJSON lines, one per user, in completion order."""
+        while True:
+            item = await self._results.get()
+            if item is None:
+                return
+            yield json.dumps(item) + "\n"
+
+    # ─── Launch (background) ────────────────────────────────────────────
+
+    async def run(self):
+        try:
+            await self._run()
+        except Exception as e:
+            logger.exception("Cohort launch failed")
+            left = [m for m in self.members if m.status == ContainerStatus.pending]
+            for m in left:
+                m.error = str(e)
+            try:
+                await self._settle(left, {})
+            except Exception:
+                logger.exception("Could not clean up failed cohort")
+                for m in left:
+                    self._emit(m, ContainerStatus.error, m.error)
+        finally:
+            if self.discard:
+                await asyncio.to_thread(self.bundle.discard)
+            if self._open:
+                self._results.put_nowait(None)
+
+    async def _run(self):
+        live = [m for m in self.members if m.container_id]
+        if not live:
+            return
+
+        # 1) Every VPN profile the cohort needs, in one batch
+        async with SessionLocal() as db:
+            profiles = await create_profiles(
+                db,
+                users=[str(m.user_id) for m in live],
+                containers=[m.container_id for m in live],
+            )
+            self._hosts = hosts = {
+                h.id: h for h in (await db.execute(
+                    select(ContainerHost).where(
+                        ContainerHost.id.in_({m.host_id for m in live})
+                    )
+                )).scalars().all()
+            }
+
+        # 2) Warm environments are already up; everything else fans out
+        done: asyncio.Queue = asyncio.Queue()
+        for m in live:
+            if m.warm:
+                done.put_nowait(m)
+
+        slots = {
+            host_id: asyncio.Semaphore(settings.bulk_host_concurrency)
+            for host_id in hosts
+        }
+
+        async def deploy(m: CohortMember):
+            try:
+                host = hosts.get(m.host_id)
+                if not host:
+                    raise RuntimeError("Host disappeared")
+                async with slots[host.id]:
+                    await ensure_bundle_on_host(host, self.bundle)
+                    vpn_conf = await profile_config(profiles[m.container_id])
+                    m.started = True
+                    m.cache_hit = await start_on_host(
+                        host, m.container_id, self.bundle, vpn_conf
+                    )
+            except Exception as e:
+                m.error = str(e)
+            done.put_nowait(m)
+
+        writer = asyncio.create_task(self._writer(done, profiles, len(live)))
+        await asyncio.gather(*(deploy(m) for m in live if not m.warm))
+        await writer
+
+    async def _writer(self, done: asyncio.Queue, profiles: dict, expected: int):
+        """Settle finished members in whatever batches have accumulated."""
+        while expected:
+            batch = [await done.get()]
+            while not done.empty():
+                batch.append(done.get_nowait())
+            expected -= len(batch)
+            await self._settle(batch, profiles)
+
+    async def _settle(self, batch: list[CohortMember], profiles: dict[str, VPNProfile]):
+        # 1) One firewall transaction for every user↔container pair in the batch
+        ok = [m for m in batch if not m.error]
+        if ok:
+            pairs = [
+                (profiles[str(m.user_id)].ip_address, profiles[m.container_id].ip_address)
+                for m in ok
+            ]
+            try:
+                await apply_vpn_rules(pairs)
+            except Exception as e:
+                for m in ok:
+                    m.error = f"Firewall update failed: {e}"
+
+        # 2) One transaction for the batch's outcomes
+        running = [m.container_id for m in batch if not m.error and not m.warm]
+        failed = [m for m in batch if m.error and not m.warm and m.container_id]
+        returned = [m.container_id for m in batch if m.error and m.warm]
+        cancelled = []
+        async with SessionLocal() as db:
+            if running:
+                persisted = set(map(str, (await db.execute(
+                    update(Container)
+                    .where(
+                        Container.id.in_(running),
+                        Container.status == ContainerStatus.pending,
+                    )
+                    .values(status=ContainerStatus.running)
+                    .returning(Container.id)
+                    .execution_options(synchronize_session=False)
+                )).scalars().all()))
+                # Stopped or deleted while launching: slot and profile are
+                # released already, but the pairs opened above are not
+                cancelled = [
+                    m for m in batch
+                    if not m.error and not m.warm and m.container_id not in persisted
+                ]
+                for m in cancelled:
+                    m.error = "Stopped before the launch finished"
+            freed = []
+            if failed:
+                held = (await db.execute(
+                    select(Container.id, Container.host_id).where(
+                        Container.id.in_([m.container_id for m in failed]),
+                        Container.status.in_([ContainerStatus.pending, ContainerStatus.running]),
+                    )
+                )).all()
+                await db.execute(
+                    update(Container)
+                    .where(Container.id.in_([cid for cid, _ in held]))
+                    .values(status=ContainerStatus.error)
+                    .execution_options(synchronize_session=False)
+                )
+                freed = [host_id for _, host_id in held]
+                for host_id, n in Counter(freed).items():
+                    await adjust_container_count(db, host_id, -n)
+            if returned:
+                # Claimed warm environments go back to the pool
+                await db.execute(
+                    update(Container)
+                    .where(Container.id.in_(returned))
+                    .values(user_id=None)
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+            for host_id in freed:
+                placement.freed(host_id)
+
+            for m in failed:
+                try:
+                    await remove_vpn_profile(db, m.container_id)
+                except Exception:
+                    logger.exception("Could not clean up VPN profile for %s", m.container_id)
+
+        # 3) Environments an agent may have started don't stay on the host;
+        #    hand-offs that fail are left to the fleet reconciler
+        if cancelled:
+            # Recomputed from the DB, so no newer owner of an address loses access
+            firewall.request_reconcile()
+        started = [
+            m for m in failed + cancelled if m.started and m.host_id in self._hosts
+        ]
+        if started:
+            await asyncio.gather(
+                *(request_removal(self._hosts[m.host_id], m.container_id) for m in started),
+                return_exceptions=True,
+            )
+
+        for m in batch:
+            if m.error:
+                self._emit(m, ContainerStatus.error, m.error)
+            else:
+                self._emit(m, ContainerStatus.running)
+
+    def _cold(self):
+        return [m for m in self.members if m.container_id and not m.warm]
+
+    def _emit(self, m: CohortMember, status: ContainerStatus, error: str | None = None):
+        m.status, m.error = status, error
+        self._results.put_nowait(m.result())
+        self._open -= 1
+        if not self._open:
+            self._results.put_nowait(None)
@@ -0,0 +1,101 @@
+# app/internal/credentials.py
+#
+# Verified-credential cache. Once an admin or server key has been checked
+# against `api_keys` (and, for admins, `users`), the result is kept here by
+# token hash for CREDENTIAL_CACHE_TTL seconds in a bounded LRU, so steady
+# authentication costs no queries. Key rotation, host deletion and password
+# changes drop their owner's entries immediately; the TTL bounds staleness
+# across manager processes.
+
+import datetime
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.core.config import get_settings
+from app.models import APIKeyOwner, User
+
+settings = get_settings()
+
+
+@dataclass
+class Credential:
+    owner_type: APIKeyOwner
+    owner_id: uuid.UUID
+    expires_at: float
+    user: User | None = None  # detached snapshot, admins only
+
+
+class CredentialCache:
+    def __init__(self):
+        self._entries: OrderedDict[str, Credential] = OrderedDict()
+        self._generations: dict[uuid.UUID, int] = {}
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, token_hash: str, owner_type: APIKeyOwner) -> Credential | None:
+        cred = self._entries.get(token_hash)
+        if cred is None or cred.owner_type != owner_type:
+            self.misses += 1
+            return None
+        if cred.expires_at <= time.monotonic():
+            del self._entries[token_hash]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token_hash)
+        self.hits += 1
+        return cred
+
+    def generation(self, owner_id: uuid.UUID) -> int:
+        """Taken before verifying, so a revocation mid-query is not cached over."""
+        return self._generations.get(owner_id, 0)
+
+    def put(
+        self,
+        token_hash: str,
+        owner_type: APIKeyOwner,
+        owner_id: uuid.UUID,
+        generation: int,
+        key_expires_at: datetime.datetime | None = None,
+        user: User | None = None,
+    ):
+        if settings.credential_cache_size <= 0 or self.generation(owner_id) != generation:
+            return
+        ttl = settings.credential_cache_ttl
+        if key_expires_at is not None:
+            ttl = min(ttl, (key_expires_at - datetime.datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        self._entries[token_hash] = Credential(
+            owner_type=owner_type,
+            owner_id=owner_id,
+            expires_at=time.monotonic() + ttl,
+            user=user,
+        )
+        self._entries.move_to_end(token_hash)
+        while len(self._entries) > settings.credential_cache_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, owner_id: uuid.UUID):
+        """Drop every cached key of a user or host."""
+        self._generations[owner_id] = self.generation(owner_id) + 1
+        stale = [h for h, c in self._entries.items() if c.owner_id == owner_id]
+        for token_hash in stale:
+            del self._entries[token_hash]
+        self.invalidations += len(stale)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": settings.credential_cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+credentials = CredentialCache()
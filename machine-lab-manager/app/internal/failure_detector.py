@@ -0,0 +1,138 @@
+# app/internal/failure_detector.py
+#
+# Heartbeat failure detector. Every heartbeat re-arms two deadlines for its
+# host in a timer heap; one task sleeps until the earliest one instead of
+# scanning all hosts:
+#
+#   suspect  last + mean + margin       -> no new placements on the host
+#   offline  last + 2 * mean + 4 * std  -> host marked offline
+#
+# `mean`/`std` are taken over the host's recent heartbeat inter-arrival
+# times (seeded with HEARTBEAT_INTERVAL), so a steady host goes offline one
+# missed interval after its last beat while a jittery one gets proportionally
+# more slack. `phi` reports the accrual suspicion level (exponential model,
+# as in Cassandra's detector): 1 means ~10% odds the host is still alive.
+# Status only changes, and is only written back, on transitions.
+
+import asyncio
+import heapq
+import logging
+import math
+import statistics
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+
+from app.core.config import get_settings
+from app.models import HostStatus
+from app.internal.host_state import host_state
+from app.internal.placement import placement
+
+logger = logging.getLogger("failure_detector")
+settings = get_settings()
+
+SUSPECT, OFFLINE = "suspect", "offline"
+
+
+@dataclass
+class Arrivals:
+    last: float
+    intervals: deque = field(default_factory=deque)
+    generation: int = 0
+    suspected: bool = False
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.intervals) if self.intervals else settings.heartbeat_interval
+
+    @property
+    def std(self) -> float:
+        return statistics.pstdev(self.intervals) if len(self.intervals) > 1 else 0.0
+
+
+class FailureDetector:
+    def __init__(self):
+        self._hosts: dict[uuid.UUID, Arrivals] = {}
+        self._timers: list[tuple[float, int, uuid.UUID, str]] = []
+        self._wake = asyncio.Event()
+
+    def seed(self):
+        """Arm deadlines for hosts the table already considers alive."""
+        now_wall, now = time.time(), time.monotonic()
+        for h in host_state.all():
+            if h.status == HostStatus.offline:
+                continue
+            if not h.last_seen:
+                host_state.mark_offline(h.id)
+                continue
+            last = now - max(0.0, now_wall - h.last_seen.timestamp())
+            self._hosts[h.id] = Arrivals(last=last)
+            self._arm(h.id)
+
+    def heartbeat(self, host_id: uuid.UUID):
+        now = time.monotonic()
+        arr = self._hosts.get(host_id)
+        if arr is None:
+            arr = self._hosts[host_id] = Arrivals(last=now)
+        else:
+            arr.intervals.append(now - arr.last)
+            while len(arr.intervals) > settings.failure_detector_window:
+                arr.intervals.popleft()
+            arr.last = now
+        if arr.suspected:
+            arr.suspected = False
+            placement.suspect(host_id, False)
+        self._arm(host_id)
+
+    def forget(self, host_id: uuid.UUID):
+        self._hosts.pop(host_id, None)
+
+    def phi(self, host_id: uuid.UUID) -> float | None:
+        arr = self._hosts.get(host_id)
+        if arr is None:
+            return None
+        elapsed = time.monotonic() - arr.last
+        return round(elapsed / arr.mean * math.log10(math.e), 3)
+
+    async def run(self):
+        while True:
+            delay = self._timers[0][0] - time.monotonic() if self._timers else None
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._fire(time.monotonic())
+
+    # ─── Internals ──────────────────────────────────────────────────────
+
+    def _arm(self, host_id: uuid.UUID):
+        arr = self._hosts[host_id]
+        arr.generation += 1
+        mean, std = arr.mean, arr.std
+        margin = max(2 * std, 0.25 * mean)
+        earliest = self._timers[0][0] if self._timers else None
+        heapq.heappush(self._timers, (arr.last + mean + margin, arr.generation, host_id, SUSPECT))
+        heapq.heappush(self._timers, (arr.last + 2 * mean + 4 * std, arr.generation, host_id, OFFLINE))
+        if earliest is None or self._timers[0][0] < earliest:
+            self._wake.set()
+
+    def _fire(self, now: float):
+        while self._timers and self._timers[0][0] <= now:
+            _, generation, host_id, kind = heapq.heappop(self._timers)
+            arr = self._hosts.get(host_id)
+            if arr is None or arr.generation != generation:
+                continue  # re-armed by a later heartbeat
+            if kind == SUSPECT and not arr.suspected:
+                arr.suspected = True
+                placement.suspect(host_id, True)
+                logger.info("Host %s suspected (phi %.2f)", host_id, self.phi(host_id))
+            elif kind == OFFLINE:
+                logger.warning("Host %s missed its heartbeat deadline; marking offline", host_id)
+                del self._hosts[host_id]
+                placement.suspect(host_id, False)
+                host_state.mark_offline(host_id)
+
+
+failure_detector = FailureDetector()
@@ -0,0 +1,142 @@
+# app/internal/firewall.py
+#
+# Firewall reconciler. The desired VPN access state is derived from the DB:
+# every assigned, pending or running environment lets its user's active
+# profile reach its own active profile. Two paths keep the kernel there:
+#
+#   * incremental: launches and teardowns queue allow/revoke changes and
+#     wait for the next flush; changes arriving within FIREWALL_BATCH_WINDOW
+#     of each other go to the kernel as one transaction, so a burst of 500
+#     teardowns is a single update;
+#   * full: `reconcile()` recomputes the desired pairs and replaces whatever
+#     the kernel holds with them in one transaction. It runs at startup,
+#     every FIREWALL_RECONCILE_INTERVAL seconds, on demand, and (debounced)
+#     after an incremental flush fails.
+#
+# Both paths are serialized, and a full reconcile reads the DB under the
+# same lock, so it can never re-open a pair that a later flush revoked.
+
+import asyncio
+import logging
+
+from sqlalchemy import String, and_, cast
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import Container, ContainerStatus, VPNProfile
+from app.internal.vpn_acl import ALLOW, REVOKE, vpn_acl
+
+logger = logging.getLogger("firewall")
+settings = get_settings()
+
+
+class FirewallReconciler:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._changes: list[tuple] = []
+        self._waiters: list[asyncio.Future] = []
+        self._flush_task: asyncio.Task | None = None
+        self._reconcile_task: asyncio.Task | None = None
+        self.flushes = 0
+        self.reconciles = 0
+
+    # ─── Incremental ────────────────────────────────────────────────────
+
+    async def allow(self, pairs: list[tuple[str, str]]):
+        """Open each user↔container pair; returns once it is in the kernel."""
+        await self._submit([(ALLOW, a, b) for a, b in pairs])
+
+    async def revoke(self, ips: list[str]):
+        """Close every pair of each address; returns once it is out of the kernel."""
+        await self._submit([(REVOKE, ip) for ip in ips])
+
+    async def _submit(self, changes: list[tuple]):
+        if not changes:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._changes += changes
+        self._waiters.append(fut)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        await fut
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.firewall_batch_window)
+        async with self._lock:
+            changes, self._changes = self._changes, []
+            waiters, self._waiters = self._waiters, []
+            self._flush_task = None
+            try:
+                await asyncio.to_thread(vpn_acl.update, changes)
+                self.flushes += 1
+                error = None
+            except Exception as e:
+                logger.exception("Firewall flush of %d changes failed", len(changes))
+                self.request_reconcile()
+                error = e
+        for fut in waiters:
+            if fut.done():
+                continue
+            if error:
+                fut.set_exception(error)
+            else:
+                fut.set_result(None)
+
+    # ─── Full ───────────────────────────────────────────────────────────
+
+    async def desired_pairs(self, db) -> list[tuple[str, str]]:
+        user_prof = aliased(VPNProfile)
+        cont_prof = aliased(VPNProfile)
+        stmt = (
+            select(user_prof.ip_address, cont_prof.ip_address)
+            .select_from(Container)
+            .join(user_prof, and_(
+                user_prof.client_name == cast(Container.user_id, String),
+                user_prof.revoked == False,
+            ))
+            .join(cont_prof, and_(
+                cont_prof.client_name == cast(Container.id, String),
+                cont_prof.revoked == False,
+            ))
+            .where(
+                Container.user_id.is_not(None),
+                Container.status.in_([ContainerStatus.pending, ContainerStatus.running]),
+            )
+        )
+        return [(str(u), str(c)) for u, c in (await db.execute(stmt)).all()]
+
+    async def reconcile(self) -> dict:
+        """Replace the kernel's pairs with the ones the DB calls for."""
+        async with self._lock:
+            async with SessionLocal() as db:
+                pairs = await self.desired_pairs(db)
+            added, removed = await asyncio.to_thread(vpn_acl.replace, pairs)
+            self.reconciles += 1
+        if added or removed:
+            logger.info("Firewall reconciled: %d entries added, %d removed", added, removed)
+        return {"pairs": len(pairs), "added": added, "removed": removed}
+
+    def request_reconcile(self):
+        """Debounced: one full reconcile after a burst of requests."""
+        if self._reconcile_task is None or self._reconcile_task.done():
+            self._reconcile_task = asyncio.create_task(self._reconcile_later())
+
+    async def _reconcile_later(self):
+        await asyncio.sleep(settings.firewall_reconcile_debounce)
+        try:
+            await self.reconcile()
+        except Exception:
+            logger.exception("Firewall reconcile failed")
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Firewall reconcile failed")
+            await asyncio.sleep(settings.firewall_reconcile_interval)
+
+
+firewall = FirewallReconciler()
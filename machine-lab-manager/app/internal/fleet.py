@@ -0,0 +1,286 @@
+# app/internal/fleet.py
+#
+# Fleet reconciler: makes the DB agree with what the agents actually run.
+# Every FLEET_RECONCILE_INTERVAL seconds it diffs each online host's
+# environment inventory against the host's `containers` rows:
+#
+#   * a running row whose environment is gone, has no running service or
+#     is being removed died or was removed out-of-band: it is marked
+#     `error` and its VPN access is revoked;
+#   * an environment with no row at all is an orphan (a work dir left by a
+#     launch or teardown the DB never recorded) and is queued for removal
+#     on its agent;
+#   * so is an environment still on its host behind an `error` row (a
+#     launch that failed after the agent started it, or a lost environment
+#     whose containers linger): nothing ever runs an `error` row again.
+#
+# Fleet-wide it then revokes active container-pool VPN profiles that no
+# pending or running environment owns, and has placement re-derive host
+# container counts from the corrected rows. Status changes go out as one
+# UPDATE and revocations as one batch per pass. Every repair is counted;
+# the counters are served at GET /hosts/reconciler.
+#
+# Inventories are cheap to keep current: heartbeats carry a digest of
+# them, and a host's inventory is fetched again only when the digest moved
+# (or FLEET_INVENTORY_MAX_AGE passed). Repairs are only ever made from an
+# inventory fetched during the pass, and rows are read both before it
+# (running rows, so an environment that just started is not taken for
+# lost) and after it (all rows, so one that is just starting is not taken
+# for an orphan).
+
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+
+from sqlalchemy import String, cast, update
+from sqlalchemy.dialects.postgresql import INET
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import Container, ContainerHost, ContainerStatus, HostStatus, VPNProfile
+from app.internal.agent_client import agents
+from app.internal.host_state import host_state
+from app.internal.ip_pool import CONTAINERS
+from app.internal.placement import placement
+from app.internal.teardown import request_removal
+from app.internal.vpn import remove_vpn_profiles, vpn_addresses
+
+logger = logging.getLogger("fleet")
+settings = get_settings()
+
+REPAIRS = (
+    "lost_environments",
+    "orphaned_environments",
+    "failed_environments",
+    "orphaned_vpn_profiles",
+    "capacity_counts",
+)
+
+
+@dataclass
+class Inventory:
+    digest: str
+    fetched_at: float
+    environments: dict[str, dict]
+
+
+def _dead(env: dict | None) -> bool:
+    return env is None or env["removing"] or env["state"] in ("missing", "stopped")
+
+
+class FleetReconciler:
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._inventories: dict[uuid.UUID, Inventory] = {}
+        self.repairs = dict.fromkeys(REPAIRS, 0)
+        self.passes = 0
+        self.inventory_fetches = 0
+        self.unreachable = 0
+        self.last_run: datetime.datetime | None = None
+        self.last_report: dict | None = None
+
+    def stats(self) -> dict:
+        return {
+            "passes": self.passes,
+            "last_run": self.last_run,
+            "repairs": dict(self.repairs),
+            "last_report": self.last_report,
+            "inventory_fetches": self.inventory_fetches,
+            "unreachable": self.unreachable,
+        }
+
+    def forget(self, host_id: uuid.UUID):
+        self._inventories.pop(host_id, None)
+
+    # ─── Pass ───────────────────────────────────────────────────────────
+
+    async def reconcile(self) -> dict:
+        async with self._lock:
+            report = await self._reconcile()
+        self.passes += 1
+        self.last_run = datetime.datetime.now(datetime.timezone.utc)
+        self.last_report = report
+        for key in REPAIRS:
+            self.repairs[key] += report[key]
+        if any(report[key] for key in REPAIRS):
+            logger.warning("Fleet drift repaired: %s", report)
+        return report
+
+    async def _reconcile(self) -> dict:
+        report = dict.fromkeys(REPAIRS, 0)
+        report["hosts"] = report["unreachable"] = 0
+
+        # 1) Online hosts and the environments the DB says are running
+        async with SessionLocal() as db:
+            hosts = [
+                h for h in (await db.execute(select(ContainerHost))).scalars().all()
+                if (host_state.get(h.id) or h).status != HostStatus.offline
+            ]
+            running: dict[uuid.UUID, dict[str, uuid.UUID]] = {}
+            for cid, name, host_id in (await db.execute(
+                select(Container.id, Container.name, Container.host_id)
+                .where(Container.status == ContainerStatus.running)
+            )).all():
+                running.setdefault(host_id, {})[name] = cid
+        started = time.monotonic()
+
+        # 2) Inventories: cached ones first; hosts that look drifted are
+        #    fetched again, since only fresh data is acted on
+        invs = await self._inventories_of(hosts, fresh=False)
+        names = await self._names()
+        drifted = [
+            h for h in hosts
+            if h.id in invs and invs[h.id].fetched_at < started
+            and any(self._diff(invs[h.id], running.get(h.id, {}), names.get(h.id, {})))
+        ]
+        if drifted:
+            invs.update(await self._inventories_of(drifted, fresh=True))
+            names = await self._names()
+        report["hosts"] = len(hosts)
+        report["unreachable"] = len(hosts) - len(invs)
+
+        lost_ids, orphans, failed = [], [], []
+        for h in hosts:
+            inv = invs.get(h.id)
+            if inv is None or inv.fetched_at < started:
+                continue
+            lost, orphaned, errored = self._diff(
+                inv, running.get(h.id, {}), names.get(h.id, {})
+            )
+            lost_ids += [running[h.id][n] for n in lost]
+            orphans += [(h, n) for n in orphaned]
+            failed += [(h, n) for n in errored]
+
+        async with SessionLocal() as db:
+            # 3) Lost environments: one guarded UPDATE, one revocation batch
+            if lost_ids:
+                lost = (await db.execute(
+                    update(Container)
+                    .where(Container.id.in_(lost_ids), Container.status == ContainerStatus.running)
+                    .values(status=ContainerStatus.error)
+                    .returning(Container.id)
+                    .execution_options(synchronize_session=False)
+                )).scalars().all()
+                await db.commit()
+                report["lost_environments"] = len(lost)
+                await remove_vpn_profiles(db, lost)
+
+            # 4) Container profiles nobody running owns
+            orphaned_profiles = await self._orphaned_profiles(db)
+            if orphaned_profiles:
+                await remove_vpn_profiles(db, orphaned_profiles)
+            report["orphaned_vpn_profiles"] = len(orphaned_profiles)
+
+            # 5) Host container counts from the corrected rows
+            report["capacity_counts"] = await placement.sync(db)
+
+        # 6) Orphaned and failed environments go to their agents' removal queues
+        if orphans or failed:
+            sem = asyncio.Semaphore(settings.teardown_concurrency)
+
+            async def remove(host: ContainerHost, name: str) -> bool:
+                async with sem:
+                    return await request_removal(host, name)
+
+            queued = await asyncio.gather(*(remove(h, n) for h, n in orphans + failed))
+            report["orphaned_environments"] = sum(queued[:len(orphans)])
+            report["failed_environments"] = sum(queued[len(orphans):])
+        return report
+
+    @staticmethod
+    def _diff(inv: Inventory, running: dict[str, uuid.UUID], names: dict[str, ContainerStatus]):
+        """
+        (lost, orphaned, failed): running rows without a live environment,
+        environments without a row, and environments behind an `error` row.
+        """
+        lost = [n for n in running if _dead(inv.environments.get(n))]
+        orphaned, failed = [], []
+        for n, env in inv.environments.items():
+            if env["removing"]:
+                continue
+            if n not in names:
+                orphaned.append(n)
+            elif names[n] == ContainerStatus.error:
+                failed.append(n)
+        return lost, orphaned, failed
+
+    async def _names(self) -> dict[uuid.UUID, dict[str, ContainerStatus]]:
+        """Every environment name the DB knows, with its status, by host."""
+        names: dict[uuid.UUID, dict[str, ContainerStatus]] = {}
+        async with SessionLocal() as db:
+            for name, host_id, status in (await db.execute(
+                select(Container.name, Container.host_id, Container.status)
+            )).all():
+                names.setdefault(host_id, {})[name] = status
+        return names
+
+    async def _orphaned_profiles(self, db) -> list[str]:
+        subnet = vpn_addresses.pools[CONTAINERS].subnet
+        grace = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=settings.fleet_profile_grace
+        )
+        live = select(cast(Container.id, String)).where(
+            Container.status.in_([ContainerStatus.pending, ContainerStatus.running])
+        )
+        stmt = (
+            select(VPNProfile.client_name)
+            .where(
+                VPNProfile.revoked == False,
+                VPNProfile.ip_address.op("<<=")(cast(str(subnet), INET)),
+                VPNProfile.client_name.not_in(live),
+                VPNProfile.created_at < grace,
+            )
+            .distinct()
+        )
+        return list((await db.execute(stmt)).scalars().all())
+
+    # ─── Inventories ────────────────────────────────────────────────────
+
+    async def _inventories_of(
+        self, hosts: list[ContainerHost], fresh: bool
+    ) -> dict[uuid.UUID, Inventory]:
+        invs = await asyncio.gather(*(self._inventory(h, fresh) for h in hosts))
+        return {h.id: inv for h, inv in zip(hosts, invs) if inv is not None}
+
+    async def _inventory(self, host: ContainerHost, fresh: bool) -> Inventory | None:
+        cached = self._inventories.get(host.id)
+        state = host_state.get(host.id)
+        if (
+            not fresh
+            and cached
+            and state
+            and state.inventory_digest == cached.digest
+            and time.monotonic() - cached.fetched_at < settings.fleet_inventory_max_age
+        ):
+            return cached
+        try:
+            resp = await agents.request(host, "GET", "/inventory", timeout=10.0)
+            resp.raise_for_status()
+            body = resp.json()
+        except Exception as e:
+            logger.warning("Inventory of %s unavailable: %s", host.hostname, e)
+            self.unreachable += 1
+            return None
+        inv = Inventory(
+            digest=body["digest"],
+            fetched_at=time.monotonic(),
+            environments={env["name"]: env for env in body["environments"]},
+        )
+        self._inventories[host.id] = inv
+        self.inventory_fetches += 1
+        return inv
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.fleet_reconcile_interval)
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.exception("Fleet reconcile failed")
+
+
+fleet = FleetReconciler()
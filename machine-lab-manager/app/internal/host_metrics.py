@@ -0,0 +1,286 @@
+# app/internal/host_metrics.py
+#
+# Host CPU/mem history. Every heartbeat is kept at full resolution in a
+# per-host ring of HOST_METRICS_RAW_SAMPLES entries (a float timestamp and
+# two bytes per sample, so memory is fixed however long the manager runs),
+# and folded into the host's open 1-minute and 1-hour buckets. Closed
+# buckets are upserted every HOST_METRICS_FLUSH_INTERVAL seconds into
+# `host_metrics_1m` and `host_metrics_1h`, one row per host and interval;
+# an upsert merges into an existing row (weighted averages, max of maxes),
+# so a bucket split by a restart still adds up. Minute rows are kept for
+# HOST_METRICS_MINUTE_RETENTION days and hour rows for
+# HOST_METRICS_HOUR_RETENTION days.
+#
+# A query picks the coarsest resolution its step allows: the raw ring when
+# the step is under a minute and the ring reaches back far enough, else the
+# minute table, else the hour table (also for ranges older than the minute
+# retention). Tables are binned by step in SQL over their primary key, and
+# buckets not yet written are merged in from memory.
+
+import asyncio
+import datetime
+import logging
+import math
+import time
+import uuid
+from array import array
+from dataclasses import dataclass
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import HostMetricHour, HostMetricMinute
+
+logger = logging.getLogger("host_metrics")
+settings = get_settings()
+
+MINUTE, HOUR = 60, 3600
+TABLES = {MINUTE: HostMetricMinute, HOUR: HostMetricHour}
+RESOLUTIONS = {MINUTE: "1m", HOUR: "1h"}
+PRUNE_INTERVAL = 3600
+UPSERT_CHUNK = 2000   # rows per INSERT, well under Postgres' bind parameter limit
+
+
+@dataclass
+class Bucket:
+    samples: int = 0
+    cpu_sum: float = 0.0
+    cpu_max: int = 0
+    mem_sum: float = 0.0
+    mem_max: int = 0
+
+    def add(self, cpu: int, mem: int):
+        self.samples += 1
+        self.cpu_sum += cpu
+        self.mem_sum += mem
+        self.cpu_max = max(self.cpu_max, cpu)
+        self.mem_max = max(self.mem_max, mem)
+
+    def merge(self, other: "Bucket"):
+        self.samples += other.samples
+        self.cpu_sum += other.cpu_sum
+        self.mem_sum += other.mem_sum
+        self.cpu_max = max(self.cpu_max, other.cpu_max)
+        self.mem_max = max(self.mem_max, other.mem_max)
+
+    def point(self, t: float) -> dict:
+        return {
+            "t": datetime.datetime.fromtimestamp(t, datetime.timezone.utc),
+            "samples": self.samples,
+            "cpu_avg": round(self.cpu_sum / self.samples, 2),
+            "cpu_max": self.cpu_max,
+            "mem_avg": round(self.mem_sum / self.samples, 2),
+            "mem_max": self.mem_max,
+        }
+
+
+class Ring:
+    """The last `capacity` heartbeats of one host."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self._next = 0
+        self._t = array("d", bytes(8 * capacity))
+        self._cpu = array("B", bytes(capacity))
+        self._mem = array("B", bytes(capacity))
+
+    def push(self, t: float, cpu: int, mem: int):
+        i = self._next
+        self._t[i] = t
+        self._cpu[i] = max(0, min(255, cpu))
+        self._mem[i] = max(0, min(255, mem))
+        self._next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def oldest(self) -> float | None:
+        if not self.size:
+            return None
+        return self._t[(self._next - self.size) % self.capacity]
+
+    def between(self, start: float, end: float):
+        first = (self._next - self.size) % self.capacity
+        for k in range(self.size):
+            i = (first + k) % self.capacity
+            if start <= self._t[i] < end:
+                yield self._t[i], self._cpu[i], self._mem[i]
+
+
+class HostMetrics:
+    def __init__(self):
+        self._rings: dict[uuid.UUID, Ring] = {}
+        # Per width: the bucket each host is filling, and closed ones not yet written
+        self._open: dict[int, dict[uuid.UUID, tuple[int, Bucket]]] = {MINUTE: {}, HOUR: {}}
+        self._pending: dict[int, dict[tuple[uuid.UUID, int], Bucket]] = {MINUTE: {}, HOUR: {}}
+        self._pruned_at = 0.0
+
+    # ─── Writes (memory only) ───────────────────────────────────────────
+
+    def record(self, host_id: uuid.UUID, cpu: int, mem: int):
+        now = time.time()
+        ring = self._rings.get(host_id)
+        if ring is None:
+            ring = self._rings[host_id] = Ring(settings.host_metrics_raw_samples)
+        ring.push(now, cpu, mem)
+        for width, open_ in self._open.items():
+            start = int(now // width * width)
+            current = open_.get(host_id)
+            if current is None or current[0] != start:
+                if current is not None:
+                    self._close(width, host_id, *current)
+                current = open_[host_id] = (start, Bucket())
+            current[1].add(cpu, mem)
+
+    def forget(self, host_id: uuid.UUID):
+        self._rings.pop(host_id, None)
+        for width in TABLES:
+            self._open[width].pop(host_id, None)
+            for key in [k for k in self._pending[width] if k[0] == host_id]:
+                del self._pending[width][key]
+
+    def _close(self, width: int, host_id: uuid.UUID, start: int, bucket: Bucket):
+        pending = self._pending[width].get((host_id, start))
+        if pending is None:
+            self._pending[width][(host_id, start)] = bucket
+        else:
+            pending.merge(bucket)
+
+    # ─── Write-behind ───────────────────────────────────────────────────
+
+    async def flush(self, final: bool = False):
+        """Upsert closed buckets (all open ones too if `final`) and prune old rows."""
+        now = time.time()
+        for width, open_ in self._open.items():
+            for host_id, (start, bucket) in list(open_.items()):
+                # A host that stopped beating never closes its bucket itself
+                if final or start + width <= now:
+                    del open_[host_id]
+                    self._close(width, host_id, start, bucket)
+
+        batches = {width: self._pending[width] for width in TABLES}
+        self._pending = {width: {} for width in TABLES}
+        try:
+            async with SessionLocal() as db:
+                for width, batch in batches.items():
+                    items = list(batch.items())
+                    for i in range(0, len(items), UPSERT_CHUNK):
+                        await db.execute(_upsert(TABLES[width], items[i:i + UPSERT_CHUNK]))
+                if now - self._pruned_at >= PRUNE_INTERVAL:
+                    await self._prune(db, now)
+                await db.commit()
+        except Exception:
+            # Put them back for the next flush, unless their host is gone
+            for width, batch in batches.items():
+                for (host_id, start), bucket in batch.items():
+                    if host_id in self._rings:
+                        self._close(width, host_id, start, bucket)
+            raise
+
+    async def _prune(self, db: AsyncSession, now: float):
+        for table, days in (
+            (HostMetricMinute, settings.host_metrics_minute_retention),
+            (HostMetricHour, settings.host_metrics_hour_retention),
+        ):
+            cutoff = datetime.datetime.fromtimestamp(now - days * 86400, datetime.timezone.utc)
+            await db.execute(delete(table).where(table.bucket < cutoff))
+        self._pruned_at = now
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.host_metrics_flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Host metrics flush failed")
+
+    # ─── Reads ──────────────────────────────────────────────────────────
+
+    async def series(
+        self, db: AsyncSession, host_id: uuid.UUID, start: float, end: float, step: int
+    ) -> tuple[str, int, list[dict]]:
+        """(resolution, effective step, points) for [start, end) in `step`-second bins."""
+        ring = self._rings.get(host_id)
+        oldest = ring.oldest() if ring else None
+        if step < MINUTE and oldest is not None and oldest <= start:
+            bins: dict[int, Bucket] = {}
+            for t, cpu, mem in ring.between(start, end):
+                bins.setdefault(int(t // step * step), Bucket()).add(cpu, mem)
+            return "raw", step, [bins[b].point(b) for b in sorted(bins)]
+
+        minute_floor = time.time() - settings.host_metrics_minute_retention * 86400
+        width = MINUTE if step < HOUR and start >= minute_floor else HOUR
+        step = math.ceil(step / width) * width
+        start = start // width * width   # the bucket holding `start`
+        bins = await self._from_table(db, TABLES[width], host_id, start, end, step)
+
+        # Buckets still in memory
+        unwritten = [
+            (s, b) for (h, s), b in self._pending[width].items() if h == host_id
+        ]
+        current = self._open[width].get(host_id)
+        if current:
+            unwritten.append(current)
+        for s, bucket in unwritten:
+            if start <= s < end:
+                bins.setdefault(int(s // step * step), Bucket()).merge(bucket)
+        return RESOLUTIONS[width], step, [bins[b].point(b) for b in sorted(bins)]
+
+    @staticmethod
+    async def _from_table(db, table, host_id, start, end, step) -> dict[int, Bucket]:
+        epoch = func.extract("epoch", table.bucket)
+        bin_ = (func.floor(epoch / step) * step).label("bin")
+        rows = (await db.execute(
+            select(
+                bin_,
+                func.sum(table.samples),
+                func.sum(table.cpu_avg * table.samples),
+                func.max(table.cpu_max),
+                func.sum(table.mem_avg * table.samples),
+                func.max(table.mem_max),
+            )
+            .where(
+                table.host_id == host_id,
+                table.bucket >= datetime.datetime.fromtimestamp(start, datetime.timezone.utc),
+                table.bucket < datetime.datetime.fromtimestamp(end, datetime.timezone.utc),
+            )
+            .group_by(bin_)
+        )).all()
+        return {
+            int(b): Bucket(int(n), float(cs), cm, float(ms), mm)
+            for b, n, cs, cm, ms, mm in rows
+        }
+
+
+def _upsert(table, items: list[tuple[tuple[uuid.UUID, int], Bucket]]):
+    rows = [
+        {
+            "host_id": host_id,
+            "bucket": datetime.datetime.fromtimestamp(start, datetime.timezone.utc),
+            "samples": b.samples,
+            "cpu_avg": b.cpu_sum / b.samples,
+            "cpu_max": b.cpu_max,
+            "mem_avg": b.mem_sum / b.samples,
+            "mem_max": b.mem_max,
+        }
+        for (host_id, start), b in items
+    ]
+    stmt = insert(table).values(rows)
+    new, old = stmt.excluded, table.__table__.c
+    total = old.samples + new.samples
+    return stmt.on_conflict_do_update(
+        index_elements=[old.host_id, old.bucket],
+        set_={
+            "samples": total,
+            "cpu_avg": (old.cpu_avg * old.samples + new.cpu_avg * new.samples) / total,
+            "cpu_max": func.greatest(old.cpu_max, new.cpu_max),
+            "mem_avg": (old.mem_avg * old.samples + new.mem_avg * new.samples) / total,
+            "mem_max": func.greatest(old.mem_max, new.mem_max),
+        },
+    )
+
+
+host_metrics = HostMetrics()
@@ -0,0 +1,184 @@
+# app/internal/host_state.py
+#
+# Live host state table. Heartbeats and the failure detector update it in
+# memory only; a background task writes the rows that changed back to
+# Postgres every HOST_FLUSH_INTERVAL seconds in one batched UPDATE. Host
+# listings are served from here, so they show the latest heartbeat even
+# before it reaches the DB.
+
+import asyncio
+import datetime
+import logging
+import uuid
+from dataclasses import dataclass, field
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import ContainerHost, HostStatus
+from app.internal.host_metrics import host_metrics
+from app.internal.placement import placement
+
+logger = logging.getLogger("host_state")
+settings = get_settings()
+
+
+_FLUSH = (
+    update(ContainerHost.__table__)
+    .where(ContainerHost.__table__.c.id == bindparam("host_id"))
+    .values(
+        cpu_percent=bindparam("b_cpu"),
+        mem_percent=bindparam("b_mem"),
+        status=bindparam("b_status"),
+        last_seen=bindparam("b_last_seen"),
+    )
+)
+
+
+@dataclass
+class HostState:
+    id: uuid.UUID
+    hostname: str
+    ip: str
+    ssh_port: int
+    api_port: int
+    max_containers: int
+    current_containers: int
+    cpu_percent: int
+    mem_percent: int
+    status: HostStatus
+    last_seen: datetime.datetime | None
+    dirty: bool = False
+    # Agent operation queue, as of the last heartbeat (never persisted)
+    ops_queued: int = 0
+    ops_running: int = 0
+    inventory_digest: str | None = None
+    # Heaviest environments by CPU: [{name, cpu_percent, mem_bytes}]
+    top_environments: list[dict] = field(default_factory=list)
+
+
+class HostStateTable:
+    def __init__(self):
+        self._hosts: dict[uuid.UUID, HostState] = {}
+
+    async def load(self, db: AsyncSession):
+        hosts = (await db.execute(select(ContainerHost))).scalars().all()
+        self._hosts = {h.id: self._from_row(h) for h in hosts}
+
+    # ─── Reads ──────────────────────────────────────────────────────────
+
+    def get(self, host_id: uuid.UUID) -> HostState | None:
+        state = self._hosts.get(host_id)
+        if state:
+            state.current_containers = placement.used(host_id, state.current_containers)
+        return state
+
+    def all(self) -> list[HostState]:
+        return [self.get(host_id) for host_id in list(self._hosts)]
+
+    # ─── Writes (memory only) ───────────────────────────────────────────
+
+    def heartbeat(
+        self,
+        host_id: uuid.UUID,
+        cpu: int,
+        mem: int,
+        ops_queued: int = 0,
+        ops_running: int = 0,
+        inventory_digest: str | None = None,
+        top_environments: list[dict] | None = None,
+    ) -> bool:
+        state = self._hosts.get(host_id)
+        if not state:
+            return False
+        state.cpu_percent, state.mem_percent = cpu, mem
+        state.ops_queued, state.ops_running = ops_queued, ops_running
+        state.inventory_digest = inventory_digest
+        state.top_environments = top_environments or []
+        state.last_seen = datetime.datetime.now(datetime.timezone.utc)
+        state.status = HostStatus.healthy
+        state.dirty = True
+        placement.heartbeat(host_id, cpu, mem)
+        host_metrics.record(host_id, cpu, mem)
+        return True
+
+    def mark_offline(self, host_id: uuid.UUID):
+        state = self._hosts.get(host_id)
+        if state and state.status != HostStatus.offline:
+            state.status = HostStatus.offline
+            state.dirty = True
+            placement.mark_offline(host_id)
+
+    def upsert(self, host: ContainerHost):
+        """Registration or an admin edit (already committed to the DB)."""
+        state = self._hosts.get(host.id)
+        if state is None:
+            self._hosts[host.id] = self._from_row(host)
+            return
+        # Heartbeat-owned fields in the row may be older than ours
+        state.hostname, state.ip = host.hostname, host.ip
+        state.ssh_port, state.api_port = host.ssh_port, host.api_port
+        state.max_containers = host.max_containers
+
+    def remove(self, host_id: uuid.UUID):
+        self._hosts.pop(host_id, None)
+        host_metrics.forget(host_id)
+
+    # ─── Write-behind ───────────────────────────────────────────────────
+
+    async def flush(self):
+        dirty = [s for s in self._hosts.values() if s.dirty]
+        if not dirty:
+            return
+        rows = [
+            {
+                "host_id": s.id,
+                "b_cpu": s.cpu_percent,
+                "b_mem": s.mem_percent,
+                "b_status": s.status,
+                "b_last_seen": s.last_seen,
+            }
+            for s in dirty
+        ]
+        for s in dirty:
+            s.dirty = False
+        try:
+            async with SessionLocal() as db:
+                # One executemany round trip for every changed row
+                await db.execute(_FLUSH, rows)
+                await db.commit()
+        except Exception:
+            for s in dirty:
+                if s.id in self._hosts:
+                    s.dirty = True
+            raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.host_flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Host state flush failed")
+
+    @staticmethod
+    def _from_row(h: ContainerHost) -> HostState:
+        return HostState(
+            id=h.id,
+            hostname=h.hostname,
+            ip=h.ip,
+            ssh_port=h.ssh_port,
+            api_port=h.api_port,
+            max_containers=h.max_containers,
+            current_containers=h.current_containers or 0,
+            cpu_percent=h.cpu_percent or 0,
+            mem_percent=h.mem_percent or 0,
+            status=h.status,
+            last_seen=h.last_seen,
+        )
+
+
+host_state = HostStateTable()
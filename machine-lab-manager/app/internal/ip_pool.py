@@ -0,0 +1,180 @@
+# app/internal/ip_pool.py
+#
+# VPN address allocation. Each pool is a bitmap with one bit per address of
+# its subnet (8 KiB for a /16), plus a summary bitmap with one bit per full
+# 64-bit word, so finding a free address touches a handful of words no
+# matter how large or full the subnet is. Users and containers draw from
+# separate pools carved out of the VPN network.
+#
+# Allocation happens synchronously on the event loop, so concurrent requests
+# in this process can never be handed the same address; the partial unique
+# index on active `vpn_profiles` addresses guards the DB itself. Pools are
+# rebuilt from active profiles at startup.
+
+import logging
+from ipaddress import IPv4Address, IPv4Network, ip_address
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import VPNProfile
+
+logger = logging.getLogger("ip_pool")
+
+USERS, CONTAINERS = "users", "containers"
+
+WORD = 64
+FULL = (1 << WORD) - 1
+
+
+def _first_clear(word: int) -> int:
+    return (~word & (word + 1)).bit_length() - 1
+
+
+class PoolExhausted(RuntimeError):
+    pass
+
+
+class AddressPool:
+    def __init__(self, name: str, subnet: IPv4Network, reserved: set[IPv4Address]):
+        self.name = name
+        self.subnet = subnet
+        self.size = subnet.num_addresses
+        self._base = int(subnet.network_address)
+        self._words = [0] * -(-self.size // WORD)
+        self._summary = [0] * -(-len(self._words) // WORD)
+        self._cursor = 0  # no summary word before this one has room
+        self.allocated = 0
+
+        # Bits past the end of the subnet (and summary bits past the last
+        # word), and reserved addresses, stay set
+        for i in range(self.size, len(self._words) * WORD):
+            self._set(i)
+        for w in range(len(self._words), len(self._summary) * WORD):
+            self._summary[w // WORD] |= 1 << (w % WORD)
+        self.reserved = 0
+        for addr in reserved:
+            if addr in subnet:
+                self._set(int(addr) - self._base)
+                self.reserved += 1
+
+    @property
+    def capacity(self) -> int:
+        return self.size - self.reserved
+
+    def allocate(self) -> str:
+        # 1) First summary word with a non-full word under it
+        while self._cursor < len(self._summary) and self._summary[self._cursor] == FULL:
+            self._cursor += 1
+        if self._cursor == len(self._summary):
+            raise PoolExhausted(f"No free address in VPN {self.name} pool {self.subnet}")
+        w = self._cursor * WORD + _first_clear(self._summary[self._cursor])
+
+        # 2) First clear bit in that word
+        i = w * WORD + _first_clear(self._words[w])
+        self._set(i)
+        self.allocated += 1
+        return str(IPv4Address(self._base + i))
+
+    def mark(self, addr: IPv4Address) -> bool:
+        """Record an address handed out before startup."""
+        i = int(addr) - self._base
+        if self._words[i // WORD] >> (i % WORD) & 1:
+            return False
+        self._set(i)
+        self.allocated += 1
+        return True
+
+    def free(self, addr: IPv4Address):
+        i = int(addr) - self._base
+        w, bit = divmod(i, WORD)
+        if not self._words[w] >> bit & 1:
+            return
+        self._words[w] &= ~(1 << bit)
+        self._summary[w // WORD] &= ~(1 << (w % WORD))
+        self._cursor = min(self._cursor, w // WORD)
+        self.allocated -= 1
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.name,
+            "subnet": str(self.subnet),
+            "capacity": self.capacity,
+            "allocated": self.allocated,
+            "free": self.capacity - self.allocated,
+            "utilization": round(self.allocated / self.capacity, 4) if self.capacity else 1.0,
+        }
+
+    def _set(self, i: int):
+        w, bit = divmod(i, WORD)
+        self._words[w] |= 1 << bit
+        if self._words[w] == FULL:
+            self._summary[w // WORD] |= 1 << (w % WORD)
+
+
+class AddressAllocator:
+    """The user and container pools of one VPN network."""
+
+    def __init__(self, network: IPv4Network, pools: dict[str, IPv4Network]):
+        for name, subnet in pools.items():
+            if not subnet.subnet_of(network):
+                raise ValueError(f"VPN {name} pool {subnet} is outside {network}")
+        subnets = list(pools.values())
+        for i, a in enumerate(subnets):
+            if any(a.overlaps(b) for b in subnets[i + 1:]):
+                raise ValueError(f"VPN address pools overlap: {subnets}")
+        self.network = network
+        self._subnets = pools
+        self.pools = self._build()
+
+    async def load(self, db: AsyncSession):
+        """Mark the addresses of every active profile as taken."""
+        ips = (await db.execute(
+            select(VPNProfile.ip_address).where(VPNProfile.revoked == False)
+        )).scalars().all()
+        pools = self._build()
+        for ip in ips:
+            addr = _parse(ip)
+            pool = next((p for p in pools.values() if addr in p.subnet), None)
+            if pool is None:
+                logger.warning("Active VPN address %s is outside every pool", addr)
+            elif not pool.mark(addr):
+                logger.warning("VPN address %s is held by more than one profile", addr)
+        self.pools = pools
+
+    def allocate(self, pool: str, count: int = 1) -> list[str]:
+        """`count` addresses from one pool, all or none."""
+        p = self.pools[pool]
+        if p.capacity - p.allocated < count:
+            raise PoolExhausted(f"No free address in VPN {pool} pool {p.subnet}")
+        return [p.allocate() for _ in range(count)]
+
+    def release(self, ips):
+        for ip in ips:
+            addr = _parse(ip)
+            pool = self._pool_of(addr)
+            if pool:
+                pool.free(addr)
+
+    def stats(self) -> list[dict]:
+        return [p.stats() for p in self.pools.values()]
+
+    def _build(self) -> dict[str, AddressPool]:
+        # The network and broadcast addresses, and the server's own
+        net = self.network
+        reserved = {net.network_address, net.network_address + 1, net.broadcast_address}
+        return {
+            name: AddressPool(name, subnet, reserved)
+            for name, subnet in self._subnets.items()
+        }
+
+    def _pool_of(self, addr: IPv4Address) -> AddressPool | None:
+        for pool in self.pools.values():
+            if addr in pool.subnet:
+                return pool
+        return None
+
+
+def _parse(ip) -> IPv4Address:
+    # INET values may come back with a prefix length
+    return ip_address(str(ip).split("/")[0])
@@ -0,0 +1,148 @@
+# app/internal/jobs.py
+
+import asyncio
+import datetime
+import logging
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from app.models import ContainerStatus
+from app.internal.prometheus import LAUNCH_FAILURES, LAUNCH_PHASE, LAUNCH_TOTAL
+
+logger = logging.getLogger("jobs")
+
+
+@dataclass
+class JobPhase:
+    name: str
+    started_at: datetime.datetime
+    finished_at: datetime.datetime | None = None
+    error: str | None = None
+
+
+@dataclass
+class LaunchJob:
+    """In-memory record of one launch moving through the background pipeline."""
+    container_id: str
+    host_id: uuid.UUID
+    user_id: uuid.UUID | None
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    status: ContainerStatus = ContainerStatus.pending
+    phase: str = "queued"
+    phases: list[JobPhase] = field(default_factory=list)
+    error: str | None = None
+    cache_hit: bool | None = None
+    created_at: datetime.datetime = field(default_factory=datetime.datetime.utcnow)
+    finished_at: datetime.datetime | None = None
+
+    @contextmanager
+    def step(self, name: str):
+        """Record the start/end of a pipeline phase (errors are re-raised)."""
+        rec = JobPhase(name=name, started_at=datetime.datetime.utcnow())
+        self.phase = name
+        self.phases.append(rec)
+        try:
+            yield rec
+        except Exception as e:
+            rec.error = str(e)
+            LAUNCH_FAILURES.labels(name).inc()
+            raise
+        finally:
+            rec.finished_at = datetime.datetime.utcnow()
+            LAUNCH_PHASE.labels(name).observe(
+                (rec.finished_at - rec.started_at).total_seconds()
+            )
+
+    def finish(self, status: ContainerStatus, error: str | None = None):
+        self.status = status
+        self.error = error
+        self.phase = {
+            ContainerStatus.running: "done",
+            ContainerStatus.stopped: "cancelled",   # stopped while it launched
+        }.get(status, "failed")
+        self.finished_at = datetime.datetime.utcnow()
+        LAUNCH_TOTAL.labels(self.phase).observe(
+            (self.finished_at - self.created_at).total_seconds()
+        )
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+
+class QueueFull(Exception):
+    """Raised when the launch queue cannot take more work."""
+
+
+class JobQueue:
+    """
+    Bounded FIFO of launch jobs drained by a fixed number of worker tasks.
+    Finished jobs are kept for `ttl` seconds so clients can poll the outcome.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._jobs: dict[str, LaunchJob] = {}
+        self._ttl = 3600
+
+    def start(self, workers: int, maxsize: int, ttl: int):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._ttl = ttl
+        self._workers = [
+            asyncio.create_task(self._worker(i)) for i in range(max(1, workers))
+        ]
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def ensure_capacity(self):
+        if self._queue is None or self._queue.full():
+            raise QueueFull("Launch queue is full")
+
+    def submit(
+        self,
+        job: LaunchJob,
+        run: Callable[[LaunchJob], Awaitable[None]],
+    ) -> LaunchJob:
+        self.ensure_capacity()
+        self._prune()
+        self._jobs[job.id] = job
+        self._queue.put_nowait((job, run))
+        return job
+
+    def get(self, job_id: str) -> LaunchJob | None:
+        return self._jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self._ttl)
+        stale = [
+            jid for jid, j in self._jobs.items()
+            if j.finished_at is not None and j.finished_at < cutoff
+        ]
+        for jid in stale:
+            del self._jobs[jid]
+
+    async def _worker(self, idx: int):
+        while True:
+            job, run = await self._queue.get()
+            LAUNCH_PHASE.labels("queued").observe(
+                (datetime.datetime.utcnow() - job.created_at).total_seconds()
+            )
+            try:
+                await run(job)
+            except Exception as e:
+                # The pipeline records its own failures; this is a last resort
+                logger.exception("Launch job %s crashed in worker %d", job.id, idx)
+                if not job.done:
+                    job.finish(ContainerStatus.error, str(e))
+            finally:
+                self._queue.task_done()
+
+
+launch_jobs = JobQueue()
@@ -0,0 +1,210 @@
+# app/internal/launcher.py
+
+import asyncio
+import base64
+import logging
+
+from fastapi import status
+from sqlalchemy import update
+from app.core.database import SessionLocal
+from app.models import Container, ContainerHost, ContainerStatus
+from app.internal.agent_client import agents
+from app.internal.jobs import LaunchJob
+from app.internal.bundles import SpooledBundle
+from app.internal.ip_pool import CONTAINERS
+from app.internal.live_state import live_state
+from app.internal.placement import adjust_container_count, placement
+from app.internal.teardown import request_removal
+from app.internal.vpn import (
+    create_or_get_profile,
+    apply_vpn_rule,
+    profile_config,
+    remove_vpn_profile,
+)
+
+logger = logging.getLogger("launcher")
+
+
+class LaunchError(Exception):
+    """A launch pipeline step failed; the message is surfaced on the job."""
+
+
+# (host_id, digest) pairs the agent is known to have cached, plus one lock
+# per pair so concurrent launches of a template upload it only once.
+_cached_on_host: set[tuple] = set()
+_transfer_locks: dict[tuple, asyncio.Lock] = {}
+
+BUNDLE_CHUNK = 1024 * 1024
+
+
+async def _iter_file(path: str):
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, BUNDLE_CHUNK):
+            yield chunk
+
+
+async def ensure_bundle_on_host(host: ContainerHost, bundle: SpooledBundle):
+    """Upload a bundle to the agent's digest cache unless it already has it."""
+    key = (host.id, bundle.sha256)
+    if key in _cached_on_host:
+        return
+
+    lock = _transfer_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        if key in _cached_on_host:
+            return
+        path = f"/bundles/{bundle.sha256}"
+        resp = await agents.request(host, "HEAD", path, timeout=10.0)
+        if resp.status_code == status.HTTP_404_NOT_FOUND:
+            # A streamed body cannot be replayed, so no retries here
+            resp = await agents.request(
+                host, "PUT", path,
+                retry=False,
+                content=_iter_file(bundle.path),
+                headers={"Content-Type": "application/zip"},
+                timeout=600.0,
+            )
+            if resp.status_code not in (status.HTTP_200_OK, status.HTTP_201_CREATED):
+                raise LaunchError(f"Agent rejected bundle upload: {resp.text}")
+        elif resp.status_code != status.HTTP_200_OK:
+            raise LaunchError(f"Agent bundle lookup failed: HTTP {resp.status_code}")
+        _cached_on_host.add(key)
+
+
+async def run_launch(job: LaunchJob, bundle: SpooledBundle, discard: bool = True):
+    """
+    Background pipeline for one pending Container row:
+    VPN profiles -> bundle to agent cache -> agent `docker compose up`
+    -> mark running -> iptables.
+    On any failure the row is set to `error` and the host slot is released;
+    an environment the agent may already have started is queued for removal.
+    A row stopped while the pipeline ran is left alone and the job cancelled.
+    Ad-hoc uploads (`discard=True`) are removed once the pipeline is done.
+    """
+    try:
+        await _run_launch(job, bundle)
+    finally:
+        if discard:
+            await asyncio.to_thread(bundle.discard)
+
+
+async def _start_from_cache(host, name, bundle, vpn_conf: bytes):
+    return await agents.request(
+        host, "POST", "/containers/from-bundle",
+        json={
+            "name": name,
+            "digest": bundle.sha256,
+            "vpn_conf_base64": base64.b64encode(vpn_conf).decode(),
+        },
+        timeout=600.0,  # 10 minutes for container building
+    )
+
+
+async def start_on_host(
+    host: ContainerHost,
+    name: str,
+    bundle: SpooledBundle,
+    vpn_conf: bytes,
+) -> bool | None:
+    """
+    Start environment `name` from the agent's bundle cache, re-uploading
+    the bundle once if the agent evicted it. Returns the agent's cache_hit.
+    """
+    resp = await _start_from_cache(host, name, bundle, vpn_conf)
+    if resp.status_code == status.HTTP_404_NOT_FOUND:
+        # Agent evicted the bundle since we last saw it
+        _cached_on_host.discard((host.id, bundle.sha256))
+        await ensure_bundle_on_host(host, bundle)
+        resp = await _start_from_cache(host, name, bundle, vpn_conf)
+    if resp.status_code != status.HTTP_201_CREATED:
+        raise LaunchError(f"Agent failed to launch container: {resp.text}")
+    live_state.invalidate(host.id)
+    return resp.json().get("cache_hit")
+
+
+async def _run_launch(job: LaunchJob, bundle: SpooledBundle):
+    async with SessionLocal() as db:
+        cont = await db.get(Container, job.container_id)
+        host = await db.get(ContainerHost, job.host_id)
+        if not cont or not host:
+            job.finish(ContainerStatus.error, "Container or host disappeared")
+            return
+
+        started = False
+        try:
+            # 1) User + container VPN profiles (warm-pool launches have no user yet)
+            with job.step("vpn_profiles"):
+                user_prof = None
+                if job.user_id:
+                    user_prof = await create_or_get_profile(db, str(job.user_id))
+                cont_prof = await create_or_get_profile(
+                    db, job.container_id, pool=CONTAINERS
+                )
+                vpn_conf = await profile_config(cont_prof)
+
+            # 2) Make sure the host has the bundle (at most one transfer)
+            with job.step("bundle_transfer"):
+                await ensure_bundle_on_host(host, bundle)
+
+            # 3) Start the environment from the agent's cache
+            started = True   # from here on the agent may hold the environment
+            with job.step("agent_launch"):
+                job.cache_hit = await start_on_host(
+                    host, job.container_id, bundle, vpn_conf
+                )
+
+            # 4) Persist the running state, unless the row was stopped (or
+            #    deleted) meanwhile: its slot and VPN access are gone already
+            with job.step("persist"):
+                persisted = (await db.execute(
+                    update(Container)
+                    .where(
+                        Container.id == job.container_id,
+                        Container.status == ContainerStatus.pending,
+                    )
+                    .values(status=ContainerStatus.running)
+                    .execution_options(synchronize_session=False)
+                )).rowcount
+                await db.commit()
+            if not persisted:
+                logger.info("Launch %s was stopped before it finished", job.id)
+                await request_removal(host, job.container_id)
+                job.finish(ContainerStatus.stopped, "Stopped before the launch finished")
+                return
+
+            # 5) Allow only user↔container over tun0
+            if user_prof:
+                with job.step("firewall"):
+                    await apply_vpn_rule(user_prof.ip_address, cont_prof.ip_address)
+        except Exception as e:
+            logger.warning("Launch %s failed in phase %s: %s", job.id, job.phase, e)
+            await _fail(db, job, str(e), started)
+            return
+
+        job.finish(ContainerStatus.running)
+
+
+async def _fail(db, job: LaunchJob, error: str, started: bool = False):
+    await db.rollback()
+    cont = await db.get(Container, job.container_id)
+    held_slot = cont and cont.status in (ContainerStatus.pending, ContainerStatus.running)
+    if held_slot:
+        cont.status = ContainerStatus.error
+        await adjust_container_count(db, job.host_id, -1)
+    await db.commit()
+    if held_slot:
+        placement.freed(job.host_id)
+    try:
+        await remove_vpn_profile(db, job.container_id)
+    except Exception:
+        logger.exception("Could not clean up VPN profile for %s", job.container_id)
+    if started:
+        # Don't leave it running on the host; if the agent can't take the
+        # removal now, the fleet reconciler finds it next to its error row
+        try:
+            host = await db.get(ContainerHost, job.host_id)
+            if host:
+                await request_removal(host, job.container_id)
+        except Exception:
+            logger.exception("Could not queue removal of %s", job.container_id)
+    job.finish(ContainerStatus.error, error)
@@ -0,0 +1,89 @@
+# app/internal/live_state.py
+#
+# Short-lived snapshots of what each agent reports as running, keyed by
+# host. Concurrent readers of the same host share one in-flight fetch, and a
+# snapshot is reused for LIVE_STATE_TTL seconds, so a listing page costs at
+# most one agent round trip per host no matter how many rows it shows.
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from app.core.config import get_settings
+from app.models import Container, ContainerHost
+from app.internal.agent_client import agents
+
+logger = logging.getLogger("live_state")
+settings = get_settings()
+
+
+@dataclass
+class HostSnapshot:
+    fetched_at: float
+    projects: dict[str, list[dict]] = field(default_factory=dict)
+    unlabeled: list[dict] = field(default_factory=list)  # agents without compose labels
+    error: str | None = None
+
+    def services(self, cont: Container) -> list[dict]:
+        """The compose services of one environment."""
+        name = str(cont.name)
+        if name in self.projects:
+            return self.projects[name]
+        return [c for c in self.unlabeled if name in c["name"]]
+
+
+def summarize(services: list[dict]) -> str:
+    """One word for an environment: running, degraded, stopped or missing."""
+    if not services:
+        return "missing"
+    running = sum(1 for s in services if s.get("status") == "running")
+    if running == len(services):
+        return "running"
+    return "degraded" if running else "stopped"
+
+
+class LiveStateCache:
+    def __init__(self):
+        self._snapshots: dict[uuid.UUID, HostSnapshot] = {}
+        self._inflight: dict[uuid.UUID, asyncio.Task] = {}
+
+    async def get(self, host: ContainerHost) -> HostSnapshot:
+        snap = self._snapshots.get(host.id)
+        if snap and time.monotonic() - snap.fetched_at < settings.live_state_ttl:
+            return snap
+        task = self._inflight.get(host.id)
+        if task is None:
+            task = asyncio.create_task(self._fetch(host))
+            self._inflight[host.id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(host.id, None))
+        return await asyncio.shield(task)
+
+    async def gather(self, hosts: list[ContainerHost]) -> dict[uuid.UUID, HostSnapshot]:
+        """Snapshots of several hosts, fetched concurrently."""
+        snaps = await asyncio.gather(*(self.get(h) for h in hosts))
+        return {h.id: s for h, s in zip(hosts, snaps)}
+
+    def invalidate(self, host_id: uuid.UUID):
+        self._snapshots.pop(host_id, None)
+
+    async def _fetch(self, host: ContainerHost) -> HostSnapshot:
+        snap = HostSnapshot(fetched_at=time.monotonic())
+        try:
+            resp = await agents.request(host, "GET", "/containers", timeout=10.0)
+            resp.raise_for_status()
+            for c in resp.json():
+                if c.get("project"):
+                    snap.projects.setdefault(c["project"], []).append(c)
+                else:
+                    snap.unlabeled.append(c)
+        except Exception as e:
+            # Errors are cached too, so a dead host is not hammered
+            logger.warning("Live state of %s unavailable: %s", host.hostname, e)
+            snap.error = str(e)
+        self._snapshots[host.id] = snap
+        return snap
+
+
+live_state = LiveStateCache()
@@ -0,0 +1,158 @@
+# app/internal/pki.py
+#
+# In-process client PKI. The Easy-RSA CA certificate and key and the
+# tls-auth key are read once and kept in memory; client certificates are
+# signed here instead of by forking Easy-RSA, and .ovpn profiles are
+# rendered straight to bytes. Easy-RSA remains the tool that creates the CA
+# and the server certificate.
+#
+# Key generation is the only expensive step, so it is a plain module-level
+# function that the certificate pool runs in worker processes.
+
+import datetime
+import os
+import secrets
+import threading
+from dataclasses import dataclass
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+# Paths
+EASYRSA_DIR = "/etc/openvpn/easy-rsa"
+PKI_DIR = os.path.join(EASYRSA_DIR, "pki")
+
+
+def generate_key_pem(key_type: str, rsa_bits: int) -> bytes:
+    """A new client private key as unencrypted PKCS#8 PEM."""
+    if key_type == "ec":
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=rsa_bits)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+
+
+@dataclass
+class IssuedCert:
+    cn: str
+    cert_pem: str
+    key_pem: str
+
+
+class PKI:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ca_cert: x509.Certificate | None = None
+        self._ca_key = None
+        self.ca_pem = ""
+        self.tls_auth = ""
+
+    def load(self):
+        """Blocking: read the CA and tls-auth material (once)."""
+        with self._lock:
+            if self._ca_cert is not None:
+                return
+            with open(os.path.join(PKI_DIR, "ca.crt"), "rb") as f:
+                ca_pem = f.read()
+            with open(os.path.join(PKI_DIR, "private", "ca.key"), "rb") as f:
+                passphrase = settings.pki_ca_key_passphrase
+                ca_key = serialization.load_pem_private_key(
+                    f.read(), passphrase.encode() if passphrase else None
+                )
+            with open(os.path.join(EASYRSA_DIR, "ta.key")) as f:
+                self.tls_auth = f.read().strip()
+            self.ca_pem = ca_pem.decode().strip()
+            self._ca_key = ca_key
+            self._ca_cert = x509.load_pem_x509_certificate(ca_pem)
+
+    def sign(self, cn: str, key_pem: bytes) -> IssuedCert:
+        """Blocking: a client certificate for `cn` over an existing key."""
+        self.load()
+        key = serialization.load_pem_private_key(key_pem, None)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        usage_rsa = isinstance(key, rsa.RSAPrivateKey)
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)]))
+            .issuer_name(self._ca_cert.subject)
+            .public_key(key.public_key())
+            .serial_number(int.from_bytes(secrets.token_bytes(16), "big") >> 1)
+            .not_valid_before(now - datetime.timedelta(hours=1))
+            .not_valid_after(now + datetime.timedelta(days=settings.pki_cert_days))
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False)
+            .add_extension(
+                x509.KeyUsage(
+                    digital_signature=True,
+                    content_commitment=False,
+                    key_encipherment=usage_rsa,
+                    data_encipherment=False,
+                    key_agreement=not usage_rsa,
+                    key_cert_sign=False,
+                    crl_sign=False,
+                    encipher_only=False,
+                    decipher_only=False,
+                ),
+                critical=False,
+            )
+            .add_extension(
+                x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False
+            )
+            .add_extension(
+                x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False
+            )
+            .add_extension(
+                x509.AuthorityKeyIdentifier.from_issuer_public_key(self._ca_key.public_key()),
+                critical=False,
+            )
+            .sign(self._ca_key, hashes.SHA256())
+        )
+        return IssuedCert(
+            cn=cn,
+            cert_pem=cert.public_bytes(serialization.Encoding.PEM).decode().strip(),
+            key_pem=key_pem.decode().strip(),
+        )
+
+    def render(self, cert: IssuedCert) -> bytes:
+        """A complete client .ovpn with everything inlined."""
+        self.load()
+        host = os.getenv("OPENVPN_SERVER_HOST", "vpn.example.com")
+        port = os.getenv("OPENVPN_SERVER_PORT", "1194")
+        proto = os.getenv("OPENVPN_PROTO", "udp")
+        dev = os.getenv("OPENVPN_DEV", "tun")
+
+        conf = [
+            "client",
+            f"dev {dev}",
+            f"proto {proto}",
+            f"remote {host} {port}",
+            "nobind",
+            "remote-cert-tls server",
+            "<ca>",
+            self.ca_pem,
+            "</ca>",
+            "<cert>",
+            cert.cert_pem,
+            "</cert>",
+            "<key>",
+            cert.key_pem,
+            "</key>",
+            "key-direction 1",
+            "<tls-auth>",
+            self.tls_auth,
+            "</tls-auth>",
+            "verb 3",
+        ]
+        return ("\n".join(conf) + "\n").encode()
+
+
+pki = PKI()
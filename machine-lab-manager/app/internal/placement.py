@@ -0,0 +1,284 @@
+# app/internal/placement.py
+#
+# In-process index of host capacity. Picks come off a min-heap keyed by
+# (used + reserved) slots, so choosing a host is O(log n) and never touches
+# Postgres. Entries are invalidated lazily: every change to a host bumps its
+# version and pushes a fresh entry; stale ones are dropped when they surface.
+#
+# A pick takes a reservation on the host right away, so concurrent launches
+# see each other. The caller confirms it once the Container row is committed,
+# or releases it on failure; unconfirmed reservations expire after
+# PLACEMENT_RESERVATION_TTL seconds. The index is rebuilt from the DB at
+# startup and every PLACEMENT_SYNC_INTERVAL seconds.
+
+import asyncio
+import heapq
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+
+from sqlalchemy import func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import Container, ContainerHost, ContainerStatus, HostStatus
+
+logger = logging.getLogger("placement")
+settings = get_settings()
+
+LOAD_LIMIT = 90  # cpu/mem % at which a host stops taking new environments
+
+
+@dataclass
+class HostSlot:
+    id: uuid.UUID
+    max_containers: int
+    used: int = 0           # pending/running environments recorded in the DB
+    reserved: int = 0       # picks not yet confirmed or released
+    cpu: int = 0
+    mem: int = 0
+    online: bool = False
+    suspended: bool = False  # agent circuit breaker is open
+    suspected: bool = False  # heartbeat overdue (failure detector)
+    version: int = 0
+
+    @property
+    def load(self) -> int:
+        return self.used + self.reserved
+
+    @property
+    def available(self) -> bool:
+        return (
+            self.online
+            and not self.suspended
+            and not self.suspected
+            and self.cpu < LOAD_LIMIT
+            and self.mem < LOAD_LIMIT
+            and self.load < self.max_containers
+        )
+
+
+@dataclass
+class Reservation:
+    id: str
+    host_id: uuid.UUID
+    expires_at: float
+
+
+class PlacementIndex:
+    """
+    All methods except `sync`/`run` are synchronous, so each one runs
+    atomically on the event loop without locking.
+    """
+
+    def __init__(self):
+        self._hosts: dict[uuid.UUID, HostSlot] = {}
+        self._heap: list[tuple[int, int, uuid.UUID]] = []
+        self._reservations: dict[str, Reservation] = {}
+        self._expiry: deque[Reservation] = deque()
+
+    # ─── Picks ──────────────────────────────────────────────────────────
+
+    def reserve(self) -> Reservation | None:
+        """Take a slot on the least-loaded available host."""
+        self._expire()
+        while self._heap:
+            _, version, host_id = self._heap[0]
+            slot = self._hosts.get(host_id)
+            if slot is None or slot.version != version or not slot.available:
+                heapq.heappop(self._heap)
+                continue
+            slot.reserved += 1
+            self._touch(slot)
+            res = Reservation(
+                id=str(uuid.uuid4()),
+                host_id=host_id,
+                expires_at=time.monotonic() + settings.placement_reservation_ttl,
+            )
+            self._reservations[res.id] = res
+            self._expiry.append(res)
+            return res
+        return None
+
+    def confirm(self, res: Reservation):
+        """The environment is recorded in the DB; the slot is now in use."""
+        self._drop(res)
+        slot = self._hosts.get(res.host_id)
+        if slot:
+            slot.used += 1
+            self._touch(slot)
+
+    def release(self, res: Reservation):
+        """The launch never made it to the DB; give the slot back."""
+        self._drop(res)
+
+    def freed(self, host_id: uuid.UUID):
+        """A pending/running environment on `host_id` stopped or failed."""
+        slot = self._hosts.get(host_id)
+        if slot:
+            slot.used = max(0, slot.used - 1)
+            self._touch(slot)
+
+    def slots(self) -> list[HostSlot]:
+        return list(self._hosts.values())
+
+    def used(self, host_id: uuid.UUID, default: int = 0) -> int:
+        slot = self._hosts.get(host_id)
+        return slot.used if slot else default
+
+    # ─── Host state ─────────────────────────────────────────────────────
+
+    def heartbeat(self, host_id: uuid.UUID, cpu: int, mem: int):
+        slot = self._hosts.get(host_id)
+        if slot:
+            slot.cpu, slot.mem, slot.online = cpu, mem, True
+            self._touch(slot)
+
+    def mark_offline(self, host_id: uuid.UUID):
+        slot = self._hosts.get(host_id)
+        if slot and slot.online:
+            slot.online = False
+            self._touch(slot)
+
+    def suspend(self, host_id: uuid.UUID):
+        """Stop placing on a host whose agent keeps failing."""
+        slot = self._hosts.get(host_id)
+        if slot and not slot.suspended:
+            slot.suspended = True
+            self._touch(slot)
+
+    def resume(self, host_id: uuid.UUID):
+        slot = self._hosts.get(host_id)
+        if slot and slot.suspended:
+            slot.suspended = False
+            self._touch(slot)
+
+    def suspect(self, host_id: uuid.UUID, suspected: bool):
+        slot = self._hosts.get(host_id)
+        if slot and slot.suspected != suspected:
+            slot.suspected = suspected
+            self._touch(slot)
+
+    def upsert(self, host: ContainerHost):
+        """Registration or an admin edit of `host`."""
+        slot = self._hosts.get(host.id)
+        if slot is None:
+            slot = self._hosts[host.id] = HostSlot(
+                id=host.id,
+                max_containers=host.max_containers,
+                cpu=host.cpu_percent or 0,
+                mem=host.mem_percent or 0,
+                online=host.status != HostStatus.offline,
+            )
+        # Load and liveness of known hosts come from heartbeats, not the row
+        slot.max_containers = host.max_containers
+        self._touch(slot)
+
+    def remove(self, host_id: uuid.UUID):
+        self._hosts.pop(host_id, None)
+
+    # ─── DB consistency ─────────────────────────────────────────────────
+
+    async def sync(self, db: AsyncSession) -> int:
+        """
+        Rebuild host slots from the DB, keeping outstanding reservations.
+        Returns the number of hosts whose stored container count was repaired.
+        """
+        hosts = (await db.execute(select(ContainerHost))).scalars().all()
+        used = dict((await db.execute(
+            select(Container.host_id, func.count())
+            .where(Container.status.in_([ContainerStatus.pending, ContainerStatus.running]))
+            .group_by(Container.host_id)
+        )).all())
+
+        drift = []
+        for h in hosts:
+            n = used.get(h.id, 0)
+            if h.current_containers != n:
+                drift.append(h.hostname)
+                h.current_containers = n
+        if drift:
+            logger.warning("Repaired container counts on %s", ", ".join(drift))
+            await db.commit()
+
+        # No awaits from here on: the rebuild is atomic on the event loop
+        self._expire()
+        reserved: dict[uuid.UUID, int] = {}
+        for r in self._reservations.values():
+            reserved[r.host_id] = reserved.get(r.host_id, 0) + 1
+        # Load and liveness reach the DB write-behind; keep the live values
+        live = dict(self._hosts)
+
+        self._hosts = {
+            h.id: HostSlot(
+                id=h.id,
+                max_containers=h.max_containers,
+                used=used.get(h.id, 0),
+                reserved=reserved.get(h.id, 0),
+                cpu=live[h.id].cpu if h.id in live else h.cpu_percent or 0,
+                mem=live[h.id].mem if h.id in live else h.mem_percent or 0,
+                online=live[h.id].online if h.id in live else h.status != HostStatus.offline,
+                suspended=h.id in live and live[h.id].suspended,
+                suspected=h.id in live and live[h.id].suspected,
+            )
+            for h in hosts
+        }
+        self._heap = [
+            (s.load, s.version, s.id) for s in self._hosts.values() if s.available
+        ]
+        heapq.heapify(self._heap)
+        return len(drift)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.placement_sync_interval)
+            try:
+                async with SessionLocal() as db:
+                    await self.sync(db)
+            except Exception:
+                logger.exception("Placement index sync failed")
+
+    # ─── Internals ──────────────────────────────────────────────────────
+
+    def _touch(self, slot: HostSlot):
+        slot.version += 1
+        if slot.available:
+            heapq.heappush(self._heap, (slot.load, slot.version, slot.id))
+        if len(self._heap) > 4 * len(self._hosts) + 64:
+            self._heap = [
+                (s.load, s.version, s.id) for s in self._hosts.values() if s.available
+            ]
+            heapq.heapify(self._heap)
+
+    def _drop(self, res: Reservation):
+        if self._reservations.pop(res.id, None) is None:
+            return
+        slot = self._hosts.get(res.host_id)
+        if slot:
+            slot.reserved = max(0, slot.reserved - 1)
+            self._touch(slot)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._expiry and self._expiry[0].expires_at <= now:
+            res = self._expiry.popleft()
+            if res.id in self._reservations:
+                logger.warning("Reservation %s on host %s timed out", res.id, res.host_id)
+                self._drop(res)
+
+
+async def adjust_container_count(db: AsyncSession, host_id: uuid.UUID, delta: int):
+    """Atomically bump `current_containers` in the DB (part of the caller's transaction)."""
+    await db.execute(
+        update(ContainerHost)
+        .where(ContainerHost.id == host_id)
+        .values(current_containers=func.greatest(ContainerHost.current_containers + delta, 0))
+        .execution_options(synchronize_session=False)
+    )
+
+
+placement = PlacementIndex()
@@ -0,0 +1,184 @@
+# app/internal/prometheus.py
+#
+# Prometheus metrics, served at GET /metrics. Hot paths only ever bump a
+# counter or observe a histogram (a lock and a few additions); everything
+# that is a level rather than an event — pools, queues, host capacity — is
+# read from the in-memory singletons at scrape time by `StateCollector`, so
+# it costs nothing between scrapes.
+
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from app.core.database import engine
+
+# Seconds; a launch phase runs from a few milliseconds (DB commit) to
+# minutes (image build behind `docker compose up`)
+PHASE_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)
+
+LAUNCH_PHASE = Histogram(
+    "mlab_launch_phase_seconds",
+    "Duration of each phase of an environment launch",
+    ["phase"],
+    buckets=PHASE_BUCKETS,
+)
+LAUNCH_TOTAL = Histogram(
+    "mlab_launch_seconds",
+    "Launch duration from queueing to running (or failed, or cancelled)",
+    ["result"],
+    buckets=PHASE_BUCKETS,
+)
+LAUNCH_FAILURES = Counter(
+    "mlab_launch_failures_total",
+    "Launches that failed, by the phase they failed in",
+    ["phase"],
+)
+STOP_PHASE = Histogram(
+    "mlab_stop_phase_seconds",
+    "Duration of each phase of stopping an environment",
+    ["phase"],
+    buckets=PHASE_BUCKETS,
+)
+AUTH = Counter(
+    "mlab_auth_total",
+    "Authentication attempts",
+    ["kind", "result"],   # kind: admin_key | server_key | login
+)
+DB_STATEMENTS = Counter(
+    "mlab_db_statements_total",
+    "Round trips to Postgres: statements (an executemany counts once) and commits/rollbacks",
+    ["verb"],
+)
+
+_DB_VERBS = ("select", "insert", "update", "delete")
+
+
+@contextmanager
+def timed(histogram: Histogram, phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(phase).observe(time.perf_counter() - start)
+
+
+def count_db_statements(engine):
+    """Count every round trip `engine` makes, by leading SQL verb."""
+    counters = {verb: DB_STATEMENTS.labels(verb) for verb in _DB_VERBS}
+    other = DB_STATEMENTS.labels("other")
+    commits, rollbacks = DB_STATEMENTS.labels("commit"), DB_STATEMENTS.labels("rollback")
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        words = statement.split(None, 1)
+        counters.get(words[0].lower() if words else "", other).inc()
+
+    event.listen(engine.sync_engine, "commit", lambda conn: commits.inc())
+    event.listen(engine.sync_engine, "rollback", lambda conn: rollbacks.inc())
+
+
+class StateCollector:
+    """Pool, queue and capacity levels, read when Prometheus scrapes."""
+
+    def describe(self):
+        # Without this, registering calls collect() at import time, which
+        # imports the singletons it reads before they are initialised
+        return []
+
+    def collect(self):
+        from app.internal.cert_pool import cert_pool
+        from app.internal.firewall import firewall
+        from app.internal.fleet import fleet
+        from app.internal.host_state import host_state
+        from app.internal.jobs import launch_jobs
+        from app.internal.placement import placement
+        from app.internal.teardown import reaper
+        from app.internal.vpn import vpn_addresses
+
+        # Launch queue
+        yield GaugeMetricFamily(
+            "mlab_launch_queue_depth", "Launches waiting for a worker", value=launch_jobs.depth
+        )
+
+        # Certificate and VPN address pools
+        certs = cert_pool.stats()
+        yield GaugeMetricFamily(
+            "mlab_cert_pool_ready", "Pre-issued client certificates ready", value=certs["ready"]
+        )
+        yield GaugeMetricFamily(
+            "mlab_cert_pool_target", "Certificate pool target size", value=certs["target"]
+        )
+        yield CounterMetricFamily(
+            "mlab_cert_pool_on_demand", "Certificates issued on a launch's critical path",
+            value=certs["on_demand"],
+        )
+        allocated = GaugeMetricFamily(
+            "mlab_vpn_addresses_allocated", "VPN addresses in use", labels=["pool"]
+        )
+        capacity = GaugeMetricFamily(
+            "mlab_vpn_addresses_capacity", "VPN addresses in the pool", labels=["pool"]
+        )
+        for pool in vpn_addresses.stats():
+            allocated.add_metric([pool["pool"]], pool["allocated"])
+            capacity.add_metric([pool["pool"]], pool["capacity"])
+        yield allocated
+        yield capacity
+
+        # Host capacity, as placement sees it
+        used = GaugeMetricFamily(
+            "mlab_host_containers", "Pending/running environments per host", labels=["host"]
+        )
+        reserved = GaugeMetricFamily(
+            "mlab_host_reserved", "Unconfirmed slot reservations per host", labels=["host"]
+        )
+        limit = GaugeMetricFamily(
+            "mlab_host_capacity", "Environment limit per host", labels=["host"]
+        )
+        available = GaugeMetricFamily(
+            "mlab_host_available", "1 if the host takes new environments", labels=["host"]
+        )
+        names = {h.id: h.hostname for h in host_state.all()}
+        for slot in placement.slots():
+            host = names.get(slot.id, str(slot.id))
+            used.add_metric([host], slot.used)
+            reserved.add_metric([host], slot.reserved)
+            limit.add_metric([host], slot.max_containers)
+            available.add_metric([host], int(slot.available))
+        yield from (used, reserved, limit, available)
+
+        by_status = GaugeMetricFamily("mlab_hosts", "Hosts by status", labels=["status"])
+        counts: dict[str, int] = {}
+        for h in host_state.all():
+            counts[h.status.value] = counts.get(h.status.value, 0) + 1
+        for status, n in counts.items():
+            by_status.add_metric([status], n)
+        yield by_status
+
+        # Background queues
+        teardown = reaper.stats()
+        yield CounterMetricFamily(
+            "mlab_teardown_handed_off", "Stopped environments handed to their agents",
+            value=teardown["handed_off"],
+        )
+        yield CounterMetricFamily(
+            "mlab_teardown_handoff_failures", "Hand-offs that failed and will be retried",
+            value=teardown["failures"],
+        )
+        yield CounterMetricFamily(
+            "mlab_firewall_flushes", "Batched firewall updates", value=firewall.flushes
+        )
+        repairs = CounterMetricFamily(
+            "mlab_fleet_repairs", "Drift repaired by the fleet reconciler", labels=["kind"]
+        )
+        for kind, n in fleet.repairs.items():
+            repairs.add_metric([kind], n)
+        yield repairs
+
+
+REGISTRY.register(StateCollector())
+count_db_statements(engine)
@@ -0,0 +1,123 @@
+# app/internal/teardown.py
+#
+# Teardown is two-phase. `teardown_container` does what the user is
+# waiting for: it marks the environment `stopped`, frees its host slot and
+# revokes its VPN access, all in one short transaction. Removing the
+# environment from its host happens afterwards: the reaper hands every
+# `stopped` row to its agent's removal queue, which accepts it at once and
+# does the slow work in the background, and deletes the row once the agent
+# has accepted it. A `stopped` row is the durable record of an unfinished
+# hand-off, so one that fails (agent down, circuit open) is simply retried
+# on the next pass.
+
+import asyncio
+import logging
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import Container, ContainerHost, ContainerStatus
+from app.internal.agent_client import AgentUnavailable, agents
+from app.internal.live_state import live_state
+from app.internal.placement import adjust_container_count, placement
+from app.internal.prometheus import STOP_PHASE, timed
+from app.internal.vpn import remove_vpn_profile
+
+logger = logging.getLogger("teardown")
+settings = get_settings()
+
+
+async def teardown_container(db: AsyncSession, cont: Container, host: ContainerHost):
+    """
+    Stop an environment: release its host slot, revoke its VPN access and
+    queue it for removal from the host. Returns without waiting for the host.
+    """
+    # 1) Mark it stopped (only pending/running rows hold a host slot)
+    held_slot = cont.status in (ContainerStatus.pending, ContainerStatus.running)
+    cont.status = ContainerStatus.stopped
+    if held_slot:
+        with timed(STOP_PHASE, "release_slot"):
+            await adjust_container_count(db, host.id, -1)
+
+    # 2) Revoke VPN access; this commits the status change too
+    with timed(STOP_PHASE, "revoke_vpn"):
+        await remove_vpn_profile(db, cont.id)
+    if held_slot:
+        placement.freed(host.id)
+
+    # 3) Removal from the host happens in the background
+    reaper.wake()
+
+
+async def request_removal(host: ContainerHost, name: str) -> bool:
+    """Queue environment `name` for removal on its agent; True once accepted."""
+    try:
+        with timed(STOP_PHASE, "agent_handoff"):
+            resp = await agents.request(host, "DELETE", f"/containers/{name}", timeout=10.0)
+    except AgentUnavailable as e:
+        logger.warning("Could not hand %s to its host: %s", name, e)
+        return False
+    if resp.status_code not in (200, 202, 204, 404):
+        logger.warning("Agent refused removal of %s: %s", name, resp.text)
+        return False
+    live_state.invalidate(host.id)
+    return True
+
+
+class TeardownReaper:
+    def __init__(self):
+        self._wake = asyncio.Event()
+        self.handed_off = 0
+        self.failures = 0
+
+    def wake(self):
+        self._wake.set()
+
+    def stats(self) -> dict:
+        return {"handed_off": self.handed_off, "failures": self.failures}
+
+    async def run(self):
+        while True:
+            try:
+                await self.reap()
+            except Exception:
+                logger.exception("Teardown hand-off pass failed")
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), timeout=settings.teardown_retry_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def reap(self):
+        """Hand every stopped environment to its agent; delete those accepted."""
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(Container.id, Container.name, ContainerHost)
+                .join(ContainerHost, ContainerHost.id == Container.host_id)
+                .where(Container.status == ContainerStatus.stopped)
+            )).all()
+        if not rows:
+            return
+
+        sem = asyncio.Semaphore(settings.teardown_concurrency)
+
+        async def hand_off(name: str, host: ContainerHost) -> bool:
+            async with sem:
+                return await request_removal(host, name)
+
+        accepted = await asyncio.gather(*(hand_off(name, host) for _, name, host in rows))
+        done = [cid for (cid, _, _), ok in zip(rows, accepted) if ok]
+        self.handed_off += len(done)
+        self.failures += len(rows) - len(done)
+        if done:
+            async with SessionLocal() as db:
+                await db.execute(delete(Container).where(Container.id.in_(done)))
+                await db.commit()
+
+
+reaper = TeardownReaper()
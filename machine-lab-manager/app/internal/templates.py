@@ -0,0 +1,88 @@
+# app/internal/templates.py
+
+import os
+import shutil
+import zipfile
+
+import yaml
+
+from app.core.config import get_settings
+from app.internal.bundles import SpooledBundle
+
+settings = get_settings()
+
+CHALLENGE_FILES = ("challenge.yml", "challenge.yaml")
+COMPOSE_FILES = (
+    "compose.yaml",
+    "compose.yml",
+    "docker-compose.yaml",
+    "docker-compose.yml",
+)
+
+
+class InvalidBundle(Exception):
+    """The uploaded ZIP is not a usable challenge bundle."""
+
+
+def template_path(digest: str) -> str:
+    return os.path.join(settings.template_dir, f"{digest}.zip")
+
+
+def _load_yaml(z: zipfile.ZipFile, name: str) -> dict:
+    try:
+        doc = yaml.safe_load(z.read(name)) or {}
+    except yaml.YAMLError as e:
+        raise InvalidBundle(f"{name} is not valid YAML: {e}")
+    if not isinstance(doc, dict):
+        raise InvalidBundle(f"{name} must be a mapping")
+    return doc
+
+
+def _summarize_services(compose: dict) -> dict:
+    services = {}
+    for svc_name, svc in (compose.get("services") or {}).items():
+        svc = svc or {}
+        services[svc_name] = {
+            "image": svc.get("image"),
+            "build": svc.get("build") is not None,
+            "ports": [str(p) for p in svc.get("ports") or []],
+        }
+    return services
+
+
+def parse_bundle_metadata(path: str) -> dict:
+    """Blocking: read challenge.yml and the compose file out of a bundle."""
+    try:
+        z = zipfile.ZipFile(path, "r")
+    except zipfile.BadZipFile:
+        raise InvalidBundle("Bundle is not a valid ZIP")
+
+    with z:
+        names = set(z.namelist())
+        compose_file = next((n for n in COMPOSE_FILES if n in names), None)
+        if not compose_file:
+            raise InvalidBundle("Bundle has no docker-compose file at its root")
+        challenge_file = next((n for n in CHALLENGE_FILES if n in names), None)
+
+        compose = _load_yaml(z, compose_file)
+        challenge = _load_yaml(z, challenge_file) if challenge_file else {}
+
+    # Never keep flags in metadata that is shown back through the API
+    challenge.pop("flags", None)
+    return {
+        "compose_file": compose_file,
+        "services": _summarize_services(compose),
+        "challenge": challenge,
+    }
+
+
+def store_bundle(bundle: SpooledBundle) -> str:
+    """Blocking: move a spooled upload to its content-addressed location."""
+    os.makedirs(settings.template_dir, exist_ok=True)
+    dest = template_path(bundle.sha256)
+    if os.path.exists(dest):
+        bundle.discard()
+    else:
+        shutil.move(bundle.path, dest)
+    bundle.path = dest
+    return dest
@@ -3,41 +3,53 @@
 import os
 import glob
 import subprocess
-from subprocess import CalledProcessError
 import datetime
 from pathlib import Path
 from ipaddress import IPv4Network
 import asyncio
+import logging
 import uuid
+from collections import OrderedDict
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.core.config import get_settings
 from app.models import VPNProfile
+from app.internal.cert_pool import cert_pool
+from app.internal.ip_pool import CONTAINERS, USERS, AddressAllocator
+from app.internal.pki import PKI_DIR, pki
+from app.internal.firewall import firewall
+
+logger = logging.getLogger("vpn")
+settings = get_settings()
 
 # Paths
-EASYRSA_DIR = "/etc/openvpn/easy-rsa"
-PKI_DIR = os.path.join(EASYRSA_DIR, "pki")
 OVPN_DIR = "/etc/openvpn/pki/ovpns"
 CCD_DIR = "/etc/openvpn/ccd"
 
 VPN_SUBNET = os.getenv("VPN_INTERNAL_SUBNET", "10.8.0.0/24")
 NETWORK = IPv4Network(VPN_SUBNET)
 
-
-def _run_sync(cmd: list[str]) -> None:
-    """Blocking: run an Easy-RSA command."""
-    subprocess.check_call(cmd, cwd=EASYRSA_DIR)
+# Users and containers get separate address pools, by default the two
+# halves of the VPN network
+_halves = list(NETWORK.subnets(prefixlen_diff=1))
+vpn_addresses = AddressAllocator(NETWORK, {
+    USERS: IPv4Network(settings.vpn_user_pool or _halves[0]),
+    CONTAINERS: IPv4Network(settings.vpn_container_pool or _halves[1]),
+})
 
 
-def _cleanup_artifacts_sync(client: str):
+def _cleanup_artifacts_sync(client: str, cert_name: str | None = None):
     """Blocking: remove old certs/keys and .ovpn."""
+    cert_name = cert_name or client
     patterns = [
-        os.path.join(PKI_DIR, "issued", f"{client}.*"),
-        os.path.join(PKI_DIR, "private", f"{client}.*"),
-        os.path.join(PKI_DIR, "reqs", f"{client}.*"),
+        os.path.join(PKI_DIR, "issued", f"{cert_name}.*"),
+        os.path.join(PKI_DIR, "private", f"{cert_name}.*"),
+        os.path.join(PKI_DIR, "reqs", f"{cert_name}.*"),
         os.path.join(OVPN_DIR, f"{client}.ovpn"),
-        os.path.join(CCD_DIR, client),
+        os.path.join(CCD_DIR, cert_name),
     ]
     for pat in patterns:
         for path in glob.glob(pat):
@@ -50,179 +62,224 @@ def _cleanup_artifacts_sync(client: str):
                 pass
 
 
-def _make_client_sync(name: str, ip: str) -> str:
-    """Blocking: build cert+key and bundle .ovpn with static IP."""
-    _run_sync(["./easyrsa", "--batch", "build-client-full", name, "nopass"])
-
-    # Read pieces...
-    ca = open(os.path.join(PKI_DIR, "ca.crt")).read().strip()
-    cert = open(os.path.join(PKI_DIR, "issued", f"{name}.crt")).read().strip()
-    key = open(os.path.join(PKI_DIR, "private", f"{name}.key")).read().strip()
-    ta = open(os.path.join(EASYRSA_DIR, "ta.key")).read().strip()
-
-    host = os.getenv("OPENVPN_SERVER_HOST", "vpn.example.com")
-    port = os.getenv("OPENVPN_SERVER_PORT", "1194")
-    proto = os.getenv("OPENVPN_PROTO", "udp")
-    dev = os.getenv("OPENVPN_DEV", "tun")
-
-    conf = [
-        "client",
-        f"dev {dev}",
-        f"proto {proto}",
-        f"remote {host} {port}",
-        "nobind",
-        "remote-cert-tls server",
-        "<ca>",
-        ca,
-        "</ca>",
-        "<cert>",
-        cert,
-        "</cert>",
-        "<key>",
-        key,
-        "</key>",
-        "key-direction 1",
-        "<tls-auth>",
-        ta,
-        "</tls-auth>",
-        "verb 3",
-    ]
+def _write_clients_sync(clients: list[tuple[str, str, str, bytes | None]]) -> dict[str, str]:
+    """
+    Blocking: CCD entries, in one threadpool trip. An .ovpn copy is only
+    written for clients given a config, i.e. when the DB does not keep it.
+    """
+    paths = {}
+    for name, cert_name, ip, config in clients:
+        out_path = os.path.join(OVPN_DIR, f"{name}.ovpn")
+        if config is not None:
+            Path(OVPN_DIR).mkdir(parents=True, exist_ok=True)
+            with open(out_path, "wb") as f:
+                f.write(config)
+        # OpenVPN looks the CCD entry up by the certificate's common name
+        with open(os.path.join(CCD_DIR, cert_name), "w") as ccd:
+            ccd.write(f"ifconfig-push {ip} {NETWORK.netmask}\n")
+        paths[name] = out_path
+    return paths
 
-    Path(OVPN_DIR).mkdir(parents=True, exist_ok=True)
-    out_path = os.path.join(OVPN_DIR, f"{name}.ovpn")
-    with open(out_path, "w") as f:
-        f.write("\n".join(conf) + "\n")
 
-    ccd_path = os.path.join(CCD_DIR, name)
-    with open(ccd_path, "w") as ccd:
-        ccd.write(f"ifconfig-push {ip} {NETWORK.netmask}\n")
+# ─── Rendered profiles ─────────────────────────────────────────────────
 
-    return out_path
+# profile id -> .ovpn bytes, most recently used last
+_configs: OrderedDict[uuid.UUID, bytes] = OrderedDict()
 
 
-async def create_or_get_profile(db: AsyncSession, user_id: str) -> str:
-    """
-    1) Check for existing non-revoked profile.
-    2) Allocate a new IP if needed.
-    3) Offload blocking work -> asyncio.to_thread.
-    4) Persist and return the .ovpn path.
-    """
-    # 1) Existing?
+def _cache_config(prof: VPNProfile, config: bytes):
+    _configs[prof.id] = config
+    _configs.move_to_end(prof.id)
+    while len(_configs) > settings.vpn_profile_cache_size:
+        _configs.popitem(last=False)
+
+
+async def profile_config(prof: VPNProfile) -> bytes:
+    """The .ovpn of a profile, from memory or the DB; disk only for old profiles."""
+    config = _configs.get(prof.id)
+    if config is None:
+        config = prof.config
+        if config is None:
+            config = await asyncio.to_thread(Path(prof.config_path).read_bytes)
+        _cache_config(prof, config)
+    else:
+        _configs.move_to_end(prof.id)
+    return config
+
+
+# ─── Issuance ──────────────────────────────────────────────────────────
+
+async def get_active_profile(db: AsyncSession, client_name: str) -> VPNProfile | None:
     stmt = select(VPNProfile).where(
-        VPNProfile.client_name == user_id, VPNProfile.revoked == False
+        VPNProfile.client_name == client_name, VPNProfile.revoked == False
     )
-    res = await db.execute(stmt)
-    prof = res.scalar_one_or_none()
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def _issue_profiles(
+    db: AsyncSession,
+    clients: list[tuple[str, str]],
+) -> dict[str, VPNProfile]:
+    """
+    1) Allocate addresses from each client's pool and pre-issued certs.
+    2) Render every .ovpn in memory.
+    3) Write CCD entries in one threadpool trip, and .ovpn copies unless
+       VPN_PROFILE_STORE_DB is set.
+    4) Persist, with the rendered bytes if VPN_PROFILE_STORE_DB is set.
+    """
+    # 1) Addresses (all or none) and certificates
+    ips: dict[str, str] = {}
+    certs = []
+    try:
+        for pool in (USERS, CONTAINERS):
+            names = [n for n, p in clients if p == pool]
+            ips.update(zip(names, vpn_addresses.allocate(pool, len(names))))
+        certs = await cert_pool.acquire(len(clients))
+
+        # 2) + 3)
+        configs = {name: pki.render(cert) for (name, _), cert in zip(clients, certs)}
+        on_disk = not settings.vpn_profile_store_db
+        paths = await asyncio.to_thread(_write_clients_sync, [
+            (name, cert.cn, ips[name], configs[name] if on_disk else None)
+            for (name, _), cert in zip(clients, certs)
+        ])
+    except Exception:
+        vpn_addresses.release(ips.values())
+        cert_pool.give_back(certs)
+        raise
+
+    # 4) One commit for all of them
+    now = datetime.datetime.utcnow()
+    profiles = {}
+    for (name, _), cert in zip(clients, certs):
+        profiles[name] = VPNProfile(
+            client_name=name,
+            ip_address=ips[name],
+            cert_name=cert.cn,
+            config_path=paths[name],
+            config=configs[name] if settings.vpn_profile_store_db else None,
+            revoked=False,
+            created_at=now,
+        )
+        db.add(profiles[name])
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        # On a unique violation someone else holds the address; keep it
+        # marked until the next load
+        if not isinstance(e, IntegrityError):
+            vpn_addresses.release(ips.values())
+        cert_pool.give_back(certs)
+        raise
+    for name, prof in profiles.items():
+        _cache_config(prof, configs[name])
+    return profiles
+
+
+async def create_or_get_profile(
+    db: AsyncSession, user_id: str, pool: str = USERS
+) -> VPNProfile:
+    """The client's active profile, issued from `pool` if it has none."""
+    prof = await get_active_profile(db, user_id)
     if prof:
-        return prof.config_path
-
-    # 2) Allocate next IP (only consider non-revoked profiles)
-    existing_ips = (await db.execute(
-        select(VPNProfile.ip_address).where(VPNProfile.revoked == False)
-    )).scalars().all()
-    used_octets = {int(str(ip).split(".")[-1]) for ip in existing_ips if ip is not None}
-    for octet in range(2, NETWORK.num_addresses - 1):
-        if octet not in used_octets:
-            ip = f"{NETWORK.network_address.exploded.rsplit('.', 1)[0]}.{octet}"
-            break
-    else:
-        raise RuntimeError("No free IP in VPN subnet")
-
-    # 3) Offload cleanup & generation to threadpool
-    await asyncio.to_thread(_cleanup_artifacts_sync, user_id)
-    ovpn_path = await asyncio.to_thread(_make_client_sync, user_id, ip)
-
-    # 4) Persist in DB
-    new = VPNProfile(
-        client_name=user_id,
-        ip_address=ip,
-        config_path=ovpn_path,
-        revoked=False,
-        created_at=datetime.datetime.utcnow(),
+        return prof
+    return (await _issue_profiles(db, [(user_id, pool)]))[user_id]
+
+
+async def create_profiles(
+    db: AsyncSession,
+    users: list[str] = (),
+    containers: list[str] = (),
+) -> dict[str, VPNProfile]:
+    """
+    Batch form of `create_or_get_profile`: one lookup, one allocation
+    pass, one trip to the threadpool and one commit for all clients.
+    """
+    client_names = [*users, *containers]
+    stmt = select(VPNProfile).where(
+        VPNProfile.client_name.in_(client_names), VPNProfile.revoked == False
     )
-    db.add(new)
-    await db.commit()
-    await db.refresh(new)
-    return ovpn_path
+    profiles = {p.client_name: p for p in (await db.execute(stmt)).scalars().all()}
 
+    container_names = set(containers)
+    missing = [
+        (n, CONTAINERS if n in container_names else USERS)
+        for n in dict.fromkeys(client_names)
+        if n not in profiles
+    ]
+    if missing:
+        profiles.update(await _issue_profiles(db, missing))
+    return profiles
 
-def apply_vpn_rule(src_ip: str, dst_ip: str):
+
+async def apply_vpn_rules(pairs: list[tuple[str, str]]):
+    """
+    Batch form of `apply_vpn_rule`: every pair goes into the ACL set in the
+    firewall's next batched transaction.
+    """
+    await firewall.allow(pairs)
+
+
+async def apply_vpn_rule(src_ip: str, dst_ip: str):
     """
     Allow traffic only between src_ip and dst_ip over tun0.
-    Inserts two ACCEPT rules (src→dst and dst→src) in FORWARD.
-    """
-    src = str(src_ip)
-    dst = str(dst_ip)
-    for s, d in ((src, dst), (dst, src)):
-        cmd = [
-            "iptables",
-            "-I",
-            "FORWARD",
-            "-i",
-            "tun0",
-            "-o",
-            "tun0",
-            "-s",
-            s,
-            "-d",
-            d,
-            "-j",
-            "ACCEPT",
-        ]
-        subprocess.check_call(cmd)
-
-
-def remove_vpn_rule(ip: str):
-    """
-    Remove all FORWARD-chain rules on tun0 where -s ip or -d ip.
-    We list rules, find those matching, convert -A → -D, and delete.
-    """
-    ip = str(ip)
-    if not ip:
-        return
+    Adds both directions (src→dst and dst→src) to the ACL set.
+    """
+    await firewall.allow([(src_ip, dst_ip)])
 
-    # Fetch all FORWARD rules
-    try:
-        raw = subprocess.check_output(["iptables", "-S", "FORWARD"], text=True)
-    except CalledProcessError:
-        return
 
-    for line in raw.splitlines():
-        # Look for a rule on tun0→tun0 that mentions this IP
-        if (
-            "-i tun0" in line
-            and "-o tun0" in line
-            and (f"-s {ip}" in line or f"-d {ip}" in line)
-        ):
-            parts = line.split()
-            # parts = ["-A", "FORWARD", ..., "-j", "ACCEPT"]
-            parts[0] = "-D"  # change append to delete
-            cmd = ["iptables"] + parts
-            try:
-                subprocess.check_call(cmd)
-            except CalledProcessError:
-                # maybe someone already removed it
-                pass
+async def remove_vpn_rule(ip: str):
+    """
+    Drop every ACL entry where ip is the source or destination.
+    """
+    if ip:
+        await firewall.revoke([ip])
 
 
 async def remove_vpn_profile(db: AsyncSession, user_id: uuid.UUID | str):
     """
-    Mark profile revoked, drop iptables rule, and clean up all VPN files.
+    Mark profile revoked, drop its firewall pairs, and clean up all VPN files.
+    """
+    await remove_vpn_profiles(db, [user_id])
+
+
+async def remove_vpn_profiles(db: AsyncSession, client_names: list[uuid.UUID | str]):
+    """
+    Batch form of `remove_vpn_profile`: one commit and one firewall revoke
+    for all of them.
     """
+    names = [str(n) for n in client_names]
+    if not names:
+        return
     stmt = select(VPNProfile).where(
-        VPNProfile.client_name == str(user_id), VPNProfile.revoked == False
+        VPNProfile.client_name.in_(names), VPNProfile.revoked == False
     )
     res = await db.execute(stmt)
     profiles_to_cleanup = []
+    freed_ips = []
     
     for prof in res.scalars().all():
         prof.revoked = True
-        # Remove iptables rules for this IP
-        remove_vpn_rule(prof.ip_address)
-        profiles_to_cleanup.append(str(user_id))
+        _configs.pop(prof.id, None)
+        profiles_to_cleanup.append((prof.client_name, prof.cert_name))
+        freed_ips.append(prof.ip_address)
             
+    # Commit first, so a concurrent full reconcile cannot re-open the pairs
     await db.commit()
+    if freed_ips:
+        try:
+            await firewall.revoke(freed_ips)
+        except Exception:
+            # The reconciler will close them; the addresses stay allocated
+            # until the next allocator load rather than be handed out while
+            # still reachable
+            logger.error("Firewall revoke for %s failed; deferring to reconcile", ", ".join(names))
+        else:
+            vpn_addresses.release(freed_ips)
     
     # Clean up all VPN files after successful database commit
-    for client_name in profiles_to_cleanup:
-        await asyncio.to_thread(_cleanup_artifacts_sync, client_name)
+    if profiles_to_cleanup:
+        await asyncio.to_thread(
+            lambda: [_cleanup_artifacts_sync(c, cert) for c, cert in profiles_to_cleanup]
+        )
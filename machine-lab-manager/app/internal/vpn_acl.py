@@ -0,0 +1,250 @@
+# app/internal/vpn_acl.py
+#
+# VPN access control. Allowed user↔container pairs live in one ipset of type
+# hash:net,net, and a single FORWARD rule accepts tun0 traffic whose
+# (source, destination) is in the set. The kernel matches a packet with one
+# hash lookup however many pairs are allowed, and adding or dropping a pair
+# is a set update instead of a chain rewrite. Updates are batched into one
+# `ipset restore` transaction each; the firewall reconciler decides what
+# goes into them.
+#
+# The engine remembers each address's peers so that revoking an address
+# deletes exactly its entries. VPN_ACL_BACKEND=fake swaps the commands for
+# an in-memory stand-in, for development without root.
+
+import ipaddress
+import logging
+import re
+import subprocess
+import threading
+
+from app.core.config import get_settings
+
+logger = logging.getLogger("vpn_acl")
+settings = get_settings()
+
+ALLOW, REVOKE = "allow", "revoke"
+
+# A per-pair rule as written by earlier versions (iptables -S syntax)
+_LEGACY_RULE = re.compile(
+    r"^-A FORWARD -s (?P<src>[\d.]+)(?:/32)? -d (?P<dst>[\d.]+)(?:/32)? "
+    r"-i tun0 -o tun0 -j ACCEPT$"
+)
+
+
+class CommandRunner:
+    """Runs ipset/iptables for real."""
+
+    def run(self, argv: list[str], input: str | None = None) -> str:
+        proc = subprocess.run(argv, input=input, text=True, capture_output=True, check=True)
+        return proc.stdout
+
+
+class FakeRunner:
+    """
+    Understands just the commands this module issues, against in-memory
+    sets and rules, so the engine can be exercised without root.
+    """
+
+    def __init__(self):
+        self.sets: dict[str, set[tuple[str, str]]] = {}
+        self.rules: list[str] = []
+        self.calls: list[list[str]] = []
+
+    def run(self, argv: list[str], input: str | None = None) -> str:
+        self.calls.append(argv)
+        tool, args = argv[0], [a for a in argv[1:] if a != "-exist"]
+        if tool == "ipset" and args[0] == "create":
+            self.sets.setdefault(args[1], set())
+        elif tool == "ipset" and args[0] == "list":
+            members = sorted(self.sets.get(args[1], ()))
+            return "".join(f"add {args[1]} {s},{d}\n" for s, d in members)
+        elif tool == "ipset" and args[0] == "restore":
+            for line in (input or "").splitlines():
+                op, name, member = line.split()[:3]
+                pair = tuple(member.split(","))
+                if op == "add":
+                    self.sets[name].add(pair)
+                elif op == "del":
+                    self.sets[name].discard(pair)
+        elif tool == "iptables" and args[0] == "-S":
+            return "".join(f"-A FORWARD {r}\n" for r in self.rules)
+        elif tool == "iptables" and args[0] == "-C":
+            if " ".join(args[2:]) not in self.rules:
+                raise subprocess.CalledProcessError(1, argv)
+        elif tool == "iptables" and args[0] == "-I":
+            self.rules.insert(0, " ".join(args[2:]))
+        elif tool == "iptables-restore":
+            for line in (input or "").splitlines():
+                if line.startswith("-D FORWARD "):
+                    rule = line[len("-D FORWARD "):]
+                    if rule in self.rules:
+                        self.rules.remove(rule)
+        return ""
+
+
+class VpnAcl:
+    def __init__(self, runner):
+        self._runner = runner
+        self._lock = threading.Lock()
+        self._peers: dict[str, set[str]] = {}
+        self._ready = False
+
+    @property
+    def set_name(self) -> str:
+        return settings.vpn_acl_set
+
+    def _match_rule(self) -> list[str]:
+        return [
+            "-i", "tun0", "-o", "tun0",
+            "-m", "set", "--match-set", self.set_name, "src,dst",
+            "-j", "ACCEPT",
+        ]
+
+    # ─── Setup ──────────────────────────────────────────────────────────
+
+    def setup(self):
+        """Blocking: create the set and its rule, and learn what is in it."""
+        with self._lock:
+            self._setup()
+
+    def _setup(self):
+        if self._ready:
+            return
+        run = self._runner.run
+        run([
+            "ipset", "create", self.set_name, "hash:net,net",
+            "maxelem", str(settings.vpn_acl_maxelem), "-exist",
+        ])
+        rule = self._match_rule()
+        if not self._has_rule(rule):
+            run(["iptables", "-I", "FORWARD", *rule])
+
+        self._peers = {}
+        for src, dst in self._read_set():
+            _link(self._peers, src, dst)
+        self._migrate_legacy_rules()
+        self._ready = True
+
+    def _has_rule(self, rule: list[str]) -> bool:
+        try:
+            self._runner.run(["iptables", "-C", "FORWARD", *rule])
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def _migrate_legacy_rules(self):
+        """Fold per-pair FORWARD rules left by earlier versions into the set."""
+        legacy = []
+        for line in self._runner.run(["iptables", "-S", "FORWARD"]).splitlines():
+            m = _LEGACY_RULE.match(line.strip())
+            if m:
+                legacy.append((line.strip(), m["src"], m["dst"]))
+        if not legacy:
+            return
+        self._apply([("add", src, dst) for _, src, dst in legacy])
+        for _, src, dst in legacy:
+            _link(self._peers, src, dst)
+        restore = ["*filter"] + [
+            "-D" + line[len("-A"):] for line, _, _ in legacy
+        ] + ["COMMIT"]
+        self._runner.run(["iptables-restore", "--noflush"], input="\n".join(restore) + "\n")
+        logger.info("Moved %d legacy VPN FORWARD rules into ipset %s", len(legacy), self.set_name)
+
+    # ─── Updates ────────────────────────────────────────────────────────
+
+    def update(self, changes: list[tuple]):
+        """
+        Blocking: apply (ALLOW, a, b) and (REVOKE, ip) changes in order, as
+        one transaction. Allowing opens both directions; revoking drops
+        every pair the address is part of.
+        """
+        with self._lock:
+            self._setup()
+            peers = {ip: set(p) for ip, p in self._peers.items()}
+            ops = []
+            for change in changes:
+                if change[0] == ALLOW:
+                    a, b = _host(change[1]), _host(change[2])
+                    ops += [("add", a, b), ("add", b, a)]
+                    _link(peers, a, b)
+                else:
+                    ip = _host(change[1])
+                    for peer in peers.pop(ip, ()):
+                        ops += [("del", ip, peer), ("del", peer, ip)]
+                        _unlink(peers, peer, ip)
+            self._apply(ops)
+            self._peers = peers
+
+    def allow(self, pairs: list[tuple[str, str]]):
+        self.update([(ALLOW, a, b) for a, b in pairs])
+
+    def revoke(self, ip: str):
+        self.update([(REVOKE, ip)])
+
+    def replace(self, pairs: list[tuple[str, str]]) -> tuple[int, int]:
+        """
+        Blocking: make the kernel set hold exactly `pairs` (both ways),
+        whatever drifted, in one transaction. Returns (added, removed).
+        """
+        with self._lock:
+            self._setup()
+            rule = self._match_rule()
+            if not self._has_rule(rule):
+                logger.warning("VPN ACL rule was missing from FORWARD; restoring it")
+                self._runner.run(["iptables", "-I", "FORWARD", *rule])
+
+            desired, peers = set(), {}
+            for a, b in pairs:
+                a, b = _host(a), _host(b)
+                desired |= {(a, b), (b, a)}
+                _link(peers, a, b)
+            live = self._read_set()
+            stale, missing = live - desired, desired - live
+            self._apply(
+                [("del", s, d) for s, d in sorted(stale)]
+                + [("add", s, d) for s, d in sorted(missing)]
+            )
+            self._peers = peers
+            return len(missing), len(stale)
+
+    def peers(self, ip: str) -> set[str]:
+        with self._lock:
+            return set(self._peers.get(_host(ip), ()))
+
+    def _read_set(self) -> set[tuple[str, str]]:
+        members = set()
+        out = self._runner.run(["ipset", "list", self.set_name, "-output", "save"])
+        for line in out.splitlines():
+            parts = line.split()
+            if len(parts) >= 3 and parts[0] == "add":
+                src, dst = parts[2].split(",")
+                members.add((_host(src), _host(dst)))
+        return members
+
+    def _apply(self, ops: list[tuple[str, str, str]]):
+        if not ops:
+            return
+        lines = [f"{op} {self.set_name} {src},{dst}" for op, src, dst in ops]
+        self._runner.run(["ipset", "-exist", "restore"], input="\n".join(lines) + "\n")
+
+
+def _link(peers: dict[str, set[str]], a: str, b: str):
+    peers.setdefault(a, set()).add(b)
+    peers.setdefault(b, set()).add(a)
+
+
+def _unlink(peers: dict[str, set[str]], a: str, b: str):
+    others = peers.get(a)
+    if others is not None:
+        others.discard(b)
+        if not others:
+            del peers[a]
+
+
+def _host(ip) -> str:
+    # Profile addresses may carry a prefix length (INET)
+    return str(ipaddress.ip_interface(str(ip)).ip)
+
+
+vpn_acl = VpnAcl(FakeRunner() if settings.vpn_acl_backend == "fake" else CommandRunner())
@@ -0,0 +1,224 @@
+# app/internal/warm_pool.py
+
+import asyncio
+import datetime
+import logging
+import time
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.models import (
+    ChallengeTemplate,
+    Container,
+    ContainerHost,
+    ContainerStatus,
+)
+from app.internal.bundles import SpooledBundle
+from app.internal.jobs import LaunchJob, QueueFull, launch_jobs
+from app.internal.launcher import run_launch
+from app.internal.placement import adjust_container_count, placement
+from app.internal.teardown import teardown_container
+from app.internal.vpn import (
+    create_or_get_profile,
+    get_active_profile,
+    apply_vpn_rule,
+)
+
+logger = logging.getLogger("warm_pool")
+settings = get_settings()
+
+ACTIVE = (ContainerStatus.pending, ContainerStatus.running)
+
+
+class WarmPool:
+    """
+    Keeps `ChallengeTemplate.warm_pool_size` launched, unassigned
+    environments per template (rows with user_id NULL). Launches of a
+    template claim one of them instead of going through the cold pipeline.
+    A template nobody has asked for in WARM_POOL_IDLE_SECONDS is drained
+    until the next request for it.
+    """
+
+    def __init__(self):
+        self._last_demand: dict[str, float] = {}
+        self._started = time.monotonic()
+        self._wake = asyncio.Event()
+
+    def note_demand(self, digest: str):
+        self._last_demand[digest] = time.monotonic()
+
+    def is_idle(self, digest: str) -> bool:
+        last = self._last_demand.get(digest, self._started)
+        return time.monotonic() - last > settings.warm_pool_idle_seconds
+
+    def target(self, tmpl: ChallengeTemplate) -> int:
+        return 0 if self.is_idle(tmpl.digest) else tmpl.warm_pool_size
+
+    def wake(self):
+        self._wake.set()
+
+    async def claim(
+        self,
+        db: AsyncSession,
+        digest: str,
+        user_id: uuid.UUID,
+    ) -> Container | None:
+        """Hand a ready environment to `user_id` and open its VPN path."""
+        self.note_demand(digest)
+        stmt = (
+            select(Container)
+            .where(
+                Container.template_digest == digest,
+                Container.user_id.is_(None),
+                Container.status == ContainerStatus.running,
+            )
+            .order_by(Container.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        cont = (await db.execute(stmt)).scalars().first()
+        if not cont:
+            self.wake()
+            return None
+        cont.user_id = user_id
+        await db.commit()
+
+        try:
+            user_prof = await create_or_get_profile(db, str(user_id))
+            cont_prof = await get_active_profile(db, str(cont.id))
+            if not user_prof or not cont_prof:
+                raise RuntimeError("VPN profile missing")
+            await apply_vpn_rule(user_prof.ip_address, cont_prof.ip_address)
+        except Exception:
+            # Put it back for the next claimant
+            cont.user_id = None
+            await db.commit()
+            raise
+        finally:
+            self.wake()
+        return cont
+
+    async def stats(self, db: AsyncSession, tmpl: ChallengeTemplate) -> dict:
+        rows = (await db.execute(
+            select(Container.status, func.count())
+            .where(
+                Container.template_digest == tmpl.digest,
+                Container.user_id.is_(None),
+                Container.status.in_(ACTIVE),
+            )
+            .group_by(Container.status)
+        )).all()
+        counts = {s: n for s, n in rows}
+        return {
+            "size": tmpl.warm_pool_size,
+            "target": self.target(tmpl),
+            "ready": counts.get(ContainerStatus.running, 0),
+            "launching": counts.get(ContainerStatus.pending, 0),
+            "idle": self.is_idle(tmpl.digest),
+        }
+
+    async def run(self):
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Warm pool refill failed")
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), timeout=settings.warm_pool_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def refill(self):
+        async with SessionLocal() as db:
+            unassigned = dict((await db.execute(
+                select(Container.template_digest, func.count())
+                .where(
+                    Container.template_digest.is_not(None),
+                    Container.user_id.is_(None),
+                    Container.status.in_(ACTIVE),
+                )
+                .group_by(Container.template_digest)
+            )).all())
+            templates = (await db.execute(
+                select(ChallengeTemplate).where(
+                    (ChallengeTemplate.warm_pool_size > 0)
+                    | ChallengeTemplate.digest.in_(list(unassigned))
+                )
+            )).scalars().all()
+
+            for tmpl in templates:
+                have = unassigned.get(tmpl.digest, 0)
+                want = self.target(tmpl)
+                if have < want:
+                    for _ in range(want - have):
+                        if not await self._launch_one(db, tmpl):
+                            break
+                elif have > want:
+                    await self._shrink(db, tmpl, have - want)
+
+    async def _launch_one(self, db: AsyncSession, tmpl: ChallengeTemplate) -> bool:
+        try:
+            launch_jobs.ensure_capacity()
+        except QueueFull:
+            return False
+        # Least-loaded placement counts pooled environments too, so
+        # successive picks spread the pool across hosts
+        res = placement.reserve()
+        if not res:
+            return False
+
+        container_id = str(uuid.uuid4())
+        try:
+            db.add(Container(
+                id=container_id,
+                user_id=None,
+                host_id=res.host_id,
+                name=container_id,
+                template_digest=tmpl.digest,
+                status=ContainerStatus.pending,
+                created_at=datetime.datetime.utcnow(),
+            ))
+            await adjust_container_count(db, res.host_id, +1)
+            await db.commit()
+        except Exception:
+            placement.release(res)
+            raise
+        placement.confirm(res)
+
+        bundle = SpooledBundle(path=tmpl.storage_path, sha256=tmpl.digest, size=tmpl.size)
+        job = LaunchJob(container_id=container_id, host_id=res.host_id, user_id=None)
+        launch_jobs.submit(job, lambda j: run_launch(j, bundle, discard=False))
+        logger.info("Warming %s on host %s (%s)", tmpl.digest[:12], res.host_id, container_id)
+        return True
+
+    async def _shrink(self, db: AsyncSession, tmpl: ChallengeTemplate, surplus: int):
+        # Only ready environments are removed; in-flight launches finish first
+        stmt = (
+            select(Container)
+            .where(
+                Container.template_digest == tmpl.digest,
+                Container.user_id.is_(None),
+                Container.status == ContainerStatus.running,
+            )
+            .order_by(Container.created_at.desc())
+            .limit(surplus)
+            .with_for_update(skip_locked=True)
+        )
+        for cont in (await db.execute(stmt)).scalars().all():
+            host = await db.get(ContainerHost, cont.host_id)
+            try:
+                await teardown_container(db, cont, host)
+            except Exception as e:
+                logger.warning("Could not drain warm environment %s: %s", cont.id, e)
+                await db.rollback()
+
+
+warm_pool = WarmPool()
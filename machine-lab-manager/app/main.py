@@ -1,16 +1,19 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware 
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import os
 
 from app.api.auth import router as auth_router
 from app.api.users import router as user_router
 from app.api.hosts import router as host_router
 from app.api.containers import router as container_router
+from app.api.templates import router as template_router
 
-from app.core.events import startup as on_startup
+from app.core.config import get_settings
+from app.core.events import startup as on_startup, shutdown as on_shutdown
 from dotenv import load_dotenv
 
 load_dotenv()  # dev convenience
@@ -74,16 +77,29 @@ app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(host_router)
 app.include_router(container_router)
+app.include_router(template_router)
 
 @app.on_event("startup")
 async def app_startup():
     await on_startup()
 
+@app.on_event("shutdown")
+async def app_shutdown():
+    await on_shutdown()
+
 @app.get("/health", tags=["meta"])
 async def health():
     """Health check endpoint to verify the service is running."""
     return {"status": "ok"}
 
+@app.get("/metrics", tags=["meta"], include_in_schema=False)
+async def metrics(authorization: str | None = Header(None)):
+    """Prometheus metrics; with METRICS_TOKEN set, scrapers must send it as a bearer token."""
+    token = get_settings().metrics_token
+    if token and authorization != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Bad metrics token")
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 # Custom OpenAPI schema with better documentation
 def custom_openapi():
@@ -130,6 +146,10 @@ def custom_openapi():
                 "name": "containers",
                 "description": "Container lifecycle management with VPN integration"
             },
+            {
+                "name": "templates",
+                "description": "Content-addressed challenge bundles launched by digest"
+            },
             {
                 "name": "users",
                 "description": "VPN profile management for users and containers"
@@ -161,7 +181,7 @@ def custom_openapi():
     for path_data in openapi_schema["paths"].values():
         for method_data in path_data.values():
             if isinstance(method_data, dict) and "tags" in method_data:
-                if method_data["tags"][0] in ["hosts", "containers", "users"]:
+                if method_data["tags"][0] in ["hosts", "containers", "templates", "users"]:
                     if "/heartbeat" in str(path_data):
                         method_data["security"] = [{"ServerKey": []}]
                     else:
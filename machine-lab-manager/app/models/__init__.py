@@ -2,4 +2,6 @@ from .user import User, UserRole, UserState
 from .api_key import APIKey, APIKeyOwner
 from .vpn_profile import VPNProfile
 from .host import ContainerHost, HostStatus
-from .container import Container, ContainerStatus
\ No newline at end of file
+from .container import Container, ContainerStatus
+from .template import ChallengeTemplate
+from .host_metrics import HostMetricMinute, HostMetricHour
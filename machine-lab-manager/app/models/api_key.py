@@ -14,6 +14,6 @@ class APIKey(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     owner_type = Column(Enum(APIKeyOwner), nullable=False)
     owner_id = Column(UUID(as_uuid=True), nullable=True, index=True, doc="References users.id when owner_type=admin, container_hosts.id when server")
-    key_hash = Column(String, nullable=False)
+    key_hash = Column(String, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
     expires_at = Column(DateTime, nullable=True)
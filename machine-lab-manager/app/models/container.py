@@ -2,7 +2,7 @@ import uuid
 import datetime
 import enum
 
-from sqlalchemy import Column, String, Enum, ForeignKey, DateTime, func
+from sqlalchemy import Column, String, Enum, ForeignKey, DateTime, Index, func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from app.core.database import Base
 
@@ -14,6 +14,10 @@ class ContainerStatus(str, enum.Enum):
 
 class Container(Base):
     __tablename__ = "containers"
+    __table_args__ = (
+        # Keyset pagination of GET /containers/ (newest first)
+        Index("ix_containers_created_at_id", "created_at", "id"),
+    )
 
     id = Column(
         UUID(as_uuid=True),
@@ -23,8 +27,8 @@ class Container(Base):
     )
     user_id = Column(
         UUID(as_uuid=True),
-        nullable=False,
-        doc="Owner user",
+        nullable=True,
+        doc="Owner user (NULL while the environment sits in a warm pool)",
     )
     host_id = Column(
         UUID(as_uuid=True),
@@ -37,6 +41,12 @@ class Container(Base):
         nullable=False,
         doc="Logical name (and Docker container name)",
     )
+    template_digest = Column(
+        String(64),
+        nullable=True,
+        index=True,
+        doc="Challenge template the environment was launched from",
+    )
     status = Column(
         Enum(ContainerStatus, name="containerstatus"),
         nullable=False,
@@ -0,0 +1,41 @@
+from sqlalchemy import Column, DateTime, ForeignKey, PrimaryKeyConstraint, REAL, SmallInteger
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import declared_attr
+from app.core.database import Base
+
+class HostMetricRollup:
+    """Heartbeat CPU/mem aggregated over one interval; one row per host and interval."""
+
+    @declared_attr
+    def __table_args__(cls):
+        # Host first: every read is one host's range of buckets
+        return (PrimaryKeyConstraint("host_id", "bucket"),)
+
+    @declared_attr
+    def host_id(cls):
+        return Column(
+            UUID(as_uuid=True),
+            ForeignKey("container_hosts.id", ondelete="CASCADE"),
+            nullable=False,
+        )
+
+    bucket = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        doc="Start of the interval",
+    )
+    samples = Column(
+        SmallInteger,
+        nullable=False,
+        doc="Heartbeats aggregated into this row",
+    )
+    cpu_avg = Column(REAL, nullable=False)
+    cpu_max = Column(SmallInteger, nullable=False)
+    mem_avg = Column(REAL, nullable=False)
+    mem_max = Column(SmallInteger, nullable=False)
+
+class HostMetricMinute(HostMetricRollup, Base):
+    __tablename__ = "host_metrics_1m"
+
+class HostMetricHour(HostMetricRollup, Base):
+    __tablename__ = "host_metrics_1h"
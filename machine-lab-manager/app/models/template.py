@@ -0,0 +1,48 @@
+import datetime
+
+from sqlalchemy import Column, String, Text, Integer, BigInteger, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from app.core.database import Base
+
+class ChallengeTemplate(Base):
+    __tablename__ = "challenge_templates"
+
+    digest = Column(
+        String(64),
+        primary_key=True,
+        doc="sha256 of the bundle ZIP (content address)",
+    )
+    name = Column(
+        String,
+        nullable=False,
+        index=True,
+        doc="Display name (challenge.yml `name` or the upload filename)",
+    )
+    size = Column(
+        BigInteger,
+        nullable=False,
+        doc="Bundle size in bytes",
+    )
+    storage_path = Column(
+        Text,
+        nullable=False,
+        doc="Filesystem path of the stored bundle",
+    )
+    meta = Column(
+        JSONB,
+        nullable=False,
+        default=dict,
+        doc="Parsed challenge.yml and compose service summary",
+    )
+    warm_pool_size = Column(
+        Integer,
+        nullable=False,
+        default=0,
+        doc="Ready, unassigned environments to keep launched",
+    )
+    created_at = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        doc="When the bundle was first uploaded",
+    )
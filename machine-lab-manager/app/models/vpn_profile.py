@@ -1,11 +1,20 @@
 import uuid
 import datetime
-from sqlalchemy import Column, Text, Boolean, DateTime, String
+from sqlalchemy import Column, Text, Boolean, DateTime, String, Index, LargeBinary, text
 from sqlalchemy.dialects.postgresql import UUID, INET
 from app.core.database import Base
 
 class VPNProfile(Base):
     __tablename__ = "vpn_profiles"
+    __table_args__ = (
+        # An address belongs to at most one active profile
+        Index(
+            "uq_vpn_profiles_active_ip",
+            "ip_address",
+            unique=True,
+            postgresql_where=text("NOT revoked"),
+        ),
+    )
 
     # Primary key for the profile record
     id = Column(
@@ -31,11 +40,26 @@ class VPNProfile(Base):
         doc="Static VPN IP assigned to this client",
     )
 
-    # Path on disk where the .ovpn file lives
+    # Common name of the client certificate bundled in the profile
+    cert_name = Column(
+        String,
+        nullable=True,
+        index=True,
+        doc="CN of the pooled client certificate (NULL: same as client_name)",
+    )
+
+    # Path on disk of the .ovpn copy, written only when config is NULL
     config_path = Column(
         Text,
         nullable=False,
-        doc="Filesystem path to the generated .ovpn",
+        doc="Filesystem path of the .ovpn copy (only written when config is NULL)",
+    )
+
+    # Rendered .ovpn, so downloads and launches skip the filesystem
+    config = Column(
+        LargeBinary,
+        nullable=True,
+        doc="The .ovpn bytes (NULL: only on disk at config_path)",
     )
 
     # Has this profile been revoked/rotated?
@@ -0,0 +1,12 @@
+import os
+
+# Settings are read at import time; the tests never reach a database
+for key, value in {
+    "POSTGRES_USER": "mlab",
+    "POSTGRES_PASSWORD": "mlab",
+    "POSTGRES_DB": "mlab",
+    "JWT_SECRET": "test-secret",
+    "ADMIN_DEFAULT_EMAIL": "admin@example.com",
+    "ADMIN_DEFAULT_PASSWORD": "admin",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from app.internal import cohort
+from app.internal.cohort import CohortLaunch
+from app.models import Container, ContainerStatus
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self._rows
+
+
+class FakeSession:
+    """An AsyncSession that answers each `execute` with the next canned result."""
+
+    def __init__(self, results):
+        self._results = list(results)
+
+    async def execute(self, stmt):
+        return FakeResult(self._results.pop(0) if self._results else [])
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    def add(self, obj):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+async def fake_create_profiles(db, users=(), containers=()):
+    # client_name is a String column: anything else never matches
+    assert all(isinstance(n, str) for n in [*users, *containers])
+    return {
+        n: SimpleNamespace(ip_address=f"10.8.0.{i}")
+        for i, n in enumerate([*users, *containers], start=2)
+    }
+
+
+def test_claims_warm_environment():
+    host = SimpleNamespace(id=uuid.uuid4())
+    warm = Container(
+        id=uuid.uuid4(),
+        host_id=host.id,
+        name="warm",
+        template_digest="ab" * 32,
+        status=ContainerStatus.running,
+    )
+    user_id = uuid.uuid4()
+    launch = CohortLaunch([user_id], bundle=None, template_digest="ab" * 32, discard=False)
+
+    async def scenario():
+        with mock.patch.object(cohort, "warm_pool") as pool, \
+             mock.patch.object(cohort, "SessionLocal", lambda: FakeSession([[host]])), \
+             mock.patch.object(cohort, "create_profiles", fake_create_profiles), \
+             mock.patch.object(cohort, "apply_vpn_rules", mock.AsyncMock()) as rules:
+            await launch.plan(FakeSession([[warm]]))
+            await launch.run()
+            pool.wake.assert_called_once()
+            rules.assert_awaited_once()
+        return [line async for line in launch.stream()]
+
+    lines = asyncio.run(scenario())
+
+    assert warm.user_id == user_id
+    [result] = [json.loads(line) for line in lines]
+    assert result == {
+        "user_id": str(user_id),
+        "container_id": str(warm.id),
+        "host_id": str(host.id),
+        "status": "running",
+        "warm": True,
+        "cache_hit": None,
+        "error": None,
+    }
+
+
+def cold_launch(sessions, firewall_error=None):
+    host = SimpleNamespace(id=uuid.uuid4())
+    launch = CohortLaunch([uuid.uuid4()], bundle=None, template_digest=None, discard=False)
+    sessions = iter(sessions([host]))
+
+    async def scenario():
+        with mock.patch.object(cohort, "placement") as placement, \
+             mock.patch.object(cohort, "adjust_container_count", mock.AsyncMock()), \
+             mock.patch.object(cohort, "SessionLocal", lambda: next(sessions)), \
+             mock.patch.object(cohort, "create_profiles", fake_create_profiles), \
+             mock.patch.object(cohort, "ensure_bundle_on_host", mock.AsyncMock()), \
+             mock.patch.object(cohort, "profile_config", mock.AsyncMock(return_value=b"")), \
+             mock.patch.object(cohort, "start_on_host", mock.AsyncMock(return_value=True)), \
+             mock.patch.object(cohort, "apply_vpn_rules", mock.AsyncMock(side_effect=firewall_error)), \
+             mock.patch.object(cohort, "remove_vpn_profile", mock.AsyncMock()), \
+             mock.patch.object(cohort, "firewall") as firewall, \
+             mock.patch.object(cohort, "request_removal", mock.AsyncMock()) as removal:
+            placement.reserve.return_value = SimpleNamespace(host_id=host.id)
+            await launch.plan(FakeSession([]))
+            await launch.run()
+            lines = [line async for line in launch.stream()]
+        return [json.loads(line) for line in lines], removal, firewall
+
+    results, removal, firewall = asyncio.run(scenario())
+    return launch, host, results, removal, firewall
+
+
+def test_failed_launch_is_removed_from_host():
+    launch, host, [result], removal, firewall = cold_launch(
+        lambda hosts: [FakeSession([hosts]), FakeSession([])], firewall_error=OSError("ipset"),
+    )
+    removal.assert_awaited_once_with(host, launch.members[0].container_id)
+    assert result["status"] == "error"
+    assert result["error"].startswith("Firewall update failed")
+    firewall.request_reconcile.assert_not_called()
+
+
+def test_launch_stopped_meanwhile_is_not_reported_running():
+    # The guarded pending -> running UPDATE returns no ids
+    launch, host, [result], removal, firewall = cold_launch(
+        lambda hosts: [FakeSession([hosts]), FakeSession([[]])],
+    )
+    removal.assert_awaited_once_with(host, launch.members[0].container_id)
+    firewall.request_reconcile.assert_called_once()
+    assert result["status"] == "error"
+    assert result["error"] == "Stopped before the launch finished"
+
+
+def test_failed_plan_returns_warm_claims():
+    warm = Container(
+        id=uuid.uuid4(), host_id=uuid.uuid4(), name="warm",
+        template_digest="ab" * 32, status=ContainerStatus.running,
+    )
+    launch = CohortLaunch([uuid.uuid4()], bundle=None, template_digest="ab" * 32, discard=False)
+    db = FakeSession([[warm]])
+    db.commit = mock.AsyncMock(side_effect=OSError("db down"))
+    db.rollback = mock.AsyncMock()
+
+    async def scenario():
+        with mock.patch.object(cohort, "warm_pool"):
+            await launch.plan(db)
+
+    with pytest.raises(OSError):
+        asyncio.run(scenario())
+    db.commit.assert_awaited_once()   # claims were not committed on their own
+    db.rollback.assert_awaited_once()
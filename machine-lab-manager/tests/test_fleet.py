@@ -0,0 +1,30 @@
+from app.internal.fleet import FleetReconciler, Inventory
+from app.models import ContainerStatus
+
+
+def env(state="running", removing=False):
+    return {"state": state, "removing": removing}
+
+
+def test_diff():
+    inv = Inventory(digest="", fetched_at=0.0, environments={
+        "ok": env(),
+        "died": env("stopped"),
+        "stray": env(),
+        "failed": env(),
+        "failed-removing": env(removing=True),
+    })
+    names = {
+        "ok": ContainerStatus.running,
+        "died": ContainerStatus.running,
+        "failed": ContainerStatus.error,
+        "failed-removing": ContainerStatus.error,
+        "gone": ContainerStatus.running,
+    }
+    running = {"ok": 1, "died": 2, "gone": 3}
+
+    lost, orphaned, failed = FleetReconciler._diff(inv, running, names)
+
+    assert lost == ["died", "gone"]
+    assert orphaned == ["stray"]
+    assert failed == ["failed"]
@@ -0,0 +1,17 @@
+from ipaddress import IPv4Address, IPv4Network
+
+import pytest
+
+from app.internal.ip_pool import AddressPool, PoolExhausted
+
+
+@pytest.mark.parametrize("subnet", ["10.8.0.0/30", "10.8.0.0/25", "10.8.0.0/20"])
+def test_exhaustion_is_reported_by_the_pool(subnet):
+    pool = AddressPool("test", IPv4Network(subnet), set())
+    addresses = {pool.allocate() for _ in range(pool.capacity)}
+    assert len(addresses) == pool.capacity
+    with pytest.raises(PoolExhausted):
+        pool.allocate()
+
+    pool.free(IPv4Address("10.8.0.3"))
+    assert pool.allocate() == "10.8.0.3"
@@ -0,0 +1,62 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from app.internal import launcher
+from app.internal.jobs import LaunchJob
+from app.models import ContainerStatus
+
+
+class FakeSession:
+    def __init__(self, rowcount):
+        self.rowcount = rowcount
+        self.rows = {}
+
+    async def get(self, model, key):
+        return self.rows.get(model.__name__)
+
+    async def execute(self, stmt):
+        return SimpleNamespace(rowcount=self.rowcount)
+
+    async def commit(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def launch(rowcount):
+    host = SimpleNamespace(id=uuid.uuid4())
+    job = LaunchJob(container_id=str(uuid.uuid4()), host_id=host.id, user_id=None)
+    db = FakeSession(rowcount)
+    db.rows = {"Container": SimpleNamespace(), "ContainerHost": host}
+    profile = SimpleNamespace(ip_address="10.8.128.2")
+
+    async def scenario():
+        with mock.patch.object(launcher, "SessionLocal", lambda: db), \
+             mock.patch.object(launcher, "create_or_get_profile", mock.AsyncMock(return_value=profile)), \
+             mock.patch.object(launcher, "profile_config", mock.AsyncMock(return_value=b"")), \
+             mock.patch.object(launcher, "ensure_bundle_on_host", mock.AsyncMock()), \
+             mock.patch.object(launcher, "start_on_host", mock.AsyncMock(return_value=True)), \
+             mock.patch.object(launcher, "request_removal", mock.AsyncMock()) as removal:
+            await launcher._run_launch(job, bundle=None)
+        return removal
+
+    return job, host, asyncio.run(scenario())
+
+
+def test_launch_persists_running():
+    job, _, removal = launch(rowcount=1)
+    assert job.status == ContainerStatus.running
+    removal.assert_not_awaited()
+
+
+def test_launch_stopped_meanwhile_is_cancelled():
+    job, host, removal = launch(rowcount=0)
+    assert job.status == ContainerStatus.stopped
+    assert job.phase == "cancelled"
+    removal.assert_awaited_once_with(host, job.container_id)
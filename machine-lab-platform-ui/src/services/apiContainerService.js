@@ -1,7 +1,15 @@
 import api from './api';
 
-export function listContainer() {
-  return api.get('/containers/');
+// GET /containers/ is paginated; follow next_cursor to collect every page
+export async function listContainer(params = {}) {
+  const containers = [];
+  let cursor = null;
+  do {
+    const res = await api.get('/containers/', { params: { limit: 500, ...params, cursor } });
+    containers.push(...res.data.items);
+    cursor = res.data.next_cursor;
+  } while (cursor);
+  return containers;
 }
 
 export function addContainer(userId, containerData) {